@@ -3,16 +3,22 @@ Tkinter app for iRacing Telemetry logger
 
 Copyright © Kyle Ward 2023
 """
+import sys
+import argparse
 import tkinter as tk
 import customtkinter as ctk
 from gui.main_screen import MainScreen
 from utils.data_bank import DataBank
+from logger.iRTLProcess import CaptureProcess
 
 class iRTLApp(ctk.CTk):
     
     def __init__(self, **kwargs):
         """
         Initialize the app
+
+        Keyword Args:
+            capture_mode (str): "process" (default) to record in a separate process, "thread" to record in a thread of the app
         """
         super().__init__()
         self.geometry("1280x720")
@@ -23,11 +29,38 @@ class iRTLApp(ctk.CTk):
         
         # Create GUI screens
         self.screens = {}
-        self.screens["main"] = MainScreen(root=self, data_bank=self.data_bank)
+        self.screens["main"] = MainScreen(root=self, data_bank=self.data_bank, capture_mode=kwargs.get("capture_mode", "process"))
         self.screens["main"].place(relwidth=1, relheight=1)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        
+    def close(self):
+        """
+        Close the app, saving the recording in progress if any
+        """
+        logger = self.screens["main"].logger
+        if isinstance(logger, CaptureProcess):
+            logger.shutdown()
+        elif self.data_bank.data["is_recording"]:
+            logger.stop()
+        self.destroy()
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    """
+    Parse the app's command line
+    """
+    parser = argparse.ArgumentParser(description="iRacing Telemetry Logger")
+    parser.add_argument("--capture-mode", choices=["process", "thread"], default="process",
+                        help="Record in a separate process (default), or in a thread of the app")
+    return parser.parse_args(argv)
 
 
-# Run app
+# Run app. `python app.py --profile-imports` reports the startup import times instead
 if __name__ == "__main__":
-    app = iRTLApp()
-    app.mainloop()
\ No newline at end of file
+    if "--profile-imports" in sys.argv:
+        from utils.import_profile import main
+        main(sys.argv[1:])
+    else:
+        args = parse_args(sys.argv[1:])
+        app = iRTLApp(capture_mode=args.capture_mode)
+        app.mainloop()
\ No newline at end of file
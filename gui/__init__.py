@@ -4,12 +4,8 @@ GUI module for iRacing Telemetry Logger
 Copyright © Kyle Ward 2023    
 """
 import datetime as dt
-import matplotlib.pyplot as plt
 import customtkinter as ctk
 
-# Set plt to use dark mode
-plt.style.use("dark_background")
-
 ctk.set_appearance_mode("dark") # Dark mode
 ctk.set_default_color_theme("dark-blue") # Dark blue theme
 
@@ -38,3 +34,12 @@ APP_METADATA = {
     "author": "Kyle Ward",
     "copyright": f"Copyright © Kyle Ward {dt.date.today().year}",
 }
+
+
+def apply_plot_style():
+    """
+    Set matplotlib to use dark mode. matplotlib is slow to import, so it is only imported (and
+    styled) by the first tab that draws a plot
+    """
+    import matplotlib.style
+    matplotlib.style.use("dark_background")
@@ -6,17 +6,18 @@ Copyright © Kyle Ward 2023
 import os 
 import sys
 import json
+import time
 import tkinter as tk
 import numpy as np
 import customtkinter as ctk
-from gui import COLORS
+from gui import COLORS, apply_plot_style
 from logger import CHANNELS
 from tkinter import messagebox
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, 
 NavigationToolbar2Tk)
-from logger.iRTLData import iRTLDataProcessor
 from threading import Thread
+from logger.iRTLRing import SampleRing
 
 sys.path.append(os.getcwd())
 from utils.data_bank import DataBank
@@ -29,6 +30,7 @@ class LiveMonitor(ctk.CTkFrame):
         """
         # Initialize frame
         super().__init__(root, **kwargs)
+        apply_plot_style()
         
         # Initialize class vars
         self.root = root
@@ -37,6 +39,13 @@ class LiveMonitor(ctk.CTkFrame):
         self.data_processor = None
         self.figure = None
         self._plot = None
+        self.line = None
+        self.window_size = 600  # Number of latest samples to plot (10 seconds at 60 Hz)
+        self.fps = 15           # Render rate of the live plot in frames per second
+        self.ring = None
+        self.render_job = None
+        self.rendered_count = 0
+        self.render_stats = {}
         
         # UI widgets
         self.widgets = {
@@ -105,44 +114,109 @@ class LiveMonitor(ctk.CTkFrame):
         
     def update_plot(self, val):
         """
-        Update plot with new data
+        Reset the plot when a new channel is selected. The next frame redraws it
+        """
+        if self._plot:
+            self._plot.clear()
+            self.line = None
+    
+    def start_rendering(self, ring: SampleRing):
+        """
+        Start rendering samples from the logger's ring on a Tk timer
+
+        Args:
+            ring (SampleRing): Ring the logger publishes samples to
+        """
+        self.ring = ring
+        self.rendered_count = 0
+        self.render_stats = {
+            "frames": 0,
+            "lag_samples": 0,       # Samples published since the previous frame was rendered
+            "max_lag_samples": 0,
+            "overruns": 0,          # Frames that took longer to render than the frame interval
+        }
+        self.data_bank.data["live_monitor_stats"] = self.render_stats
+        self.schedule_render()
+        
+    def stop_rendering(self, release: bool = False):
+        """
+        Stop the render timer
+
+        Args:
+            release (bool): Also drop the ring, e.g. before a shared memory ring is closed
+        """
+        if self.render_job:
+            self.root.after_cancel(self.render_job)
+            self.render_job = None
+        if release:
+            self.ring = None
+            self.line = None
+            
+    def schedule_render(self):
         """
-        pass #self.plot()
+        Schedule the next frame
+        """
+        self.render_job = self.root.after(int(1000 / self.fps), self.render)
+        
+    def render(self):
+        """
+        Render one frame from the latest samples in the ring, then schedule the next one
+        """
+        start = time.perf_counter()
+        write_count = self.ring.write_count
+        
+        if write_count > self.rendered_count:
+            # Track how far behind the capture thread the renderer is
+            lag = write_count - self.rendered_count
+            self.render_stats["lag_samples"] = lag
+            self.render_stats["max_lag_samples"] = max(lag, self.render_stats["max_lag_samples"])
+            
+            self.plot(write_count)
+            self.rendered_count = write_count
+            self.render_stats["frames"] += 1
             
-    def plot(self):
+            if time.perf_counter() - start > 1.0 / self.fps:
+                self.render_stats["overruns"] += 1
+        
+        self.schedule_render()
+            
+    def plot(self, end: int = None):
         """
         Update plot with new data
+
+        Args:
+            end (int): Sample number to plot up to (defaults to the latest sample)
         """
         # Get the name of the selected channel
         channel_name = self.widgets["inputs"]["string_vars"]["channel_select"].get()
         
-        if channel_name != "":
+        if channel_name != "" and self.ring and channel_name in self.ring:
             # Check if the figure has been created
             if not self.figure:
                 self.figure = Figure(figsize=(15, 7), dpi=100)
 
-            # Get the channel data from the data bank
-            x_axis = self.data_bank.data["live_telemetry"]["time"]["data"]
-            y_axis = self.data_bank.data["live_telemetry"][channel_name]["data"]      
-            
-            # Check if the x and y axis are the same length 
-            if len(x_axis) > len(y_axis):
-                for _ in range(len(x_axis) - len(y_axis)):
-                    y_axis.append(0.0)
+            # Get the latest window of channel data from the ring. Both windows end at the same sample, but the
+            # second may have lost samples the capture thread overwrote in between
+            x_axis = self.ring.window("time", self.window_size, end)
+            y_axis = self.ring.window(channel_name, self.window_size, end)
+            n = min(len(x_axis), len(y_axis))
+            x_axis, y_axis = x_axis[len(x_axis) - n:], y_axis[len(y_axis) - n:]
             
             if not self._plot:
-                # Create plot
+                # Create plot and canvas
                 self._plot = self.figure.add_subplot(111)
-                self._plot.plot(x_axis, y_axis)
-                self._plot.set_xlabel(f"time ({self.data_bank.data['live_telemetry']['time']['unit']})")                    # Set x-axis label
-                self._plot.set_ylabel(f"{channel_name} ({self.data_bank.data['live_telemetry'][channel_name]['unit']})")    # Set y-axis label
-                
-                # Create canvas
                 self.canvas = FigureCanvasTkAgg(self.figure, master=self.widgets["frames"]["plot_frame"])
-                self.canvas.draw()
                 self.canvas.get_tk_widget().pack()
+            
+            if not self.line:
+                # Create line and labels for the selected channel
+                self.line, = self._plot.plot(x_axis, y_axis)
+                self._plot.set_xlabel(f"time ({self.ring.units.get('time', 's')})")                 # Set x-axis label
+                self._plot.set_ylabel(f"{channel_name} ({self.ring.units.get(channel_name, '')})")  # Set y-axis label
             else:
-                self._plot.clear()
-                self._plot.plot(x_axis, y_axis)
-                self._plot.set_ylabel(f"{channel_name} ({self.data_bank.data['live_telemetry'][channel_name]['unit']})")    # Set y-axis label
-                self.canvas.draw()
\ No newline at end of file
+                # Only update the line data instead of rebuilding the plot
+                self.line.set_data(x_axis, y_axis)
+                self._plot.relim()
+                self._plot.autoscale_view()
+            
+            self.canvas.draw_idle()
@@ -11,17 +11,21 @@ from utils.data_bank import DataBank
 from tktooltip import ToolTip
 from logger import CHANNELS
 from functools import partial
-from logger.iRTL import iRacingTelemetryLogger
+from logger.iRTLProcess import CaptureProcess, create_logger
+from logger.iRTLStats import format_stats
 from tkinter import messagebox
-from gui.plotting_tab import PlottingTab
-from gui.live_monitor import LiveMonitor
 
 class MainScreen(ctk.CTkFrame):
     
     def __init__(self, root, data_bank: DataBank, **kwargs):
         """
         Initialize the main screen
+
+        Keyword Args:
+            capture_mode (str): "thread" to record in a thread of the app, "process" to record in a separate process
         """
+        capture_mode = kwargs.pop("capture_mode", "thread")
+        
         # Initialize frame
         super().__init__(root, **kwargs)
         self.root = root
@@ -29,8 +33,13 @@ class MainScreen(ctk.CTkFrame):
         # Set data bank object
         self.data_bank = data_bank
         
-        # Create telemetry logger object
-        self.logger = iRacingTelemetryLogger(self.data_bank)
+        # Create telemetry logger object. In process mode, sampling doesn't share the GIL with the UI
+        # and the UI process doesn't have to import the SDK
+        self.logger = create_logger(self.data_bank, capture_mode)
+        
+        # Plotting and live monitor tabs, built the first time they are shown
+        self.plotting_tab = None
+        self.live_monitor = None
         
         # UI widgets
         self.widgets = {
@@ -47,6 +56,10 @@ class MainScreen(ctk.CTkFrame):
         
         self.channel_categories = [category for category in CHANNELS.keys()]
         
+        # Capture stats panel refresh
+        self.stats_job = None
+        self.stats_interval_ms = 500
+        
         # Font sizes
         self.btn_font_size = 20 
         self.title_font_size = 30
@@ -85,6 +98,16 @@ class MainScreen(ctk.CTkFrame):
             font=("Arial", 12)
         )
         self.widgets["labels"]["version"].place(relx=0.5, rely=0.0575)
+        
+        # Create capture stats panel, filled in while recording
+        self.widgets["labels"]["capture_stats"] = ctk.CTkLabel(
+            self,
+            text="",
+            text_color=COLORS["text_white"],
+            font=("Courier", 10),
+            justify="left"
+        )
+        self.widgets["labels"]["capture_stats"].place(relx=0.185, rely=0.05, anchor="w")
 
         # Create tabs
         self.create_tabs()
@@ -97,7 +120,7 @@ class MainScreen(ctk.CTkFrame):
         Create tabs for each screen
         """
         # Create tab view and place it in the frame
-        self.widgets["tabs"] = ctk.CTkTabview(self.root)
+        self.widgets["tabs"] = ctk.CTkTabview(self.root, command=self.show_tab)
         self.widgets["tabs"].place(relx=0.5, rely=0.55, relwidth=1, relheight=0.9, anchor="center")
         
         # Build buttons
@@ -114,13 +137,26 @@ class MainScreen(ctk.CTkFrame):
         #self.create_home_tab()
         self.create_channels_tab()
         
-        # Create plotting tab
+        # Add the plotting and live monitor tabs. Their contents (and matplotlib) are loaded when first shown
         self.widgets["tabs"].add("Plotting")
-        plotting_tab = PlottingTab(self.widgets["tabs"].tab("Plotting"), self.data_bank)
-        
-        # Create live monitor tab
         self.widgets["tabs"].add("Live Monitor")
-        self.live_monitor = LiveMonitor(self.widgets["tabs"].tab("Live Monitor"), self.data_bank)
+    
+    def show_tab(self):
+        """
+        Build the selected tab if it is shown for the first time
+        """
+        tab = self.widgets["tabs"].get()
+        if tab == "Plotting" and self.plotting_tab is None:
+            from gui.plotting_tab import PlottingTab
+            self.plotting_tab = PlottingTab(self.widgets["tabs"].tab("Plotting"), self.data_bank, open_recordings=self.logger.open_recordings)
+        elif tab == "Live Monitor" and self.live_monitor is None:
+            from gui.live_monitor import LiveMonitor
+            self.live_monitor = LiveMonitor(self.widgets["tabs"].tab("Live Monitor"), self.data_bank)
+            
+            # Render the recording in progress, if any
+            self.logger.live_monitor = self.live_monitor
+            if self.data_bank.data["is_recording"] and self.logger.ring is not None:
+                self.live_monitor.start_rendering(self.logger.ring)
     
     def create_home_tab(self):
         """
@@ -274,7 +310,8 @@ class MainScreen(ctk.CTkFrame):
             self.logger.channels = self.data_bank.enabled_channels()
             
         # Update live monitor channels
-        self.live_monitor.update_channels()
+        if self.live_monitor:
+            self.live_monitor.update_channels()
 
     ###############################################
     
@@ -286,6 +323,51 @@ class MainScreen(ctk.CTkFrame):
         # Add tab tooltips
         pass
         
+    def update_stats_panel(self):
+        """
+        Refresh the capture stats panel, then schedule the next refresh
+        """
+        try:
+            stats = self.logger.publish_stats()
+        except Exception as e:
+            print(f"WARNING: Failed to read capture stats: {e}")
+            stats = {}
+        self.widgets["labels"]["capture_stats"].configure(text=format_stats(stats, self.data_bank.data["live_monitor_stats"]))
+        self.stats_job = self.after(self.stats_interval_ms, self.update_stats_panel)
+    
+    def stop_stats_panel(self):
+        """
+        Stop refreshing the capture stats panel and clear it
+        """
+        if self.stats_job:
+            self.after_cancel(self.stats_job)
+            self.stats_job = None
+        self.widgets["labels"]["capture_stats"].configure(text="")
+        
+    def poll_stop(self):
+        """
+        Check whether the capture process has saved the recording, and check again later until it has
+        """
+        try:
+            if self.logger.poll_stop() is None:
+                self.after(100, self.poll_stop)
+                return
+        except Exception as e:
+            messagebox.showerror("Error", f"ERROR: Failed to save the recording: {e}")
+        self.show_stopped()
+    
+    def show_stopped(self):
+        """
+        Show the logger as not recording
+        """
+        # Reconfigure record status label and image
+        self.widgets["labels"]["record_status"].configure(text="Not recording")
+        self.widgets["images"]["record_status"].configure(light_image=Image.open("images/circle.png"), dark_image=Image.open("images/circle.png"), size=(35, 35))
+        self.widgets["labels"]["record_status_image"] = ctk.CTkLabel(self, text="", image=self.widgets["images"]["record_status"])
+        
+        # Reconfigure record button
+        self.widgets["buttons"]["btn_toggle_record"].configure(text="Start recording", fg_color=COLORS["text_blue"], state="normal")
+        
     def toggle_recording(self):
         """
         Toggle telemetry recording 
@@ -295,15 +377,16 @@ class MainScreen(ctk.CTkFrame):
         if self.data_bank.data["is_recording"]:
             # Stop recording
             self.data_bank.data["is_recording"] = False
-            self.logger.stop()
-            
-            # Reconfigure record status label and image
-            self.widgets["labels"]["record_status"].configure(text="Not recording")
-            self.widgets["images"]["record_status"].configure(light_image=Image.open("images/circle.png"), dark_image=Image.open("images/circle.png"), size=(35, 35))
-            self.widgets["labels"]["record_status_image"] = ctk.CTkLabel(self, text="", image=self.widgets["images"]["record_status"])
-            
-            # Reconfigure record button
-            self.widgets["buttons"]["btn_toggle_record"].configure(text="Start recording", fg_color=COLORS["text_blue"])
+            self.stop_stats_panel()
+            if isinstance(self.logger, CaptureProcess):
+                # The capture process saves the recording while the UI stays responsive
+                self.logger.stop(wait=False)
+                self.widgets["labels"]["record_status"].configure(text="Saving...")
+                self.widgets["buttons"]["btn_toggle_record"].configure(state="disabled")
+                self.after(100, self.poll_stop)
+            else:
+                self.logger.stop()
+                self.show_stopped()
         else:
             # Start recording
             self.data_bank.data["is_recording"] = True
@@ -313,6 +396,9 @@ class MainScreen(ctk.CTkFrame):
                 messagebox.showerror("Error", "ERROR: Failed to connect to the iRacing SDK. Please ensure that the iRacing simulator is running and try again.")
                 return
             
+            # Show live capture stats while recording
+            self.update_stats_panel()
+            
             # Reconfigure record status label and image
             self.widgets["labels"]["record_status"].configure(text="Recording")
             self.widgets["images"]["record_status"].configure(light_image=Image.open("images/recording.png"), dark_image=Image.open("images/recording.png"), size=(40, 40))
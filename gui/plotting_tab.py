@@ -6,10 +6,10 @@ Copyright © Kyle Ward 2023
 import os 
 import sys
 import json
+import threading
 import tkinter as tk
-import numpy as np
 import customtkinter as ctk
-from gui import COLORS
+from gui import COLORS, apply_plot_style
 from logger import CHANNELS
 from tkinter import messagebox
 from tkinter import filedialog as fd
@@ -17,6 +17,7 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, 
 NavigationToolbar2Tk)
 from logger.iRTLData import iRTLDataProcessor
+from logger.iRTLCatalog import SessionCatalog
 
 sys.path.append(os.getcwd())
 from utils.data_bank import DataBank
@@ -26,9 +27,15 @@ class PlottingTab(ctk.CTkFrame):
     def __init__(self, root, data_bank: DataBank, **kwargs):
         """
         Initialize the plotting tab frame
+
+        Keyword Args:
+            open_recordings (callable): Returns the recordings the logger is still writing, which aren't catalogued yet
         """
+        self.open_recordings = kwargs.pop("open_recordings", list)
+        
         # Initialize frame
         super().__init__(root, **kwargs)
+        apply_plot_style()
         
         # Initialize class vars
         self.root = root
@@ -37,6 +44,8 @@ class PlottingTab(ctk.CTkFrame):
         self.data_processor = None
         self.figure = None
         self._plot = None
+        self.sessions = {}          # Session dropdown label: recording path
+        self.scan_thread = None
         
         # UI widgets
         self.widgets = {
@@ -67,6 +76,86 @@ class PlottingTab(ctk.CTkFrame):
         # File select button
         self.widgets["buttons"]["file_select"] = ctk.CTkButton(self.root, text="Select Telemetry File", command=self.select_file, font=("Arial", self.btn_font_size))
         self.widgets["buttons"]["file_select"].grid(row=0, column=0, padx=10, pady=10)     
+        
+        # Export to JSON button
+        self.widgets["buttons"]["export_json"] = ctk.CTkButton(self.root, text="Export JSON", command=self.export_json, font=("Arial", self.btn_font_size))
+        self.widgets["buttons"]["export_json"].grid(row=0, column=2, padx=10, pady=10)
+        
+        # Session select dropdown, listed from the session catalog and refreshed once new recordings are indexed
+        self.widgets["inputs"]["string_vars"]["selected_session"] = tk.StringVar(self.root, value="Recent Sessions")
+        self.widgets["inputs"]["session_dropdown"] = ctk.CTkComboBox(self.root, values=[], command=self.select_session, font=("Arial", self.btn_font_size),
+                                                                     state="readonly", width=320, variable=self.widgets["inputs"]["string_vars"]["selected_session"])
+        self.widgets["inputs"]["session_dropdown"].grid(row=0, column=3, padx=10, pady=10)
+        self.list_sessions()
+        self.scan_sessions()
+    
+    def list_sessions(self):
+        """
+        List the catalogued sessions in the session dropdown, newest first
+        """
+        try:
+            with SessionCatalog() as catalog:
+                recordings = [recording for recording in catalog.recordings() if not recording["error"]]
+        except Exception as e:
+            print(f"WARNING: Could not read the session catalog: {e}")
+            return
+        
+        self.sessions = {}
+        for recording in recordings:
+            label = f"{recording['recorded_at'][:16].replace('T', ' ')}  {recording['track'] or os.path.basename(recording['path'])}  ({recording['n_laps']} laps)"
+            self.sessions[label] = recording["path"]
+        self.widgets["inputs"]["session_dropdown"].configure(values=list(self.sessions))
+    
+    def scan_sessions(self):
+        """
+        Index new and changed recordings in the background, then refresh the session list
+        """
+        if self.scan_thread and self.scan_thread.is_alive():
+            return
+        skip = self.open_recordings()
+        
+        def scan():
+            try:
+                with SessionCatalog() as catalog:   # SQLite connections can't be shared between threads
+                    catalog.scan(skip=skip)
+            except Exception as e:
+                print(f"WARNING: Could not index the recordings: {e}")
+        
+        self.scan_thread = threading.Thread(target=scan, daemon=True)
+        self.scan_thread.start()
+        self.root.after(500, self.__poll_scan)
+    
+    def __poll_scan(self):
+        if self.scan_thread.is_alive():
+            self.root.after(500, self.__poll_scan)
+        else:
+            self.list_sessions()
+    
+    def select_session(self, label: str):
+        """
+        Plot a session selected from the catalog
+        """
+        path = self.sessions.get(label)
+        if not path or not os.path.exists(path):
+            messagebox.showerror("Telemetry File Error", "The selected recording no longer exists.")
+            self.scan_sessions()
+            return
+        self.load_file(path)
+    
+    def export_json(self):
+        """
+        Export the selected .irtl recording to the legacy JSON format
+        """
+        if not self.data_processor or not self.data_processor.file:
+            messagebox.showinfo("Export JSON", "Select an .irtl telemetry file to export.")
+            return
+        
+        # Prompt user for the output file
+        filename = fd.asksaveasfilename(title="Export Telemetry File", defaultextension=".json", filetypes=[("JSON", "*.json")], initialdir=os.getcwd() + "\\data\\outputs")
+        if not filename:
+            return
+        
+        self.data_processor.file.export_json(filename)
     
     def __validate_telemetry_data(self, data):
         # Check that the file contains at least one of the telemetry channels
@@ -94,21 +183,31 @@ class PlottingTab(ctk.CTkFrame):
         """
         
         # Prompt user to select a telemetry file
-        filename = fd.askopenfilename(title="Select Telemetry File", filetypes=[("JSON", "*.json")], initialdir=os.getcwd() + "\\data\\outputs")
+        filename = fd.askopenfilename(title="Select Telemetry File", filetypes=[("iRTL", "*.irtl"), ("JSON", "*.json")], initialdir=os.getcwd() + "\\data\\outputs")
         
         if not filename:
             return
+        self.load_file(filename)
+    
+    def load_file(self, filename: str):
+        """
+        Load a telemetry file to plot
+        
+        Args:
+            filename (str): Path to the recording (.irtl or .json)
+        """
         
-        # Read the file
-        with open(filename, "r") as file:
-            data = json.load(file)
+        # Create data processor. Channel data are only read when plotted
+        data_processor = iRTLDataProcessor(filename, align=True)   # Plot every channel against the same timebase
+        data = data_processor.data
         
         # Validate the data
         if not self.__validate_telemetry_data(data):
+            data_processor.close()
             return
-        
-        # Create data processor
-        self.data_processor = iRTLDataProcessor(filename)
+        if self.data_processor:
+            self.data_processor.close()     # Free the previous recording's share of the cache and release its file
+        self.data_processor = data_processor
         
         # Extract just the telemetry data
         self.data = {
@@ -118,9 +217,11 @@ class PlottingTab(ctk.CTkFrame):
             for channel in CHANNELS[category]:
                 if channel in data:
                     self.data[channel] = self.data_processor.data[channel]
+        for channel in self.data_processor.derived:
+            self.data[channel] = self.data_processor.data[channel]
         
         # Remove path from filename
-        filename = filename.split("/")[-1]
+        filename = os.path.basename(filename)
         
         # Check if telemetry file label exists
         if not "telemetry_file" in self.widgets["labels"]:
@@ -166,11 +267,9 @@ class PlottingTab(ctk.CTkFrame):
         # Create selected lap string var
         self.widgets["inputs"]["string_vars"]["selected_lap"] = tk.StringVar(self.root, value="All Laps")
         
-        # Get number of laps and create lap choices
-        n_laps = np.max(self.data["Lap"]["data"])
-        lap_numbers = np.arange(0, n_laps+1)
-        lap_choices = ["All Laps"]
-        for lap in lap_numbers:
+        # Create lap choices, one per lap in the recording's lap index
+        lap_choices = ["All Laps", "Overlay Laps"]
+        for lap in range(len(self.data_processor.laps)):
             lap_choices.append(f"Lap {lap+1}")
         
         # Create lap select dropdown    
@@ -234,18 +333,30 @@ class PlottingTab(ctk.CTkFrame):
         y_axis_name = self.widgets["inputs"]["string_vars"]["y_axis"].get()
         
         # Check lap selection
-        if not lap == "All Laps":
+        if lap == "Overlay Laps":
+            # Overlay every lap of the y axis channel against distance around the lap, resampled in one pass.
+            # Recordings without LapDistPct are overlaid against LapDist in meters
+            x_axis_name = "LapDistPct" if "LapDistPct" in self.data else "LapDist"
+            try:
+                overlay = self.data_processor.resample_laps([y_axis_name], distance=x_axis_name, scaled=True)
+            except Exception as e:
+                messagebox.showerror("Overlay Error", str(e))
+                return
+            x_axis = overlay["distance"] * 100 if x_axis_name == "LapDistPct" else overlay["distance"]
+            y_axis = overlay[y_axis_name].T
+            
+        elif not lap == "All Laps":
             # Get lap number
             lap_number = int(lap.split(" ")[-1])
             
-            # Get x and y axis data
-            x_axis = self.data_processor.get_channel_data_for_lap(x_axis_name, lap_number-1)
-            y_axis = self.data_processor.get_channel_data_for_lap(y_axis_name, lap_number-1)
+            # Get x and y axis data. Percentages are plotted 0-100 to match their unit; the scaled channels are cached
+            x_axis = self.data_processor.get_channel_data_for_lap(x_axis_name, lap_number-1, scaled=True)
+            y_axis = self.data_processor.get_channel_data_for_lap(y_axis_name, lap_number-1, scaled=True)
             
         else:
             # Get x and y axis data for the entire stint
-            x_axis = self.data_processor.get_channel_data(x_axis_name)
-            y_axis = self.data_processor.get_channel_data(y_axis_name)
+            x_axis = self.data_processor.get_channel_data(x_axis_name, scaled=True)
+            y_axis = self.data_processor.get_channel_data(y_axis_name, scaled=True)
             
         
         if not self._plot:
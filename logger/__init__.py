@@ -7,9 +7,11 @@ import os
 import sys
 
 sys.path.append(os.getcwd())
-from utils.data_utils import parse_irsdk_vars
+from utils.data_utils import load_irsdk_vars
 
-SDK_VARS = parse_irsdk_vars(os.getcwd() + "\\data\\irsdk_vars.txt")
+# Catalog of every SDK variable, keyed by name. Loaded from a cache once per process and shared
+# by CHANNELS, the DataBank and the logger
+SDK_VARS = load_irsdk_vars(os.path.join(os.getcwd(), "data", "irsdk_vars.txt"))
 
 # Data channels
 CHANNELS = {
@@ -141,4 +143,118 @@ CHANNELS = {
     }
     
     # TODO: Add session category and hardware stats category
-}
\ No newline at end of file
+}
+
+for category, channels in CHANNELS.items():
+    for channel in channels:
+        SDK_VARS[channel]["category"] = category
+
+# Sampling rate tiers
+#
+# Channels are sampled on every sim tick unless their category or the channel itself is listed
+# below. Rates are in Hz, or RATE_ON_CHANGE to store a sample only when the value changes. Each
+# tier is stored with its own timebase (see iRacingTelemetryLogger.create_store())
+RATE_ON_CHANGE = "change"
+
+CATEGORY_RATES = {
+    # category: rate
+    "environment": 1,
+}
+
+CHANNEL_RATES = {
+    # channel: rate (overrides the category rate)
+    "LFcoldPressure": 1,
+    "LRcoldPressure": 1,
+    "RFcoldPressure": 1,
+    "RRcoldPressure": 1,
+    "LFwearL": 1,
+    "LFwearM": 1,
+    "LFwearR": 1,
+    "LRwearL": 1,
+    "LRwearM": 1,
+    "LRwearR": 1,
+    "RFwearL": 1,
+    "RFwearM": 1,
+    "RFwearR": 1,
+    "RRwearL": 1,
+    "RRwearM": 1,
+    "RRwearR": 1,
+    "LapBestLap": RATE_ON_CHANGE,
+    "LapBestLapTime": RATE_ON_CHANGE,
+    "LapLastLapTime": RATE_ON_CHANGE,
+    "RaceLaps": RATE_ON_CHANGE,
+    "PlayerCarPosition": RATE_ON_CHANGE,
+}
+
+
+def channel_rates() -> dict:
+    """
+    Get the sampling rate of every channel that isn't sampled on every tick
+
+    Returns:
+        dict: {channel_name: rate}
+    """
+    rates = {}
+    for category, rate in CATEGORY_RATES.items():
+        for channel in CHANNELS[category]:
+            rates[channel] = rate
+    rates.update(CHANNEL_RATES)
+    return rates
+
+
+# Compression of recordings made from the app (see iRacingTelemetryLogger). Recordings are compressed
+# when they are compacted, so capturing costs the same as raw recordings
+APP_COMPRESSION = "zlib"
+
+# Decimal places kept for float channels of each unit. Recorded values are quantized to this
+# precision and stored as compressed integer deltas (see iRTLFile.encode_delta()). Units not
+# listed use iRacingTelemetryLogger.data_precison
+UNIT_PRECISION = {
+    "%": 4,         # 0-1 fractions, 0.01% resolution
+    "rad": 4,
+    "rad/s": 4,
+    "m": 4,         # Shock deflection in 0.1 mm
+    "m/s": 3,
+    "m/s^2": 3,
+    "s": 3,
+    "C": 2,
+    "V": 2,
+    "kPa": 2,
+    "N*m": 2,
+    "revs/min": 1,
+    "RPM": 1,
+}
+
+
+# Derived channels, computed from recorded channels when a recording is analysed (see logger.iRTLExpr).
+# Expressions see recorded values, so percentages are 0-1 fractions. Channels whose inputs weren't recorded
+# are skipped. Users can add or override channels in DERIVED_CHANNELS_FILE
+DERIVED_CHANNELS = {
+    **{
+        f"{tire}tempCAvg": {
+            "expression": f"mean({tire}tempCL, {tire}tempCM, {tire}tempCR)",
+            "unit": "C",
+            "desc": f"{tire} tire average carcass temperature",
+        }
+        for tire in ["LF", "RF", "LR", "RR"]
+    },
+    "BrakeBiasFront": {
+        "expression": "(LFbrakeLinePress + RFbrakeLinePress) / (LFbrakeLinePress + RFbrakeLinePress + LRbrakeLinePress + RRbrakeLinePress)",
+        "unit": "%",
+        "desc": "Share of brake line pressure at the front",
+    },
+    "SideslipAngle": {
+        "expression": "degrees(atan2(VelocityY, VelocityX)) if Speed > 5 else 0",
+        "unit": "deg",
+        "desc": "Angle between the car's heading and its direction of travel",
+    },
+    **{
+        f"{corner}shockVelCalc": {
+            "expression": f"deriv({corner}shockDefl)",
+            "unit": "m/s",
+            "desc": f"{corner} shock velocity from shock deflection",
+        }
+        for corner in ["LF", "RF", "LR", "RR"]
+    },
+}
+DERIVED_CHANNELS_FILE = os.path.join(os.getcwd(), "data", "derived_channels.json")
@@ -5,42 +5,96 @@ Copyright © Kyle Ward 2023
 """
 import os
 import sys
-import json
 import time
-import irsdk    # iRacing SDK
-import pandas as pd
+import numpy as np
 from datetime import datetime
 from threading import Thread
+from typing import TYPE_CHECKING
 
 sys.path.append(os.getcwd())
-from utils.data_utils import parse_irsdk_vars
 from utils.data_bank import DataBank
-from gui.live_monitor import LiveMonitor
+from utils.data_utils import apply_sdk_types
+from logger import SDK_VARS, channel_rates, UNIT_PRECISION
+from logger.iRTLCapture import TickScheduler, CapturePlan, RateTier, SegmentDetector
+from logger.iRTLStore import SampleStore, sdk_dtype
+from logger.iRTLFile import iRTLFileWriter
+from logger.iRTLRing import SampleRing, create_shared_ring, release_shared_ring
+from logger.iRTLSession import RecordingIndex, index_path, segment_path
+from logger.iRTLStats import CaptureStats, write_stats
+
+if TYPE_CHECKING:
+    from gui.live_monitor import LiveMonitor
 
 class iRacingTelemetryLogger:
     
     def __init__(self, data_bank: DataBank, **kwargs):
         """
         Initialize the logger
+
+        Keyword Args:
+            channels (list): Channels to record
+            ir_sdk (irsdk.IRSDK): SDK source to record from (e.g. a ReplaySDK). Defaults to the live sim
+            output_dir (str): Directory recordings are written to
+            polling_rate_hz (int): Sampling rate in Hz. None samples every frame the source publishes
+            channel_rates (dict): {channel_name: rate} for channels sampled less often than every tick (see logger.CHANNEL_RATES). {} samples every channel on every tick
+            compression (str): None (default) to store raw samples, with step-like channels as runs. Recordings are compacted to one
+                               contiguous block per channel when they close, and channels are read as zero-copy views into the
+                               memory-mapped file. "zlib" or "lzma" quantize and compress each channel when the recording is
+                               compacted, typically over ten times smaller, but each channel is decompressed when first read.
+                               The app records with logger.APP_COMPRESSION
+            shared_ring (bool): Place the live sample ring in shared memory so other processes can read it (see logger.iRTLProcess)
+            segment (bool): Split recordings into one file per session, described by an index file (see logger.iRTLSession). Defaults to True
+            instrument (bool): Time every poll and publish capture stats to the data bank while recording. Defaults to True
+            stats_file (bool): Write the capture stats to a <recording>.stats.json sidecar file when recording stops
         """
-        self.ir_sdk = irsdk.IRSDK()
-        self.data_dir = os.getcwd() + "\\data"
-        self.sdk_vars = parse_irsdk_vars(self.data_dir + "\\irsdk_vars.txt")
-        self.output_dir = self.data_dir + "\\outputs"
+        self.ir_sdk = kwargs.get("ir_sdk")
+        if self.ir_sdk is None:
+            import irsdk    # iRacing SDK
+            self.ir_sdk = irsdk.IRSDK()
+        self.data_dir = os.path.join(os.getcwd(), "data")
+        self.sdk_vars = SDK_VARS
+        self.output_dir = kwargs.get("output_dir", os.path.join(self.data_dir, "outputs"))
         self.recording = False
-        self.polling_rate_hz = 60
-        self.polling_rate = 1.0 / self.polling_rate_hz    # Polling rate in seconds; 
-        self.data_precison = 3      # Number of decimal places to round data to
+        self.stats = {}         # Capture stats of the last recording
+        self.polling_rate_hz = kwargs.get("polling_rate_hz", 60)
+        self.polling_rate = 1.0 / self.polling_rate_hz if self.polling_rate_hz else 0.0   # Polling rate in seconds; 
+        self.data_precison = 3      # Number of decimal places to round data to (see logger.UNIT_PRECISION)
+        self.time_precision = 6     # Number of decimal places kept for session times
+        self.compression = kwargs.get("compression")
         self.data_err_code = 0  # Error code for failed data retrieval from sim
         self.data_bank = data_bank
         self.live_monitor = None
+        self.scheduler = TickScheduler(self.ir_sdk, self.polling_rate_hz)
+        self.store = None       # Sample buffers, created when recording starts
+        self.chunk_size = 4096  # Samples per store chunk, also the size of each chunk flushed to disk
+        self.writer = None      # Background file writer of the current segment, created when recording starts
+        self.writers = []       # Writers of every segment of the current recording
+        self.ring = None        # Latest samples published to the live monitor
+        self.ring_capacity = 4096
+        self.shared_ring = kwargs.get("shared_ring", False)
+        self.ring_shm = None    # Shared memory block holding the ring, if shared
+        self.recording_path = None  # File of the first segment, which names the recording
+        self.output_path = None     # File of the current segment
+        self.segment = kwargs.get("segment", True)
+        self.detector = None    # Session boundary detector, created when recording starts if segmenting
+        self.index = None       # Segment index of the current recording
+        self.channel_rates = kwargs.get("channel_rates", channel_rates())
+        self.tiers = []         # Lower rate channel tiers, created when recording starts
+        self.capture_stats = CaptureStats() if kwargs.get("instrument", True) else None
+        self.stats_interval = 0.5   # Seconds between capture stats published to the data bank
+        self.stats_file = kwargs.get("stats_file", False)
+        self.start_time = None
         
-        # Create dictionary to store telemetry data
+        # Create dictionary to store telemetry channel info
         self.data = {
-            # channel_name: {"desc": str, "unit": str, "data": []}
-            "time": {"desc": "Session time", "unit": "s", "data": []}
+            # channel_name: {"desc": str, "unit": str}
+            "time": {"desc": "Session time", "unit": "s"},
+            "tick": {"desc": "Session tick", "unit": ""}
         }
         
+        # SDK variables that back the internal channels
+        self.sdk_names = {"time": "SessionTime", "tick": "SessionTick"}
+        
         default_channels = ["Lap", "LapDist"]
         
         # Check if list of channels to record is provided
@@ -72,19 +126,14 @@ class iRacingTelemetryLogger:
             if not channel in self.data:
                 self.data[channel] = {
                     "desc": _var["desc"],
-                    "unit": _var["unit"],
-                    "data": []
+                    "unit": _var["unit"]
                 }
     
     def channel_exists(self, channel: str) -> bool:
         """
         Check if a channel exists in the session data
         """
-        for var in self.sdk_vars:
-            if var["name"] == channel:
-                return True
-            
-        return False
+        return channel in self.sdk_vars
     
     def update_channels(self):
         """
@@ -99,13 +148,89 @@ class iRacingTelemetryLogger:
             if not channel in self.data:
                 self.data[channel] = {
                     "desc": _var["desc"],
-                    "unit": _var["unit"],
-                    "data": []
+                    "unit": _var["unit"]
                 }
     
-    def start(self, live_monitor: LiveMonitor):
+    def create_store(self):
+        """
+        Create the sample stores for the current channels
+
+        Channels sampled on every tick go in self.store. Lower rate channels are split into one
+        tier per rate (see self.channel_rates), each with its own store and time channel
+        """
+        channels = {}
+        tier_channels = {}  # rate: {channel_name: channel}
+        for channel_name, channel in self.data.items():
+            sdk_name = self.sdk_names.get(channel_name, channel_name)
+            channel = {**channel, "dtype": sdk_dtype(self.ir_sdk, sdk_name), "precision": self.__precision(channel_name, channel["unit"])}
+            rate = self.channel_rates.get(channel_name)
+            if rate is None or channel_name in self.sdk_names:
+                channels[channel_name] = channel
+            else:
+                tier_channels.setdefault(rate, {})[channel_name] = channel
+        
+        self.store = SampleStore(channels, chunk_size=self.chunk_size)
+        self.sdk_read_names = [self.sdk_names.get(name, name) for name in self.store.names]
+        self.time_col = self.store.names.index("time")
+        
+        # Resolve every channel to its place in the SDK var buffer once, instead of on every tick
+        self.plan = CapturePlan(self.ir_sdk, self.sdk_read_names, self.data_err_code)
+        missing = list(self.plan.missing)
+        
+        # Lower rate tiers. Each tier stores the session time it was sampled at in its own time channel
+        self.tiers = []
+        for rate, tier in tier_channels.items():
+            time_channel = f"time_{RateTier.label(rate)}"
+            tier = {
+                time_channel: {"desc": f"Session time ({RateTier.label(rate)} channels)", "unit": "s", "dtype": sdk_dtype(self.ir_sdk, "SessionTime"), "precision": self.time_precision},
+                **tier,
+            }
+            for channel in tier.values():
+                channel["timebase"] = time_channel
+            
+            # Slow tiers fill chunks slowly, so they use smaller ones. Only the tier's own channels are
+            # decoded; its time channel is the session time the base plan already decoded
+            store = SampleStore(tier, chunk_size=max(64, self.chunk_size // 16))
+            plan = CapturePlan(self.ir_sdk, [name for name in store.names if name != time_channel], self.data_err_code)
+            missing.extend(plan.missing)
+            self.tiers.append(RateTier(rate, store, plan, time_channel))
+            
+        # Session boundaries start a new segment file
+        self.detector = SegmentDetector(self.ir_sdk) if self.segment else None
+        self.lap_col = self.store.names.index("Lap") if "Lap" in self.store else None
+        
+        if missing:
+            print(f"WARNING: Channels not provided by the SDK will be recorded as {self.data_err_code}: {missing}")
+        
+        # Publish samples to the UI through a bounded ring so rendering never blocks capture. Lower
+        # rate channels hold their latest sample in the ring so every channel can be monitored
+        ring_names = list(self.store.names)
+        self.tier_slices = []
+        for tier in self.tiers:
+            self.tier_slices.append(slice(len(ring_names), len(ring_names) + len(tier.names)))
+            ring_names.extend(tier.names)
+        units = {name: channel["unit"] for name, channel in self.data.items()}
+        if self.shared_ring:
+            self.ring, self.ring_shm = create_shared_ring(ring_names, capacity=self.ring_capacity, units=units)
+        else:
+            self.ring = SampleRing(ring_names, capacity=self.ring_capacity, units=units)
+        self.live_row = np.zeros(len(ring_names), dtype=np.float64)
+        self.data_bank.data["live_telemetry"] = self.ring
+    
+    def __precision(self, channel: str, unit: str) -> int:
+        """
+        Number of decimal places recorded for a float channel
+        """
+        if channel == "time":
+            return self.time_precision
+        return UNIT_PRECISION.get(unit, self.data_precison)
+    
+    def start(self, live_monitor: "LiveMonitor" = None):
         """
         Start the telemetry logger
+
+        Args:
+            live_monitor (LiveMonitor): Live monitor to render samples to, if any
         """
         if not self.live_monitor:
             self.live_monitor = live_monitor
@@ -117,21 +242,174 @@ class iRacingTelemetryLogger:
             print("\nERROR: Failed to connect to the iRacing SDK. Please ensure that the iRacing simulator is running\n")
             return False
         
+        # The var file doesn't list types; use the ones the connected SDK reports
+        apply_sdk_types(self.sdk_vars, self.ir_sdk)
+        
         # Update channels in data dictionary
         self.update_channels()
         
+        # Create sample buffers typed from the SDK var headers
+        self.create_store()
+        
+        # Stream sealed chunks to disk while recording
+        self.recording_path = os.path.join(self.output_dir, self.__filename())
+        self.metadata = {"polling_rate_hz": self.polling_rate_hz, "channel_rates": {tier.time_channel: tier.rate for tier in self.tiers}, **self.__car_and_track()}
+        self.writers = []
+        self.index = RecordingIndex(index_path(self.recording_path), self.metadata) if self.segment else None
+        for store in self.stores:
+            store.retain(2)    # Only the latest chunks are needed in memory for the live monitor
+        self.__open_segment("start")
+        
         # Start the telemetry logger
         self.recording = True
+        self.scheduler.reset()
+        self.start_time = time.perf_counter()
+        if self.capture_stats:
+            self.capture_stats.reset()
         self.telemetry_thread = Thread(target=self.run) 
         self.telemetry_thread.start()
+        
+        # Render the live monitor on the UI thread's own timer
+        if self.live_monitor:
+            self.live_monitor.start_rendering(self.ring)
         return True
              
+    @property
+    def stores(self) -> list:
+        """
+        Sample stores of every timebase, the base store first
+        """
+        return [self.store] + [tier.store for tier in self.tiers]
+    
+    def __session_type(self, session_num: int) -> str:
+        """
+        Type of a session (e.g. "Practice", "Race") from the session info, if the SDK provides it
+        """
+        try:
+            return self.ir_sdk["SessionInfo"]["Sessions"][session_num]["SessionType"]
+        except (KeyError, IndexError, TypeError):
+            return None
+    
+    def __car_and_track(self) -> dict:
+        """
+        Track and car being driven, from the session info, if the SDK provides them
+        """
+        info = {}
+        try:
+            info["track"] = self.ir_sdk["WeekendInfo"]["TrackDisplayName"]
+        except (KeyError, IndexError, TypeError):
+            pass
+        try:
+            driver_info = self.ir_sdk["DriverInfo"]
+            info["car"] = driver_info["Drivers"][driver_info["DriverCarIdx"]]["CarScreenName"]
+        except (KeyError, IndexError, TypeError):
+            pass
+        return info
+
+    def __open_segment(self, reason: str):
+        """
+        Start writing a new segment file
+        
+        Args:
+            reason (str): Why the segment was started (see SegmentDetector.check())
+        """
+        self.output_path = segment_path(self.recording_path, len(self.writers) + 1)
+        channels = {}
+        for store in self.stores:
+            channels.update(store.meta)
+        on_close = self.index.finish_segment if self.index else None
+        self.writer = iRTLFileWriter(self.output_path, channels, metadata=self.metadata, compression=self.compression, on_close=on_close)
+        self.writers.append(self.writer)
+        for store in self.stores:
+            store.on_seal = self.writer.write_chunk
+        
+        if self.index:
+            session = self.detector.plan.snapshot()    # Empty if the SDK has no session number
+            session_num = session[0] if session else None
+            self.index.add_segment(self.output_path, reason, session_num, self.__session_type(session_num) if session_num is not None else None)
+    
+    def __close_segment(self) -> dict:
+        """
+        Queue the current segment's last partial chunks and footer. Everything else is already on
+        disk, so this doesn't depend on how long the segment was
+        
+        Returns:
+            dict: Capture stats stored in the segment
+        """
+        stats = self.scheduler.stats()
+        stats["tier_samples"] = {tier.name: tier.store.n_samples for tier in self.tiers}
+        stats["segments"] = len(self.writers)
+        if self.capture_stats:
+            stats.update(self.capture_stats.summary())
+        for store in self.stores:
+            store.flush()
+        self.writer.close(index={"capture": stats})
+        return stats
+    
+    def __roll_segment(self, reason: str, session_time: float):
+        """
+        Finish the current segment and start a new one at a session boundary
+        """
+        print(f"New session segment at session time {session_time:.1f} s ({reason})")
+        self.__close_segment()
+        for store in self.stores:
+            store.reset()
+        for tier in self.tiers:
+            tier.reset()
+        self.__open_segment(reason)
+    
+    def stats_snapshot(self) -> dict:
+        """
+        Get the current capture stats: scheduler counters, poll durations, writer queue depth,
+        write rate and the memory held by the sample buffers
+        """
+        elapsed = time.perf_counter() - self.start_time if self.start_time else 0.0
+        bytes_written = sum(writer.bytes_written for writer in self.writers)
+        stats = self.scheduler.stats()
+        if self.capture_stats:
+            stats.update(self.capture_stats.summary())
+        stats.update({
+            "elapsed": elapsed,
+            "segments": len(self.writers),
+            "writer_queue_depth": self.writer.queue_depth if self.writer else 0,
+            "bytes_written": bytes_written,
+            "bytes_per_second": bytes_written / elapsed if elapsed > 0 else 0.0,
+            "buffer_bytes": sum(store.nbytes for store in self.stores) + (self.ring.data.nbytes if self.ring is not None else 0),
+        })
+        return stats
+    
+    def publish_stats(self) -> dict:
+        """
+        Publish the current capture stats to the data bank
+        """
+        stats = self.stats_snapshot()
+        self.data_bank.data["capture_stats"] = stats
+        return stats
+    
+    def join(self, timeout: float = None):
+        """
+        Wait for every segment of the last recording to be written
+        """
+        for writer in self.writers:
+            writer.join(timeout)
+    
+    def open_recordings(self) -> list:
+        """
+        Recordings still being written or compacted, which other readers should leave alone (see SessionCatalog.scan())
+
+        Returns:
+            list: Path of the recording's first segment, if any
+        """
+        if self.recording or any(writer.thread.is_alive() for writer in self.writers):
+            return [self.recording_path]
+        return []
+    
     def __filename(self):
         """
         Generate an output filename for the telemetry data
         """
         base_name = "iRTL"
-        filetype = ".json"
+        filetype = ".irtl"
         
         # Format the current date and time and append to the base name
         strftime = datetime.now().strftime("%m-%d-%Y_%H-%M-%S")
@@ -142,19 +420,29 @@ class iRacingTelemetryLogger:
         Stop the telemetry logger
         """
         self.recording = False
-        filename = self.__filename()
+        self.scheduler.stop()
+        self.telemetry_thread.join()
+        if self.live_monitor:
+            self.live_monitor.stop_rendering()
         
-        for channel_name, channel in self.data.items():
-            self.data[channel_name]["data"] = [round(val, self.data_precison) for val in channel["data"]]
+        stats = self.__close_segment()
+        print(f"Recorded {stats['samples']} samples in {stats['segments']} segment(s) ({stats['dropped_ticks']} dropped ticks, {stats['duplicate_ticks']} duplicate ticks)")
+        self.stats = stats
         
-        # Save data to file
-        with open(self.output_dir + "\\" + filename, "w") as f:
-            json.dump(self.data, f)
+        final_stats = self.publish_stats()
+        if self.stats_file:
+            final_stats["live_monitor"] = self.data_bank.data.get("live_monitor_stats", {})
+            write_stats(os.path.splitext(self.recording_path)[0] + ".stats.json", final_stats)
+        
+        # Readers in other processes detach from the shared ring before the recording is stopped
+        if self.ring_shm:
+            self.data_bank.data["live_telemetry"] = {}
+            release_shared_ring(self.ring, self.ring_shm, unlink=True)
+            self.ring = self.ring_shm = None
 
         # Check if file saved successfully
-        output_path = self.output_dir + "\\" + filename
-        if os.path.exists(output_path):
-            print(f"Telemetry data saved to {output_path}")
+        if os.path.exists(self.output_path):
+            print(f"Telemetry data saved to {self.recording_path if len(self.writers) == 1 else self.index.path}")
             return True
         else:
             return False
@@ -162,32 +450,44 @@ class iRacingTelemetryLogger:
     def poll(self):
         """
         Poll the iRacing SDK for telemetry data. Only poll the selected channels in self.channels and self.data
+
+        The frame being read is the one frozen by the scheduler, so every channel comes from the same sim tick
         """
-        # Loop through channels and poll data from the sim
-        for channel_name, channel in self.data.items():
-            if channel_name == "time":
-                continue
-            
-            # Attempt to poll the channel data from the sim
-            _data = self.ir_sdk[channel_name]
-            if _data:
-                channel["data"].append(_data)
-            else:
-                channel["data"].append(self.data_err_code)  # Failed to retrieve data from sim
-                
-        # Add session time to the data
-        if len(self.data["time"]["data"]) > 1:
-            self.data["time"]["data"].append(self.data["time"]["data"][-1] + self.polling_rate)
-        else:
-            self.data["time"]["data"].append(0.0)    # First data point is 0.0
-            
-        # Update the data bank with the latest data
-        self.data_bank.data["live_telemetry"] = self.data
-        self.live_monitor.plot()
+        # Decode every channel from the frame in one pass, in store order. Time comes from the sim's own clock
+        row = self.plan.decode()
+        
+        # A session boundary starts a new segment file with this sample
+        if self.detector:
+            reason = self.detector.check(row[self.time_col], row[self.lap_col] if self.lap_col is not None else None)
+            if reason:
+                self.__roll_segment(reason, row[self.time_col])
+        self.store.append(row)
+        self.live_row[:len(row)] = row
+        
+        # Lower rate tiers only decode their channels when they are due
+        for tier, _slice in zip(self.tiers, self.tier_slices):
+            values = tier.sample(row[self.time_col])
+            if values is not None:
+                self.live_row[_slice] = values
+        self.ring.push(self.live_row)
     
     def run(self):
         """
-        Run the telemetry logger
+        Run the telemetry logger. Takes one sample per sim tick, sleeping in between
         """
-        while self.recording:
-            self.poll()
\ No newline at end of file
+        if not self.capture_stats:
+            while self.recording and self.scheduler.wait_for_tick():
+                self.poll()
+        else:
+            # Time every poll and publish the stats a couple of times a second
+            next_publish = 0.0
+            while self.recording and self.scheduler.wait_for_tick():
+                start = time.perf_counter()
+                self.poll()
+                end = time.perf_counter()
+                self.capture_stats.record(end - start)
+                if end >= next_publish:
+                    self.publish_stats()
+                    next_publish = end + self.stats_interval
+        
+        self.ir_sdk.unfreeze_var_buffer_latest()
@@ -0,0 +1,354 @@
+"""
+Batch analytics across many recordings
+
+Per-recording metrics (lap times, fuel per lap, peak brake pressures, or any function of an iRTLDataProcessor)
+are computed in parallel worker processes, one recording per task, then reduced into a summary across the
+recordings. Results are cached per recording contents hash, so re-running over an archive only processes
+new or changed recordings.
+
+    python -m logger.iRTLBatch data/outputs --metrics laps fuel brakes --output results.json
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+sys.path.append(os.getcwd())
+from logger.iRTLCatalog import OUTPUTS_DIR, is_recording
+from logger.iRTLLaps import file_hash
+
+ANALYTICS_CACHE_DIR = os.path.join(os.getcwd(), "data", "analytics")
+ANALYTICS_VERSION = 1   # Bump when the built in metrics change, to recompute cached results
+CORNERS = ["LF", "RF", "LR", "RR"]
+
+
+def lap_metrics(processor) -> dict:
+    """
+    Lap count, best and median lap time of the valid, timed laps
+    """
+    lap_times = [lap["lap_time"] for lap in processor.laps if lap["valid"] and lap["lap_time"] is not None]
+    return {
+        "n_laps": len(processor.laps),
+        "lap_times": lap_times,
+        "best": min(lap_times) if lap_times else None,
+        "median": float(np.median(lap_times)) if lap_times else None,
+    }
+
+
+def fuel_metrics(processor) -> dict:
+    """
+    Fuel used over each valid lap. Laps where the fuel level rose (refuelled) are left out
+    """
+    if "FuelLevel" not in processor.data:
+        return None
+    fuel = processor.session["FuelLevel"].values
+    bounds = np.array([lap.bounds(processor.session["FuelLevel"].timebase) for lap, entry in zip(processor.session.laps, processor.laps) if entry["valid"]],
+                      dtype=np.int64).reshape(-1, 2)
+    bounds = bounds[bounds[:, 1] > bounds[:, 0]]
+    used = fuel[bounds[:, 0]] - fuel[np.minimum(bounds[:, 1], len(fuel) - 1)]     # To the next lap's first sample, where the line was crossed
+    used = used[used >= 0].astype(np.float64)
+    return {
+        "per_lap": used.tolist(),
+        "mean": float(used.mean()) if len(used) else None,
+        "median": float(np.median(used)) if len(used) else None,
+    }
+
+
+def brake_metrics(processor) -> dict:
+    """
+    Peak brake line pressure per corner
+    """
+    peaks = {}
+    for corner in CORNERS:
+        channel = f"{corner}brakeLinePress"
+        if channel in processor.data and len(processor.session[channel]):
+            peaks[corner] = float(np.max(processor.session[channel].values))
+    return peaks or None
+
+
+# Built in per-recording metrics, {name: function(iRTLDataProcessor) -> JSON serializable result}
+METRICS = {
+    "laps": lap_metrics,
+    "fuel": fuel_metrics,
+    "brakes": brake_metrics,
+}
+
+
+def metric_name(metric) -> str:
+    """
+    Name results of a metric are stored under. Functions other than the built in metrics are named by their module and qualified name
+    """
+    if isinstance(metric, str):
+        if metric not in METRICS:
+            raise Exception(f"metric_name(): Unknown metric '{metric}'! Choose from {list(METRICS)}")
+        return metric
+    return f"{metric.__module__}.{metric.__qualname__}"
+
+
+def analyze_file(path: str, metrics: dict, digest: str = None) -> tuple:
+    """
+    Compute metrics of one recording. Runs in a worker process
+
+    Args:
+        path (str): Path to the recording
+        metrics (dict): {name: function(iRTLDataProcessor)}. Functions must be importable (module level) to run in workers
+        digest (str): Hash of the recording, if known
+
+    Returns:
+        tuple: (hash, {name: result}). A metric that fails gives {"error": message}; a recording that can't be opened gives the error for every metric
+    """
+    from logger.iRTLData import iRTLDataProcessor   # Imported in the worker, only once it has work
+    from logger.iRTLCache import LRUCache
+    digest = digest or file_hash(path)
+    try:
+        processor = iRTLDataProcessor(path, cache=LRUCache(), derived_channels={})
+    except Exception as e:
+        return digest, {name: {"error": str(e)} for name in metrics}
+
+    results = {}
+    try:
+        for name, metric in metrics.items():
+            try:
+                results[name] = metric(processor)
+            except Exception as e:
+                results[name] = {"error": str(e)}
+    finally:
+        processor.close()
+    return digest, results
+
+
+class ResultCache:
+    """
+    Metric results stored per recording contents hash, in one JSON file per hash. A stat index
+    ({path: [size, mtime_ns, hash]}) avoids rehashing recordings that haven't changed
+    """
+    def __init__(self, path: str = ANALYTICS_CACHE_DIR):
+        self.path = path
+        self.index_path = os.path.join(path, "index.json")
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def hash(self, path: str) -> str:
+        """
+        Get a recording's hash from the stat index, if the recording hasn't changed since it was hashed
+        """
+        stat = os.stat(path)
+        entry = self.index.get(os.path.abspath(path))
+        return entry[2] if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns] else None
+
+    def get(self, digest: str) -> dict:
+        try:
+            with open(os.path.join(self.path, f"{digest}.json")) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return cached["results"] if cached.get("version") == ANALYTICS_VERSION else {}
+
+    def put(self, path: str, digest: str, results: dict):
+        """
+        Store a recording's results, adding to the results already cached for its hash. Failed metrics aren't cached
+        """
+        stat = os.stat(path)
+        self.index[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+        results = {name: result for name, result in results.items() if not (isinstance(result, dict) and "error" in result)}
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            output = os.path.join(self.path, f"{digest}.json")
+            with open(output + ".tmp", "w") as f:
+                json.dump({"version": ANALYTICS_VERSION, "results": {**self.get(digest), **results}}, f)
+            os.replace(output + ".tmp", output)
+        except OSError as e:
+            print(f"WARNING: Could not cache the results of '{path}': {e}")
+
+    def save(self):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.index_path + ".tmp", "w") as f:
+                json.dump(self.index, f)
+            os.replace(self.index_path + ".tmp", self.index_path)
+        except OSError as e:
+            print(f"WARNING: Could not save the analytics cache index: {e}")
+
+
+def find_recordings(paths: list) -> list:
+    """
+    Expand folders into the recordings they contain
+
+    Returns:
+        list: Paths of the recordings, sorted
+    """
+    recordings = []
+    for path in paths:
+        if os.path.isdir(path):
+            recordings += [entry.path for entry in os.scandir(path) if entry.is_file() and is_recording(entry.name)]
+        elif os.path.exists(path):
+            recordings.append(path)
+        else:
+            raise Exception(f"find_recordings(): '{path}' not found!")
+    return sorted(set(recordings))
+
+
+def analyze(paths: list, metrics: list = None, workers: int = None, cache_dir: str = ANALYTICS_CACHE_DIR, progress=None) -> dict:
+    """
+    Compute per-recording metrics across recordings in parallel and reduce them
+
+    Args:
+        paths (list): Recordings and/or folders of recordings
+        metrics (list): Built in metric names (see METRICS) and/or module level functions of an iRTLDataProcessor. Defaults to every built in metric
+        workers (int): Worker processes. Defaults to one per CPU; 1 runs in this process
+        cache_dir (str): Folder results are cached in, or None to not cache. Other functions' results are cached under their
+                         name, so pass None while changing one
+        progress (callable): Called with (number done, number of recordings, path) as recordings finish
+
+    Returns:
+        dict: {"files": {path: {metric_name: result}}, "summary": reduced results of the built in metrics (see summarize()), "computed": number of recordings processed, "cached": number served from the cache}
+    """
+    metrics = {metric_name(metric): METRICS.get(metric, metric) for metric in (metrics or list(METRICS))}
+    recordings = find_recordings(paths)
+    cache = ResultCache(cache_dir) if cache_dir else None
+
+    files = {}
+    todo = []       # (path, hash, {name: function}) still to compute
+    for path in recordings:
+        digest = cache.hash(path) if cache else None
+        cached = cache.get(digest) if digest else {}
+        missing = {name: metric for name, metric in metrics.items() if name not in cached}
+        files[path] = {name: cached[name] for name in metrics if name in cached}
+        if missing:
+            todo.append((path, digest, missing))
+    n_cached = len(recordings) - len(todo)
+    done = n_cached
+    if progress:
+        progress(done, len(recordings), None)
+
+    def finish(path: str, digest: str, results: dict):
+        nonlocal done
+        files[path].update(results)
+        if cache:
+            cache.put(path, digest, results)
+        done += 1
+        if progress:
+            progress(done, len(recordings), path)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(todo) <= 1:
+        for path, digest, missing in todo:
+            finish(path, *analyze_file(path, missing, digest))
+    else:
+        # One task per recording, so uneven recording sizes balance across the workers
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as executor:
+            futures = {executor.submit(analyze_file, path, missing, digest): path for path, digest, missing in todo}
+            for future in as_completed(futures):
+                finish(futures[future], *future.result())
+    if cache:
+        cache.save()
+
+    files = {path: {name: files[path][name] for name in metrics} for path in recordings}
+    return {"files": files, "summary": summarize(files), "computed": len(todo), "cached": n_cached}
+
+
+def summarize(files: dict) -> dict:
+    """
+    Reduce the built in metrics across recordings
+
+    Returns:
+        dict: {"laps": {"n_laps", "best", "best_file", "median"}, "fuel": {"mean", "median"}, "brakes": {corner: {"peak", "file"}}}
+            for the metrics that were computed
+    """
+    def valid(result) -> bool:
+        return isinstance(result, dict) and "error" not in result
+
+    summary = {}
+    laps = {path: results["laps"] for path, results in files.items() if valid(results.get("laps"))}
+    if laps:
+        lap_times = [lap_time for result in laps.values() for lap_time in result["lap_times"]]
+        best_file = min((path for path in laps if laps[path]["best"] is not None), key=lambda path: laps[path]["best"], default=None)
+        summary["laps"] = {
+            "n_laps": sum(result["n_laps"] for result in laps.values()),
+            "best": laps[best_file]["best"] if best_file else None,
+            "best_file": best_file,
+            "median": float(np.median(lap_times)) if lap_times else None,
+        }
+
+    fuel = [used for results in files.values() if valid(results.get("fuel")) for used in results["fuel"]["per_lap"]]
+    if any("fuel" in results for results in files.values()):
+        summary["fuel"] = {"mean": float(np.mean(fuel)) if fuel else None, "median": float(np.median(fuel)) if fuel else None}
+
+    if any("brakes" in results for results in files.values()):
+        summary["brakes"] = {}
+        for path, results in files.items():
+            if not valid(results.get("brakes")):
+                continue
+            for corner, peak in results["brakes"].items():
+                if corner not in summary["brakes"] or peak > summary["brakes"][corner]["peak"]:
+                    summary["brakes"][corner] = {"peak": peak, "file": path}
+    return summary
+
+
+def format_time(seconds: float) -> str:
+    if seconds is None:
+        return "-"
+    return f"{int(seconds // 60)}:{seconds % 60:06.3f}"
+
+
+def print_report(report: dict):
+    """
+    Print the per-recording metrics and the summary
+    """
+    print(f"\n{'Recording':<40} {'Laps':>5} {'Best':>10} {'Median':>10} {'Fuel/lap':>9}  Peak brake LF/RF/LR/RR")
+    for path, results in report["files"].items():
+        laps = results.get("laps") or {}
+        fuel = results.get("fuel") or {}
+        brakes = results.get("brakes") or {}
+        if "error" in laps:
+            print(f"{os.path.basename(path):<40} ERROR: {laps['error']}")
+            continue
+        fuel_per_lap = f"{fuel['median']:.3f}" if fuel.get("median") is not None else "-"
+        peaks = "/".join(f"{brakes[corner]:.0f}" if corner in brakes else "-" for corner in CORNERS) if "error" not in brakes else "-"
+        print(f"{os.path.basename(path):<40} {laps.get('n_laps', '-'):>5} {format_time(laps.get('best')):>10} "
+              f"{format_time(laps.get('median')):>10} {fuel_per_lap:>9}  {peaks}")
+
+    summary = report["summary"]
+    print(f"\n{len(report['files'])} recordings ({report['computed']} processed, {report['cached']} cached)")
+    if summary.get("laps"):
+        best_file = os.path.basename(summary["laps"]["best_file"]) if summary["laps"]["best_file"] else "-"
+        print(f"Laps: {summary['laps']['n_laps']}, best {format_time(summary['laps']['best'])} ({best_file}), median {format_time(summary['laps']['median'])}")
+    if summary.get("fuel") and summary["fuel"]["median"] is not None:
+        print(f"Fuel per lap: mean {summary['fuel']['mean']:.3f}, median {summary['fuel']['median']:.3f}")
+    for corner, peak in summary.get("brakes", {}).items():
+        print(f"Peak {corner} brake line pressure: {peak['peak']:.0f} ({os.path.basename(peak['file'])})")
+
+
+def main(argv: list = None) -> dict:
+    """
+    Analyze recordings from the command line and print the report. Writes the report to a JSON file if a path is given
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Compute metrics across recordings in parallel")
+    parser.add_argument("paths", nargs="*", default=[OUTPUTS_DIR], help="Recordings and/or folders of recordings (defaults to data/outputs)")
+    parser.add_argument("--metrics", nargs="+", default=list(METRICS), choices=list(METRICS), help="Metrics to compute")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (defaults to one per CPU)")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every recording and don't cache the results")
+    parser.add_argument("--output", default=None, help="JSON file to write the report to")
+    args = parser.parse_args(argv)
+
+    def progress(done: int, total: int, path: str):
+        print(f"\rAnalyzed {done}/{total} recordings", end="" if done < total else "\n", flush=True)
+
+    report = analyze(args.paths, args.metrics, args.workers, None if args.no_cache else ANALYTICS_CACHE_DIR, progress)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"\nReport saved to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Memory-budgeted cache for data derived from recordings
+
+Derived data (scaled channels, resampled laps, deltas, ...) are cached under (file, channel, lap, transform)
+keys. The cache holds at most max_bytes of arrays and evicts the least recently used entries beyond that.
+Processors share one cache by default, so flipping between recordings, laps and channels stays within one
+budget.
+
+Copyright © Kyle Ward 2023
+"""
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def nbytes(value) -> int:
+    """
+    Approximate memory held by a cached value
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Least recently used cache with a byte budget
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        """
+        Args:
+            max_bytes (int): Memory budget of the cached values
+        """
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key: (value, nbytes, on_evict)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key, compute, on_evict=None):
+        """
+        Get a cached value, computing and caching it on a miss. Values larger than the whole budget are returned without caching them
+
+        Args:
+            key (hashable): Cache key, by convention (file, channel, lap, transform)
+            compute (callable): Computes the value
+            on_evict (callable): Called with the key when the value leaves the cache, to drop anything that refers to it
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value = compute()
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return value
+
+        evicted = []
+        with self.lock:
+            if key in self.entries:     # Computed by another thread meanwhile
+                return self.entries[key][0]
+            self.entries[key] = (value, size, on_evict)
+            self.nbytes += size
+            evicted = self.__shrink(self.max_bytes)
+        self.__notify(evicted)
+        return value
+
+    def __shrink(self, max_bytes: int) -> list:
+        """
+        Evict least recently used entries until the cache fits max_bytes. Call with the lock held
+
+        Returns:
+            list: [(key, on_evict), ...] of the evicted entries
+        """
+        evicted = []
+        while self.nbytes > max_bytes and self.entries:
+            key, (_, size, on_evict) = self.entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            evicted.append((key, on_evict))
+        return evicted
+
+    def __notify(self, evicted: list):
+        for key, on_evict in evicted:
+            if on_evict is not None:
+                on_evict(key)
+
+    def resize(self, max_bytes: int):
+        """
+        Change the memory budget, evicting entries if the cache no longer fits
+        """
+        with self.lock:
+            self.max_bytes = max_bytes
+            evicted = self.__shrink(max_bytes)
+        self.__notify(evicted)
+
+    def invalidate(self, file=None, channel=None):
+        """
+        Drop cached values, e.g. when the data they were derived from changes. Doesn't count as evictions
+
+        Args:
+            file (hashable): Only drop values derived from this file (first element of the key). None for every file
+            channel (str): Only drop values derived from this channel (second element of the key)
+        """
+        dropped = []
+        with self.lock:
+            for key in list(self.entries):
+                if (file is None or key[0] == file) and (channel is None or key[1] == channel):
+                    _, size, on_evict = self.entries.pop(key)
+                    self.nbytes -= size
+                    dropped.append((key, on_evict))
+        self.__notify(dropped)
+
+    def stats(self) -> dict:
+        """
+        Get the cache counters
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Cache shared by every data processor that isn't given its own
+CACHE = LRUCache()
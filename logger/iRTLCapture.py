@@ -0,0 +1,363 @@
+"""
+Capture scheduling and frame decoding for the iRacing Telemetry Logger
+
+Copyright © Kyle Ward 2023
+"""
+import math
+import time
+import struct
+import numpy as np
+from threading import Event
+from logger.iRTLStore import SDK_DTYPES
+
+# struct codes for each iRacing SDK var type (see SDK_DTYPES)
+STRUCT_CODES = {0: "b", 1: "?", 2: "i", 3: "I", 4: "f", 5: "d"}
+
+class TickScheduler:
+    """
+    Paces the capture loop to the simulator's tick rate.
+
+    Instead of spinning on the SDK, the scheduler blocks until the sim publishes a new
+    frame (or until the next polling deadline passes), so exactly one sample is taken per
+    sim tick and the recorder sleeps the rest of the time.
+    """
+    def __init__(self, ir_sdk, rate_hz: int = 60):
+        """
+        Initialize the scheduler
+
+        Args:
+            ir_sdk (irsdk.IRSDK): Connected SDK instance to pace against
+            rate_hz (int): Target sampling rate in Hz. None samples every frame as soon as it is published
+        """
+        self.ir_sdk = ir_sdk
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz if rate_hz else 0.0
+        self.min_wait = 0.001       # Shortest sleep between frame checks (seconds)
+        self.stop_event = Event()
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the scheduler state and counters for a new recording
+        """
+        self.stop_event.clear()
+        self.last_tick = None
+        self.last_tick_time = None  # When the last sampled frame was found
+        self.next_deadline = time.perf_counter()
+        self.tick_step = self.__tick_step()
+        self.tick_period = self.__tick_period()
+        self.samples = 0
+        self.dropped_ticks = 0      # Sim ticks that were published but never sampled
+        self.duplicate_ticks = 0    # Wake-ups that found the previously sampled frame
+
+    def stop(self):
+        """
+        Stop the scheduler and wake up the capture thread if it is waiting
+        """
+        self.stop_event.set()
+
+    def __tick_step(self) -> int:
+        """
+        Number of sim ticks expected between two consecutive samples
+        """
+        header = getattr(self.ir_sdk, "_header", None)
+        if not header or not self.rate_hz:
+            return 1
+        return max(1, round(header.tick_rate / self.rate_hz))
+
+    def __tick_period(self) -> float:
+        """
+        Seconds between two sim ticks
+        """
+        header = getattr(self.ir_sdk, "_header", None)
+        if header and header.tick_rate:
+            return 1.0 / header.tick_rate
+        return self.period or 1.0 / 60
+
+    def __next_tick_time(self) -> float:
+        """
+        When the sim is expected to publish its next frame, one or more tick periods after the last sampled frame
+        """
+        now = time.perf_counter()
+        if self.last_tick_time is None:
+            return now + self.tick_period
+        ticks = max(1, math.ceil((now - self.last_tick_time) / self.tick_period))
+        return self.last_tick_time + ticks * self.tick_period
+
+    def __sleep_until(self, deadline: float):
+        """
+        Sleep until the given deadline. Returns early if the scheduler is stopped
+        """
+        remaining = deadline - time.perf_counter()
+        self.stop_event.wait(max(remaining, self.min_wait))
+
+    def wait_for_tick(self) -> bool:
+        """
+        Block until a new sim frame is available and freeze it for sampling
+
+        Returns:
+            bool: True if a new frame is frozen and ready to be sampled, False if the scheduler was stopped
+        """
+        # Don't sample faster than the requested polling rate
+        if self.next_deadline > time.perf_counter():
+            self.__sleep_until(self.next_deadline)
+
+        while not self.stop_event.is_set():
+            # Blocks on the SDK's data-valid event until the sim writes a new frame
+            self.ir_sdk.freeze_var_buffer_latest()
+            tick = self.ir_sdk["SessionTick"]
+
+            # SDK isn't publishing data (e.g. sim is in a loading screen)
+            if tick is None:
+                self.__sleep_until(time.perf_counter() + self.period)
+                continue
+
+            # Same frame as the last sample. Sleep until the sim is due to publish the next one, rather than
+            # the polling deadline, which has usually passed already and would re-check every min_wait
+            if tick == self.last_tick:
+                self.duplicate_ticks += 1
+                self.__sleep_until(self.__next_tick_time())
+                continue
+
+            # Count any ticks that were skipped since the last sample. A tick going
+            # backwards means the session was reset, which isn't a drop
+            if self.last_tick is not None and tick > self.last_tick:
+                self.dropped_ticks += max(0, (tick - self.last_tick) // self.tick_step - 1)
+
+            self.last_tick = tick
+            self.last_tick_time = time.perf_counter()
+            self.samples += 1
+            self.next_deadline = max(self.next_deadline + self.period, time.perf_counter())
+            return True
+
+        return False
+
+    def stats(self) -> dict:
+        """
+        Get the scheduler counters
+        """
+        return {
+            "samples": self.samples,
+            "dropped_ticks": self.dropped_ticks,
+            "duplicate_ticks": self.duplicate_ticks,
+        }
+
+
+class CapturePlan:
+    """
+    Reads every selected channel from one SDK frame in a few vectorized passes.
+
+    The plan is compiled once when recording starts: each channel is resolved to its offset
+    and type in the SDK var buffer, and channels are grouped by dtype (and alignment) so each
+    group can be gathered from a typed np.frombuffer() view of the frozen frame with a single
+    take. The cost per tick depends on the number of groups, not the number of channels.
+    """
+    def __init__(self, ir_sdk, names: list, err_code: float = 0):
+        """
+        Compile the plan
+
+        Args:
+            ir_sdk (irsdk.IRSDK): Connected SDK instance
+            names (list): SDK variable names, in the order values should appear in the decoded row
+            err_code (float): Value used for variables the SDK doesn't provide
+        """
+        self.ir_sdk = ir_sdk
+        self.names = list(names)
+        self.buf_len = ir_sdk._header.buf_len
+        self.row = np.full(len(self.names), err_code, dtype=np.float64)
+
+        # Resolve every channel to its offset and type in the var buffer, grouping channels
+        # that can be read through the same typed view of the buffer
+        var_headers = ir_sdk._var_headers_dict
+        groups = {}     # (dtype, byte offset of the view): ([row positions], [element indices])
+        self.missing = []
+        for i, name in enumerate(self.names):
+            var_header = var_headers.get(name)
+            if var_header is None or var_header.count != 1:
+                self.missing.append(name)
+                continue
+            dtype = SDK_DTYPES[var_header.type]
+            base = var_header.offset % dtype.itemsize
+            rows, elements = groups.setdefault((dtype, base), ([], []))
+            rows.append(i)
+            elements.append((var_header.offset - base) // dtype.itemsize)
+
+        # (dtype, view offset, view length, row positions, element indices)
+        self.groups = [
+            (dtype, base, (self.buf_len - base) // dtype.itemsize, np.array(rows, dtype=np.intp), np.array(elements, dtype=np.intp))
+            for (dtype, base), (rows, elements) in groups.items()
+        ]
+
+        # Single struct covering every channel (in buffer order), for reading the raw values in one call
+        fields = sorted((var_headers[name].offset, STRUCT_CODES[var_headers[name].type]) for name in self.names if name not in self.missing)
+        fmt = "<"
+        pos = 0
+        for offset, code in fields:
+            fmt += f"{offset - pos}x{code}" if offset > pos else code
+            pos = offset + struct.calcsize("<" + code)
+        self.layout = struct.Struct(fmt)
+
+    def decode(self) -> np.ndarray:
+        """
+        Decode the selected channels from the SDK's latest (frozen) frame
+
+        Returns:
+            np.ndarray: Row of float64 values in the order of self.names. The row is reused on every call
+        """
+        var_buf = self.ir_sdk._var_buffer_latest
+        memory = var_buf.get_memory()
+        offset = var_buf.buf_offset
+        for dtype, base, count, rows, elements in self.groups:
+            frame = np.frombuffer(memory, dtype=dtype, count=count, offset=offset + base)
+            self.row[rows] = frame[elements]
+        return self.row
+
+    def snapshot(self) -> tuple:
+        """
+        Read the raw values of the selected channels from the SDK's latest (frozen) frame
+
+        Much cheaper than decode() for a handful of channels, so it is used to check whether any
+        value changed before decoding
+
+        Returns:
+            tuple: Channel values in the order they are laid out in the var buffer
+        """
+        var_buf = self.ir_sdk._var_buffer_latest
+        return self.layout.unpack_from(var_buf.get_memory(), var_buf.buf_offset)
+
+
+class RateTier:
+    """
+    Channels sampled at a lower rate than the sim tick, recorded with their own timebase.
+
+    A tier is either periodic (sampled once per 1/rate seconds of session time) or on-change
+    (sampled whenever any of its values changes). Periodic tiers only decode their channels
+    on the ticks they are due, so slow channels cost nothing on the other ticks.
+    """
+    def __init__(self, rate, store, plan: CapturePlan, time_channel: str):
+        """
+        Initialize the tier
+
+        Args:
+            rate (float | str): Sampling rate in Hz, or "change" to sample whenever a value changes
+            store (SampleStore): Store the tier's samples are appended to
+            plan (CapturePlan): Plan decoding the tier's channels (the store's channels except the time channel, in store order)
+            time_channel (str): Name of the tier's time channel in the store
+        """
+        self.rate = rate
+        self.on_change = not isinstance(rate, (int, float))
+        self.name = RateTier.label(rate)
+        self.store = store
+        self.plan = plan
+        self.time_channel = time_channel
+        self.names = [name for name in store.names if name != time_channel]
+        self.time_col = store.names.index(time_channel)
+        self.value_cols = np.array([store.names.index(name) for name in self.names], dtype=np.intp)
+        self.row = np.zeros(len(store.names), dtype=np.float64)     # Staging row in store order
+        self.reset()
+
+    @staticmethod
+    def label(rate) -> str:
+        """
+        Name of the tier for a rate, used to name its time channel (e.g. "1Hz", "change")
+        """
+        return f"{rate:g}Hz" if isinstance(rate, (int, float)) else str(rate)
+
+    def reset(self):
+        """
+        Reset the tier for a new recording
+        """
+        self.last_slot = None
+        self.last_snapshot = None
+
+    def sample(self, session_time: float):
+        """
+        Sample the tier's channels from the SDK's latest (frozen) frame if they are due
+
+        Args:
+            session_time (float): Session time of the frame
+
+        Returns:
+            np.ndarray: Values of the tier's channels (in the order of self.names) if a sample was taken, otherwise None.
+                        The array is reused on every call
+        """
+        if self.on_change:
+            snapshot = self.plan.snapshot()
+            if snapshot == self.last_snapshot:
+                return None
+            self.last_snapshot = snapshot
+        else:
+            # One sample per 1/rate seconds of session time. A session reset starts a new slot
+            slot = int(session_time * self.rate)
+            if slot == self.last_slot:
+                return None
+            self.last_slot = slot
+
+        values = self.plan.decode()
+        self.row[self.value_cols] = values
+        self.row[self.time_col] = session_time
+        self.store.append(self.row)
+        return values
+
+
+class SegmentDetector:
+    """
+    Detects session boundaries in the capture stream, so a recording can be split into one
+    segment per session.
+
+    A boundary is reported when the session number changes, the lap number goes backwards
+    (e.g. a session restart), session time jumps backwards or forward by more than a few seconds,
+    or no frame was sampled for a long time (the sim was paused or loading).
+    """
+    def __init__(self, ir_sdk, pause_seconds: float = 30.0, time_jump_seconds: float = 5.0):
+        """
+        Initialize the detector
+
+        Args:
+            ir_sdk (irsdk.IRSDK): Connected SDK instance
+            pause_seconds (float): Wall time without samples that starts a new segment
+            time_jump_seconds (float): Session time skipped between two samples that starts a new segment
+        """
+        self.pause_seconds = pause_seconds
+        self.time_jump_seconds = time_jump_seconds
+        self.plan = CapturePlan(ir_sdk, ["SessionNum"])    # Empty snapshot if the SDK has no session number
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the detector for a new recording
+        """
+        self.last_session = None
+        self.last_time = None
+        self.last_lap = None
+        self.last_wall = None
+
+    def check(self, session_time: float, lap: float = None) -> str:
+        """
+        Check the SDK's latest (frozen) frame against the previous one
+
+        Args:
+            session_time (float): Session time of the frame
+            lap (float): Lap number of the frame, if recorded
+
+        Returns:
+            str: Reason the frame starts a new segment ("session", "lap_reset", "time_jump" or "pause"), otherwise None
+        """
+        wall = time.perf_counter()
+        session = self.plan.snapshot()
+        reason = None
+        if self.last_time is not None:
+            if session != self.last_session:
+                reason = "session"
+            elif lap is not None and lap < self.last_lap:
+                reason = "lap_reset"
+            elif session_time < self.last_time or session_time - self.last_time > self.time_jump_seconds:
+                reason = "time_jump"
+            elif wall - self.last_wall > self.pause_seconds:
+                reason = "pause"
+
+        self.last_session = session
+        self.last_time = session_time
+        self.last_lap = lap
+        self.last_wall = wall
+        return reason
@@ -0,0 +1,319 @@
+"""
+SQLite catalog of the recordings in data/outputs
+
+Every recording is indexed once: its date, track and car, duration, channels, laps with their lap times and
+flags, and per-lap min/max/mean of key channels. Re-scans only parse recordings that are new or whose size or
+modification time changed, so sessions and laps can be listed and searched (e.g. the best laps at a track last
+month) without opening any recording.
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import json
+import sqlite3
+from datetime import datetime
+import numpy as np
+
+CATALOG_PATH = os.path.join(os.getcwd(), "data", "catalog.sqlite")
+OUTPUTS_DIR = os.path.join(os.getcwd(), "data", "outputs")
+CATALOG_VERSION = 2
+
+RECORDING_EXTENSIONS = (".irtl", ".json")
+SIDECAR_SUFFIXES = (".index.json", ".laps.json", ".stats.json")     # Files next to recordings that aren't recordings
+
+# Channels summarized per lap, when recorded
+STAT_CHANNELS = ["Speed", "RPM", "Throttle", "Brake", "SteeringWheelAngle", "LatAccel", "LongAccel", "FuelLevel",
+                 "LFbrakeLinePress", "RFbrakeLinePress", "LRbrakeLinePress", "RRbrakeLinePress"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT,
+    recorded_at TEXT,
+    track TEXT,
+    car TEXT,
+    duration REAL,
+    n_samples INTEGER,
+    n_laps INTEGER,
+    best_lap_time REAL,
+    channels TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS laps (
+    recording_id INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    lap_index INTEGER NOT NULL,
+    lap INTEGER,
+    start_time REAL,
+    lap_time REAL,
+    valid INTEGER,
+    flags TEXT,
+    PRIMARY KEY (recording_id, lap_index)
+);
+CREATE TABLE IF NOT EXISTS lap_stats (
+    recording_id INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    lap_index INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    min REAL,
+    max REAL,
+    mean REAL,
+    PRIMARY KEY (recording_id, lap_index, channel)
+);
+CREATE INDEX IF NOT EXISTS recordings_track ON recordings (track, recorded_at);
+CREATE INDEX IF NOT EXISTS laps_time ON laps (valid, lap_time);
+"""
+
+
+def recording_date(path: str, mtime_ns: int) -> str:
+    """
+    Date a recording was made, from its iRTL_MM-DD-YYYY_HH-MM-SS name, else its modification time
+
+    Returns:
+        str: ISO 8601 date and time
+    """
+    parts = os.path.splitext(os.path.basename(path))[0].split("_")
+    if len(parts) >= 3:
+        try:
+            return datetime.strptime(f"{parts[1]}_{parts[2]}", "%m-%d-%Y_%H-%M-%S").isoformat()
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(mtime_ns / 1e9).isoformat(timespec="seconds")
+
+
+def is_recording(name: str) -> bool:
+    return name.endswith(RECORDING_EXTENSIONS) and not name.endswith(SIDECAR_SUFFIXES)
+
+
+def is_segment_of(path: str, recording_path: str) -> bool:
+    """
+    Whether a file is a recording or one of its segment files (<recording>_2.irtl, ..., see logger.iRTLSession.segment_path)
+    """
+    base, ext = os.path.splitext(os.path.abspath(recording_path))
+    path_base, path_ext = os.path.splitext(os.path.abspath(path))
+    if path_ext != ext:
+        return False
+    return path_base == base or (path_base.startswith(base + "_") and path_base[len(base) + 1:].isdigit())
+
+
+def summarize_recording(path: str) -> dict:
+    """
+    Parse a recording into its catalog entry
+
+    Returns:
+        dict: {"format", "track", "car", "duration", "n_samples", "channels", "laps": [...], "lap_stats": [...]}
+    """
+    from logger.iRTLData import iRTLDataProcessor   # Imports the processor's dependencies only when indexing
+    from logger.iRTLCache import LRUCache
+    processor = iRTLDataProcessor(path, cache=LRUCache(0), derived_channels={}, save_lap_index=False)
+    try:
+        meta = processor.file.meta if processor.file else {}
+        time = np.asarray(processor.get_channel_data("time"))
+        channels = list(processor.data)
+
+        # Per-lap min/max/mean of the key channels, reduced over every lap at once
+        lap_stats = []
+        stat_channels = [channel for channel in STAT_CHANNELS if channel in processor.data]
+        laps = processor.session.laps
+        for channel in stat_channels:
+            data = processor.session[channel].values.astype(np.float64)
+            bounds = np.array([lap.bounds(processor.session[channel].timebase) for lap in laps], dtype=np.int64).reshape(-1, 2)
+            nonempty = bounds[:, 1] > bounds[:, 0]
+            if not nonempty.any():
+                continue
+            starts = bounds[nonempty, 0]
+            sums = np.add.reduceat(data, starts)
+            mins = np.minimum.reduceat(data, starts)
+            maxs = np.maximum.reduceat(data, starts)
+            # reduceat reduces up to the next start; clip every lap to its own end where laps don't touch
+            for i, (lap_index, (start, end)) in enumerate(zip(np.flatnonzero(nonempty), bounds[nonempty])):
+                next_start = starts[i + 1] if i + 1 < len(starts) else len(data)
+                if end != next_start:
+                    segment = data[start:end]
+                    sums[i], mins[i], maxs[i] = segment.sum(), segment.min(), segment.max()
+                lap_stats.append((int(lap_index), channel, float(mins[i]), float(maxs[i]), float(sums[i] / (end - start))))
+
+        return {
+            "format": "irtl" if processor.file else "json",
+            "track": meta.get("track"),
+            "car": meta.get("car"),
+            "duration": float(time[-1] - time[0]) if len(time) else 0.0,
+            "n_samples": len(time),
+            "channels": channels,
+            "laps": processor.laps,
+            "lap_stats": lap_stats,
+        }
+    finally:
+        processor.close()
+
+
+class SessionCatalog:
+    """
+    Catalog of the recordings in a folder
+    """
+    def __init__(self, path: str = CATALOG_PATH, recordings_dir: str = OUTPUTS_DIR):
+        """
+        Open (or create) the catalog
+
+        Args:
+            path (str): Path to the SQLite database
+            recordings_dir (str): Folder of the recordings
+        """
+        self.path = path
+        self.recordings_dir = recordings_dir
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS lap_stats; DROP TABLE IF EXISTS laps; DROP TABLE IF EXISTS recordings;")
+            self.db.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def scan(self, progress=None, skip: list = ()) -> dict:
+        """
+        Index new and changed recordings and forget deleted ones. Unchanged recordings (same size and modification time) aren't opened.
+        Nothing is written next to the recordings
+
+        Args:
+            progress (callable): Called with (number done, number to index, path) as recordings are indexed
+            skip (list): Recordings still being written. They and their segment files aren't opened, since mapping
+                         them would stop the logger compacting them on Windows, and are indexed once finished
+
+        Returns:
+            dict: Number of recordings "added", "updated", "removed", "unchanged", "failed" and "skipped"
+        """
+        known = {row["path"]: (row["size"], row["mtime_ns"]) for row in self.db.execute("SELECT path, size, mtime_ns FROM recordings")}
+        found = {}
+        if os.path.isdir(self.recordings_dir):
+            for entry in os.scandir(self.recordings_dir):
+                if entry.is_file() and is_recording(entry.name):
+                    stat = entry.stat()
+                    found[os.path.abspath(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+
+        skipped = [path for path in found if any(is_segment_of(path, recording) for recording in skip)]
+        changed = [path for path, key in found.items() if known.get(path) != key and path not in skipped]
+        removed = [path for path in known if path not in found or path in skipped]
+        counts = {"added": 0, "updated": 0, "removed": len(removed), "unchanged": len(found) - len(changed) - len(skipped),
+                  "failed": 0, "skipped": len(skipped)}
+        with self.db:
+            self.db.executemany("DELETE FROM recordings WHERE path = ?", [(path,) for path in removed])
+
+        for i, path in enumerate(sorted(changed)):
+            if progress:
+                progress(i, len(changed), path)
+            size, mtime_ns = found[path]
+            try:
+                summary = summarize_recording(path)
+                error = None
+            except Exception as e:
+                summary, error = None, str(e)
+                counts["failed"] += 1
+            else:
+                counts["updated" if path in known else "added"] += 1
+            self.__store(path, size, mtime_ns, summary, error)
+        if progress and changed:
+            progress(len(changed), len(changed), None)
+        return counts
+
+    def __store(self, path: str, size: int, mtime_ns: int, summary: dict, error: str):
+        """
+        Replace a recording's entry, its laps and lap stats. Failed recordings are stored with their error, so
+        they're only retried once they change
+        """
+        summary = summary or {}
+        laps = summary.get("laps", [])
+        lap_times = [lap["lap_time"] for lap in laps if lap["lap_time"] is not None and lap["valid"]]
+        with self.db:
+            self.db.execute("DELETE FROM recordings WHERE path = ?", (path,))
+            cursor = self.db.execute(
+                "INSERT INTO recordings (path, size, mtime_ns, format, recorded_at, track, car, duration, n_samples, n_laps, best_lap_time, channels, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, summary.get("format"), recording_date(path, mtime_ns), summary.get("track"), summary.get("car"),
+                 summary.get("duration"), summary.get("n_samples"), len(laps), min(lap_times) if lap_times else None,
+                 json.dumps(summary.get("channels", [])), error))
+            recording_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO laps (recording_id, lap_index, lap, start_time, lap_time, valid, flags) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(recording_id, i, lap["lap"], lap["start_time"], lap["lap_time"], int(lap["valid"]), ",".join(lap["flags"])) for i, lap in enumerate(laps)])
+            self.db.executemany(
+                "INSERT INTO lap_stats (recording_id, lap_index, channel, min, max, mean) VALUES (?, ?, ?, ?, ?, ?)",
+                [(recording_id, *stats) for stats in summary.get("lap_stats", [])])
+
+    def recordings(self, track: str = None, since: str = None, until: str = None) -> list:
+        """
+        List the indexed recordings, newest first
+
+        Args:
+            track (str): Only recordings at this track
+            since (str): Only recordings made on or after this ISO date
+            until (str): Only recordings made before this ISO date
+
+        Returns:
+            list: [{"id", "path", "recorded_at", "track", "car", "duration", "n_laps", "best_lap_time", "channels", "error", ...}, ...]
+        """
+        where, params = self.__filters(track, since, until)
+        rows = self.db.execute(f"SELECT * FROM recordings {where} ORDER BY recorded_at DESC, path", params).fetchall()
+        return [{**dict(row), "channels": json.loads(row["channels"] or "[]")} for row in rows]
+
+    def laps(self, recording: str = None, track: str = None, since: str = None, until: str = None, valid_only: bool = False, limit: int = None) -> list:
+        """
+        List laps, fastest first
+
+        Args:
+            recording (str): Only laps of this recording (path)
+            track (str): Only laps at this track
+            since (str): Only laps of recordings made on or after this ISO date
+            until (str): Only laps of recordings made before this ISO date
+            valid_only (bool): Only timed, valid laps
+            limit (int): Maximum number of laps
+
+        Returns:
+            list: [{"path", "recorded_at", "track", "lap_index", "lap", "start_time", "lap_time", "valid", "flags"}, ...]
+        """
+        where, params = self.__filters(track, since, until)
+        conditions = [where[len("WHERE "):]] if where else []
+        if recording is not None:
+            conditions.append("path = ?")
+            params.append(os.path.abspath(recording))
+        if valid_only:
+            conditions.append("valid = 1 AND lap_time IS NOT NULL")
+        query = ("SELECT path, recorded_at, track, lap_index, lap, start_time, lap_time, valid, flags FROM laps "
+                 "JOIN recordings ON recordings.id = laps.recording_id "
+                 f"{'WHERE ' + ' AND '.join(conditions) if conditions else ''} "
+                 "ORDER BY lap_time IS NULL, lap_time, recorded_at")
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [{**dict(row), "valid": bool(row["valid"]), "flags": row["flags"].split(",") if row["flags"] else []}
+                for row in self.db.execute(query, params)]
+
+    def lap_stats(self, recording: str, lap_index: int) -> dict:
+        """
+        Get the min/max/mean of the key channels over a lap
+
+        Returns:
+            dict: {channel_name: {"min", "max", "mean"}}
+        """
+        rows = self.db.execute(
+            "SELECT channel, min, max, mean FROM lap_stats JOIN recordings ON recordings.id = lap_stats.recording_id "
+            "WHERE path = ? AND lap_index = ?", (os.path.abspath(recording), lap_index))
+        return {row["channel"]: {"min": row["min"], "max": row["max"], "mean": row["mean"]} for row in rows}
+
+    def __filters(self, track: str, since: str, until: str) -> tuple:
+        conditions, params = [], []
+        for condition, value in [("track = ?", track), ("recorded_at >= ?", since), ("recorded_at < ?", until)]:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return ("WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def close(self):
+        self.db.close()
@@ -4,33 +4,188 @@ Data processor for iRacing telemetry data
 Copyright © Kyle Ward 2023    
 """
 import os
-import json
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+from logger import DERIVED_CHANNELS, DERIVED_CHANNELS_FILE
+from logger.iRTLFile import iRTLFile, ChannelData, find_runs, align as align_channel
+from logger.iRTLJson import JsonRecording
+from logger.iRTLModel import Session
+from logger.iRTLCache import LRUCache
+from logger.iRTLExpr import compile_expression, load_derived_channels
+from logger.iRTLLaps import build_lap_index, load_lap_index
+
+def resample_laps(distance: np.ndarray, channels: dict, starts: np.ndarray, ends: np.ndarray, grid: np.ndarray, period: float) -> dict:
+    """
+    Resample channels of several laps onto a common distance grid in one pass
+
+    The laps are laid end to end, each shifted by twice the lap length, so a single searchsorted over every
+    lap's distance finds the samples around every grid point of every lap. Samples either side of the start/finish
+    line (distance near the end of the lap at the start of a lap, or near 0 at its end) are unwrapped first.
+
+    Args:
+        distance (np.ndarray): Distance around the lap of every sample (LapDistPct or LapDist)
+        channels (dict): {channel_name: samples} on the same timebase as distance
+        starts (np.ndarray): First sample of every lap
+        ends (np.ndarray): Sample after the last sample of every lap
+        grid (np.ndarray): Distances to resample to, within [0, period)
+        period (float): Lap length in distance units (1 for LapDistPct)
+
+    Returns:
+        dict: {channel_name: (n_laps, n_points) array}. Grid points a lap didn't cover (e.g. partial laps) are NaN.
+              Integer and boolean channels hold their previous sample instead of being interpolated
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(ends, dtype=np.int64) - starts
+    n_laps, n_points = len(starts), len(grid)
+    empty = {name: np.full((n_laps, n_points), np.nan) for name in channels}
+    if n_laps == 0 or lengths.sum() == 0:
+        return empty
+
+    # Sample indices of every lap, laid end to end, and each sample's lap
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    lap_of_sample = np.repeat(np.arange(n_laps), lengths)
+    idxs = np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+    x = np.asarray(distance, dtype=np.float64)[idxs]
+
+    # Unwrap around the start/finish line. Distance drops by about a lap each time the car crosses it; laps counted
+    # a little after the line start with a drop in their first half, and their samples before it belong before 0
+    wraps = np.concatenate(([False], (np.diff(x) < -period / 2) & (lap_of_sample[1:] == lap_of_sample[:-1])))
+    n_wraps = np.cumsum(wraps)
+    n_wraps -= n_wraps[offsets][lap_of_sample]
+    wrap_laps, first_wrap = np.unique(lap_of_sample[wraps], return_index=True)
+    wrapped_early = np.zeros(n_laps, dtype=np.int64)
+    wrapped_early[wrap_laps] = (idxs[wraps][first_wrap] - starts[wrap_laps]) < lengths[wrap_laps] / 2
+    x += period * (n_wraps - wrapped_early[lap_of_sample])
+
+    # Make distance non-decreasing within each lap, with the laps shifted apart so they sort one after another
+    x += lap_of_sample * 2 * period
+    x = np.maximum.accumulate(x)
+
+    # Grid points outside the distance a lap covered have no data. Points within a grid step of its ends (e.g. just
+    # before its first sample, when the lap was counted a little after the line) take its first or last sample
+    has_samples = lengths > 0
+    first = np.where(has_samples, x[np.minimum(offsets, len(x) - 1)], np.inf)
+    last = np.where(has_samples, x[np.minimum(offsets + lengths - 1, len(x) - 1)], -np.inf)
+    lap_of_point = np.repeat(np.arange(n_laps), n_points)
+    shifted = (grid[None, :] + (np.arange(n_laps) * 2 * period)[:, None]).ravel()
+    tolerance = period / n_points
+    covered = (shifted >= first[lap_of_point] - tolerance) & (shifted <= last[lap_of_point] + tolerance)
+    shifted = np.where(covered, np.clip(shifted, first[lap_of_point], last[lap_of_point]), shifted)
+
+    # Find the samples either side of every grid point of every lap
+    right = np.clip(np.searchsorted(x, shifted, side="right"), 1, len(x) - 1)
+    left = right - 1
+    span = x[right] - x[left]
+    weight = np.clip(np.divide(shifted - x[left], span, out=np.zeros_like(span), where=span > 0), 0, 1)
+
+    resampled = {}
+    for name, data in channels.items():
+        values = np.asarray(data)[idxs]
+        if values.dtype.kind in "iub":
+            out = values[np.where(weight < 1, left, right)].astype(np.float64)
+        else:
+            values = values.astype(np.float64, copy=False)
+            out = values[left] + weight * (values[right] - values[left])
+        out[~covered] = np.nan
+        resampled[name] = out.reshape(n_laps, n_points)
+    return resampled
+
+
+def lap_time_deltas(elapsed: np.ndarray, reference: np.ndarray, grid: np.ndarray, sector_starts: np.ndarray,
+                    lap_times: np.ndarray = None, reference_time: float = None) -> dict:
+    """
+    Compare laps with a reference lap along distance
+
+    Args:
+        elapsed (np.ndarray): (n_laps, n_points) time into each lap at every grid point
+        reference (np.ndarray): (n_points,) time into the reference lap at every grid point
+        grid (np.ndarray): Distance of every grid point
+        sector_starts (np.ndarray): Distance at which every sector starts, the first at 0
+        lap_times (np.ndarray): Lap time of every lap (NaN for unfinished laps), to close the last sector at the line
+        reference_time (float): Lap time of the reference lap
+
+    Returns:
+        dict: {"delta": (n_laps, n_points) time gained (-) or lost (+) to the reference up to each grid point,
+               "sector_deltas": (n_laps, n_sectors) time gained or lost in each sector,
+               "lap_deltas": (n_laps,) total time gained or lost}
+    """
+    delta = elapsed - reference[None, :]
+
+    # Delta at the start of every sector and at the finish line. The finish is the lap time difference when
+    # both laps were finished, since the grid stops short of the line
+    at_starts = delta[:, np.minimum(np.searchsorted(grid, sector_starts), len(grid) - 1)]
+    finish = delta[:, -1]
+    if lap_times is not None and reference_time is not None:
+        lap_deltas = np.asarray(lap_times, dtype=np.float64) - reference_time
+        finish = np.where(np.isnan(lap_deltas), finish, lap_deltas)
+    sector_deltas = np.diff(np.column_stack((at_starts, finish)), axis=1)
+    return {"delta": delta, "sector_deltas": sector_deltas, "lap_deltas": finish - at_starts[:, 0]}
+
 
 class iRTLDataProcessor:
     """
     Data processor for iRacing telemetry data
     """
-    def __init__(self, datafile_path: str):
+    def __init__(self, datafile_path: str, align: bool = False, cache: LRUCache = None, derived_channels: dict = None, save_lap_index: bool = True):
         """
         Initialize the data processor
+
+        Args:
+            datafile_path (str): Path to the recording (.irtl or .json)
+            align (bool): Resample channels recorded at a lower rate onto the base timebase, so every channel has one sample per tick
+            cache (LRUCache): Cache for derived data. Defaults to the cache shared by every processor (logger.iRTLCache.CACHE)
+            derived_channels (dict): Derived channel definitions, {channel_name: {"expression", "unit", "desc"}}. Defaults to
+                                     DERIVED_CHANNELS and the user's definitions in DERIVED_CHANNELS_FILE
+            save_lap_index (bool): Save the lap index to a sidecar next to the recording when it has to be built
         """
         # Check if datafile exists
         if not os.path.exists(datafile_path):
             raise Exception(f"iRTLDataProcessor.__init__(): Datafile '{datafile_path}' not found!")
+        
+        # Derived data are cached under the recording's path, size and modification time, so a rewritten
+        # recording never hits data derived from its old contents
+        stat = os.stat(datafile_path)
+        self.key = (os.path.abspath(datafile_path), stat.st_size, stat.st_mtime_ns, align)
 
-        # Read datafile
-        with open(datafile_path, "r") as f:
-            self.data = json.load(f)
+        # Read datafile. .irtl recordings are memory-mapped and their channels are views into the file
+        self.file = None
+        self.json_file = None
+        self.align = align
+        self.timebases = {}     # channel_name: time channel, for channels not on the base timebase
+        if datafile_path.endswith(".irtl"):
+            self.file = iRTLFile(datafile_path)
+            self.data = self.file.to_dict(align)
+            if not align:
+                self.timebases = {name: timebase for name, timebase in self.file.timebases.items() if timebase in self.file.tiers}
+        else:
+            # Legacy JSON recordings are scanned without parsing channels that are never used
+            self.json_file = JsonRecording(datafile_path)
+            self.data = self.json_file.to_dict()
         
         # Preprocess the data
         #self.__preprocess_data()
         
-        # Get the number of laps and lap points
-        self.n_laps = np.max(self.data["Lap"]["data"])
-        self.lap_points = self.__get_lap_points()
+        # Index the laps. The index is cached next to the recording, so reopening it doesn't rescan it
+        self.laps = load_lap_index(datafile_path, self.__build_lap_index, save_lap_index)
+        self.n_laps = len(self.laps)
+        self.lap_points = np.array([[lap["start"], lap["end"] - 1] for lap in self.laps], dtype=int).reshape(-1, 2)
+        
+        # Columnar view of the recording. Channels become contiguous arrays on first use and lap data are views into them
+        self.session = Session(self.data, self.laps, self.timebases, cache, self.key)
+        self.cache = self.session.cache
+        
+        # Derived channels. They are only evaluated when first used
+        self.derived = {}       # channel_name: Expression
+        if derived_channels is None:
+            derived_channels = dict(DERIVED_CHANNELS)
+            try:
+                derived_channels.update(load_derived_channels(DERIVED_CHANNELS_FILE))
+            except Exception as e:
+                print(f"WARNING: Could not load the derived channels in '{DERIVED_CHANNELS_FILE}': {e}")
+        for name, definition in derived_channels.items():
+            try:
+                self.add_derived_channel(name, **definition)
+            except Exception as e:
+                print(f"WARNING: Derived channel '{name}' skipped: {e}")
     
     def __preprocess_data(self):
         """
@@ -41,81 +196,383 @@ class iRTLDataProcessor:
         lap_diff_idxs = np.where(np.diff(lap_data) > 0)[0]
         pass
         
-    def __get_lap_points(self):
+    def __build_lap_index(self) -> list:
         """
-        Get the start and end points for each lap
+        Build the lap index (see build_lap_index). Uses the file's runs of the Lap channel when it has them, so
+        the Lap channel doesn't have to be read
         """
-        lap_data = self.data["Lap"]["data"]
-        lap_pts = np.zeros(shape=(self.n_laps,2))
-        lap_end_pts = np.where(np.abs(np.diff(lap_data)) > 0)[0]
-        for i, end_pt in enumerate(lap_end_pts):
-            if i == 0:
-                lap_pts[i] = [0, end_pt]
-            else:
-                lap_pts[i] = [lap_end_pts[i-1]+1, end_pt]
-        lap_pts = np.append(lap_pts, [[lap_end_pts[-1]+1, len(lap_data)-1]], axis=0).astype(int)
-        return lap_pts 
+        if self.file and self.file.laps:
+            values, starts, _ = np.array(self.file.laps, dtype=np.int64).T
+        elif "Lap" in self.data:
+            starts, values = find_runs(np.asarray(self.data["Lap"]["data"]))
+        else:
+            return []
+        
+        channels = {name: np.asarray(self.data[name]["data"]) if name in self.data else None
+                    for name in ["OnPitRoad", "LapDistPct", "LapLastLapTime"]}
+        last_lap_time_time = None
+        if "LapLastLapTime" in self.timebases:
+            last_lap_time_time = np.asarray(self.data[self.timebases["LapLastLapTime"]]["data"])
+        return build_lap_index(starts, values, np.asarray(self.data["time"]["data"]), channels["OnPitRoad"], channels["LapDistPct"],
+                               channels["LapLastLapTime"], last_lap_time_time)
     
-    def get_lap_points(self, lap: int):
+    def get_lap_points(self, lap: int, channel: str = None):
         """
-        Get the start and endpoints for the given lap
+        Get the first and last sample of the given lap. The last sample is included (see Lap.bounds() for the half-open range)
+
+        Args:
+            lap (int): lap number
+            channel (str): Channel the points index into. Channels recorded at a lower rate are indexed by session time
         """
-        return self.lap_points[lap]
+        self.__check_lap(lap, "get_lap_points")
+        lap_pts = self.lap_points[lap]
+        if channel not in self.timebases:
+            return lap_pts
+        
+        time_data = self.data["time"]["data"]
+        tier_time = self.data[self.timebases[channel]]["data"]
+        return np.searchsorted(tier_time, [time_data[lap_pts[0]], time_data[lap_pts[1]]])
     
-    def get_channel_data_for_lap(self, channel: str, lap: int):
+    def __lap_bounds(self, lap: int, channel: str) -> tuple:
         """
-        Get channel data for the specified lap
+        Sample range [start, end) of a lap on a channel's timebase. The caller checks the lap exists
+        """
+        return self.session.laps[lap].bounds(self.session[channel].timebase)
+    
+    def __runs(self, channel: str) -> tuple:
+        """
+        Get the runs of a channel over the whole recording, read from the file without expanding the channel when possible
+
+        Returns:
+            tuple: (start index of every run, value of every run, number of samples)
+        """
+        if self.file and (not self.align or self.file.timebases[channel] not in self.file.tiers):
+            starts, values = self.file.runs(channel)
+            return starts, values, self.file.tiers.get(self.file.timebases[channel], self.file.n_samples)
+        
+        data = np.asarray(self.data[channel]["data"])
+        return (*find_runs(data), len(data))
+    
+    def get_channel_runs(self, channel: str, lap: int = None):
+        """
+        Get a channel as runs of the same value. Step-like channels stored as runs are answered without expanding them
 
         Args:
             channel (str): channel name
-            lap (int): lap number
+            lap (int): Only get the runs within this lap
+
+        Returns:
+            tuple: (start index of every run, value of every run). Start indices are relative to the lap when a lap is given
+        """
+        if not channel in self.data.keys():
+            return None
+        
+        starts, values, _ = self.__runs(channel)
+        if lap is None:
+            return starts, values
+        
+        # Clip the runs to the lap, keeping the run the lap starts in
+        self.__check_lap(lap, "get_channel_runs")
+        start, end = self.__lap_bounds(lap, channel)
+        first = max(np.searchsorted(starts, start, side="right") - 1, 0)
+        last = np.searchsorted(starts, end, side="left")
+        return np.maximum(starts[first:last], start) - start, values[first:last]
+    
+    def get_value_counts(self, channel: str, lap: int = None) -> dict:
+        """
+        Get the number of samples spent at each value of a step-like channel (e.g. samples in each gear)
+
+        Counts are in samples of the channel's own timebase; lower rate channels count ticks when the processor is aligned
+
+        Args:
+            channel (str): channel name
+            lap (int): Only count samples within this lap
         """
         if not channel in self.data.keys():
             return None
         
-        lap_pts = self.get_lap_points(lap)
-        return self.data[channel]["data"][lap_pts[0]:lap_pts[1]]
+        if lap is None:
+            starts, values, n_samples = self.__runs(channel)
+        else:
+            self.__check_lap(lap, "get_value_counts")
+            starts, values = self.get_channel_runs(channel, lap)
+            start, end = self.__lap_bounds(lap, channel)
+            n_samples = end - start
+        lengths = np.diff(starts, append=n_samples)
+        
+        counts = {}
+        for value, length in zip(values.tolist(), lengths.tolist()):
+            counts[value] = counts.get(value, 0) + length
+        return counts
+    
+    def get_channel_time(self, channel: str):
+        """
+        Get the session times a channel was sampled at
+        """
+        return self.data[self.timebases.get(channel, "time")]["data"]
+    
+    def get_channel_data_for_lap(self, channel: str, lap: int, scaled: bool = False):
+        """
+        Get channel data for the specified lap, as a view into the channel's array
+
+        Args:
+            channel (str): channel name
+            lap (int): Position of the lap in the recording (0 to n_laps - 1)
+            scaled (bool): Get values in display units (percentages scaled to 0-100)
+        """
+        if not channel in self.data.keys():
+            return None
+        self.__check_lap(lap, "get_channel_data_for_lap")
+        return self.session.laps[lap].data(channel, scaled)
     
-    def get_channel_data(self, channel: str):
+    def get_channel_data(self, channel: str, scaled: bool = False):
         """
         Get channel data for the entire session
+
+        Args:
+            channel (str): channel name
+            scaled (bool): Get values in display units (percentages scaled to 0-100)
         """
         if not channel in self.data.keys():
             return None
-        return self.data[channel]["data"]
+        return self.session[channel].values if scaled else self.session[channel].raw
+    
+    def get_derived(self, channel: str, lap: int, transform: str, compute):
+        """
+        Get data derived from a channel, cached under (file, channel, lap, transform) within the cache's memory budget
+
+        Args:
+            channel (str): Channel the data are derived from
+            lap (int): Lap the data cover, None for the whole session
+            transform (str): Name of the derivation
+            compute (callable): Computes the data on a cache miss
+        """
+        return self.session.derived(channel, lap, transform, compute)
     
-    def get_lap_data(self, lap: int):
+    def resample_laps(self, channels: list, laps: list = None, n_points: int = 1000, distance: str = "LapDistPct", scaled: bool = False) -> dict:
         """
-        Get data for a specific lap
+        Resample channels of several laps onto a common distance grid, so laps can be overlaid and compared point by point.
+        Every channel missing from the cache is resampled in one pass, and each channel's result is cached
+
+        Args:
+            channels (list): Channel names
+            laps (list): Lap indices, None for every lap
+            n_points (int): Number of grid points around the lap
+            distance (str): Distance channel of the grid, "LapDistPct" or "LapDist"
+            scaled (bool): Resample values in display units (percentages scaled to 0-100)
+
+        Returns:
+            dict: {"distance": grid (n_points,), channel_name: (n_laps, n_points) array}. See resample_laps()
         """
-        if lap > self.n_laps:
-            raise Exception(f"iRTLDataProcessor.get_lap_data(): Lap {lap} does not exist!")
+        if distance not in self.data:
+            raise Exception(f"iRTLDataProcessor.resample_laps(): Distance channel '{distance}' not found in the data!")
+        for channel in channels:
+            if channel not in self.data:
+                raise Exception(f"iRTLDataProcessor.resample_laps(): Channel '{channel}' not found in the data!")
         
-        # Get the lap points for the specified lap
-        lap_pts = self.lap_points[lap]
+        laps = tuple(range(len(self.laps))) if laps is None else tuple(int(lap) for lap in laps)
+        period = self.get_lap_length(distance)
+        grid = np.arange(n_points) * (period / n_points)
+        transform = f"distance:{distance}:{n_points}:{'scaled' if scaled else 'raw'}"
+        
+        # Resample every uncached channel together; the searchsorted over the laps is shared between them
+        missing = [channel for channel in channels if (self.key, channel, laps, transform) not in self.cache]
+        resampled = {}
+        def compute(channel: str) -> np.ndarray:
+            if channel not in resampled:
+                resampled.update(self.__resample_laps(missing if channel in missing else [channel], laps, grid, period, distance, scaled))
+            return resampled[channel]
+        
+        result = {"distance": grid}
+        for channel in channels:
+            result[channel] = self.get_derived(channel, laps, transform, lambda channel=channel: compute(channel))
+        return result
+    
+    def get_lap_length(self, distance: str = "LapDistPct") -> float:
+        """
+        Get the length of a lap in a distance channel's units: 1 for LapDistPct, the longest distance recorded for LapDist
+        """
+        if distance == "LapDistPct":
+            return 1.0
+        return self.get_derived(distance, None, "lap_length", lambda: float(np.nanmax(self.session[distance].raw)))
+    
+    def __resample_laps(self, channels: list, laps: tuple, grid: np.ndarray, period: float, distance: str, scaled: bool) -> dict:
+        """
+        Resample channels onto the distance grid (see resample_laps). Lower rate channels are aligned to the base timebase first
+        """
+        time = self.session["time"].raw
+        data = {}
+        for channel in channels:
+            values = self.session[channel].values if scaled else self.session[channel].raw
+            if channel in self.timebases:
+                values = align_channel(time, self.session[self.timebases[channel]].raw, values)
+            data[channel] = values
+        starts = np.array([self.laps[lap]["start"] for lap in laps], dtype=np.int64)
+        ends = np.array([self.laps[lap]["end"] for lap in laps], dtype=np.int64)
+        return resample_laps(self.session[distance].raw, data, starts, ends, grid, period)
+    
+    def add_derived_channel(self, name: str, expression: str, unit: str = "", desc: str = "") -> bool:
+        """
+        Add a channel computed from an expression over other channels (see logger.iRTLExpr), e.g. "mean(LFtempCL, LFtempCM, LFtempCR)".
+        The expression is compiled once and only evaluated when the channel is first used. Its data are cached under
+        the expression's hash. Inputs recorded on different timebases are aligned to the base timebase
+
+        Args:
+            name (str): Channel name
+            expression (str): Expression. Percentages are read as recorded, as 0-1 fractions
+            unit (str): Unit
+            desc (str): Description
+
+        Returns:
+            bool: False if the recording doesn't have every channel the expression reads
+        """
+        if name in self.data and name not in self.derived:
+            raise Exception(f"iRTLDataProcessor.add_derived_channel(): '{name}' is a recorded channel!")
+        _expression = compile_expression(expression)
+        if name in _expression.channels or not all(channel in self.data for channel in _expression.channels):
+            return False
+        
+        timebases = {self.session[channel].timebase for channel in _expression.channels}
+        timebase = timebases.pop() if len(timebases) == 1 else "time"
+        if timebase != "time":
+            self.timebases[name] = timebase
+        else:
+            self.timebases.pop(name, None)
+        
+        # Redefining a channel changes what the channels computed from it evaluate to
+        if name in self.derived:
+            for derived in self.derived:
+                self.invalidate_cache(derived)
+        self.derived[name] = _expression
+        self.session.add_channel(name, desc, unit, lambda: self.__evaluate(name), f"expr:{_expression.hash}", timebase)
+        self.data[name] = ChannelData(lambda: self.session[name].raw, desc=desc, unit=unit)
+        return True
+    
+    def __evaluate(self, name: str) -> np.ndarray:
+        """
+        Evaluate a derived channel over the whole recording
+        """
+        expression = self.derived[name]
+        timebase = self.session[name].timebase
+        time = self.session[timebase].raw
+        inputs = {}
+        for channel in expression.channels:
+            values = self.session[channel].raw
+            if self.session[channel].timebase != timebase:
+                values = align_channel(time, self.session[self.session[channel].timebase].raw, values)
+            inputs[channel] = values
+        return expression.evaluate(inputs, time)
+    
+    def get_best_lap(self) -> int:
+        """
+        Get the index of the fastest valid lap, or of the fastest finished lap if none is valid
+        """
+        timed = [i for i, lap in enumerate(self.laps) if lap["lap_time"] is not None]
+        valid = [i for i in timed if self.laps[i]["valid"]]
+        if not timed:
+            raise Exception("iRTLDataProcessor.get_best_lap(): No lap was finished!")
+        return min(valid or timed, key=lambda i: self.laps[i]["lap_time"])
+    
+    def get_elapsed_time(self, laps: list = None, n_points: int = 1000, distance: str = "LapDistPct") -> dict:
+        """
+        Get the time into each lap at every point of a distance grid
+
+        Returns:
+            dict: {"distance": grid (n_points,), "elapsed": (n_laps, n_points) array}
+        """
+        resampled = self.resample_laps(["time"], laps, n_points, distance)
+        return {"distance": resampled["distance"], "elapsed": resampled["time"] - resampled["time"][:, :1]}
+    
+    def get_time_deltas(self, laps: list = None, reference="best", n_points: int = 1000, sectors=3, distance: str = "LapDistPct") -> dict:
+        """
+        Get the time delta along the lap of several laps against a reference lap, computed for every lap at once
+        on the distance-resampled session time
+
+        Args:
+            laps (list): Lap indices, None for every lap
+            reference (int | str | tuple): Reference lap: a lap index, "best" for the fastest valid lap, or
+                                           (processor, lap index or "best") for a lap of another recording or session
+            n_points (int): Number of grid points around the lap
+            sectors (int | list): Number of equal sectors, or the distance at which every sector starts
+            distance (str): Distance channel of the grid, "LapDistPct" or "LapDist"
+
+        Returns:
+            dict: {"distance": grid, "laps": lap indices, "reference": {"file", "lap", "lap_time"}, "sector_starts": sector starts,
+                   "delta", "sector_deltas", "lap_deltas"}. See lap_time_deltas(). Laps that didn't cover the grid are NaN
+        """
+        laps = list(range(len(self.laps))) if laps is None else list(laps)
+        processor, ref_lap = reference if isinstance(reference, tuple) else (self, reference)
+        if ref_lap == "best":
+            ref_lap = processor.get_best_lap()
         
-        lap_data = {}
-        for channel in self.data.keys():
-            _data = np.array(self.data[channel]["data"][lap_pts[0]:lap_pts[1]])
-            
-            # Check if channel unit is a percentage
-            if self.data[channel]["unit"] == "%":
-                _data *= 100
-                
-            lap_data[channel] = {
-                "desc": self.data[channel]["desc"],
-                "unit": self.data[channel]["unit"],
-                "data": _data
-            }
-        
-        return lap_data
+        elapsed = self.get_elapsed_time(laps, n_points, distance)
+        grid = elapsed["distance"]
+        ref = processor.get_elapsed_time([ref_lap], n_points, distance)
+        ref_elapsed = ref["elapsed"][0]
+        if processor is not self and not np.array_equal(ref["distance"], grid):
+            ref_elapsed = np.interp(grid, ref["distance"], ref_elapsed)     # LapDist grids follow each recording's track length
+        
+        sector_starts = np.arange(sectors) * (self.get_lap_length(distance) / sectors) if np.isscalar(sectors) else np.asarray(sectors, dtype=np.float64)
+        lap_times = np.array([np.nan if self.laps[lap]["lap_time"] is None else self.laps[lap]["lap_time"] for lap in laps])
+        reference_time = processor.laps[ref_lap]["lap_time"]
+        
+        deltas = lap_time_deltas(elapsed["elapsed"], ref_elapsed, grid, sector_starts, lap_times, reference_time)
+        return {
+            "distance": grid,
+            "laps": laps,
+            "reference": {"file": processor.key[0], "lap": ref_lap, "lap_time": reference_time},
+            "sector_starts": sector_starts,
+            **deltas,
+        }
+    
+    def invalidate_cache(self, channel: str = None):
+        """
+        Drop the cached data derived from this recording (or one of its channels)
+        """
+        self.cache.invalidate(self.key, channel)
+    
+    def cache_stats(self) -> dict:
+        """
+        Get the hit, miss and eviction counters and memory use of the processor's cache
+        """
+        return self.cache.stats()
+
+    def close(self):
+        """
+        Drop the recording's cached data and release the file. Channel data must not be used afterwards
+        """
+        self.invalidate_cache()
+        if self.file:
+            self.file.close()
+        if self.json_file:
+            self.json_file.close()
+
+    def __check_lap(self, lap: int, method: str):
+        """
+        Check that a lap position (0 to n_laps - 1, in recording order) exists
+        """
+        if not 0 <= lap < self.n_laps:
+            raise Exception(f"iRTLDataProcessor.{method}(): Lap {lap} does not exist! The recording has {self.n_laps} laps")
+
+    def get_lap_data(self, lap: int, channels: list = None):
+        """
+        Get data for a specific lap. Percentages are scaled to 0-100. The data are views into the session's
+        arrays and the same dict is returned on every call, so it must not be modified
+
+        Args:
+            lap (int): Position of the lap in the recording (0 to n_laps - 1)
+            channels (list): Channels to get, including derived channels. Defaults to every recorded channel
+        """
+        self.__check_lap(lap, "get_lap_data")
+        return self.session.laps[lap].to_dict(channels)
     
     def get_lap_time(self, lap: int):
         """
-        Get the lap time for a specific lap
+        Get the lap time for a specific lap. Unfinished laps are timed to their last sample
         """
-        if lap > self.n_laps:
-            raise Exception(f"iRTLDataProcessor.get_lap_time(): Lap {lap} does not exist!")
+        self.__check_lap(lap, "get_lap_time")
+        if self.laps[lap]["lap_time"] is not None:
+            return self.laps[lap]["lap_time"]
         
         # Get the lap points for the specified lap
         lap_pts = self.lap_points[lap]
@@ -126,19 +583,20 @@ class iRTLDataProcessor:
         Plot the specified channel across the specified lap
 
         Args:
-            lap (int): Lap number
+            lap (int): Position of the lap in the recording (0 to n_laps - 1)
             channel (str): Channel name
         """
         # Check that the channel is in the list of selected channels to record
         if not channel in self.data.keys():
             raise Exception(f"iRTLDataProcessor.plot_channel_across_lap(): Channel '{channel}' not found in the data!")
-        if lap > self.n_laps:
-            raise Exception(f"iRTLDataProcessor.get_lap_time(): Lap {lap} does not exist!")
+        self.__check_lap(lap, "plot_channel_across_lap")
         
         # Get lap data and extract the channel data
-        lap_data = self.get_lap_data(lap)
-        x = lap_data["time"]["data"]
-        plt.title(f"{channel} (Lap {lap})")
+        timebase = self.session[channel].timebase
+        lap_data = self.get_lap_data(lap, [channel, timebase])
+        x = lap_data[timebase]["data"]
+        import matplotlib.pyplot as plt     # Only needed for these debug plots, and slow to import
+        plt.title(f"{channel} (Lap {self.laps[lap]['lap']})")
         plt.xlabel("Time (s)")
         plt.ylabel(f"{channel} ({lap_data[channel]['unit']})")
         plt.plot(x, lap_data[channel]["data"], label=channel)
@@ -156,22 +614,13 @@ class iRTLDataProcessor:
         if not channel in self.data.keys():
             raise Exception(f"iRTLDataProcessor.plot_channel_across_lap(): Channel '{channel}' not found in the data!")
 
-        time_data = []
-        channel_data = []
-        unit = ""
-        
-        # Iterate through each lap
-        for lap in range(self.n_laps):
-            # Append the lap time to the time data
-            lap_data = self.get_lap_data(lap)
-            channel_data = np.concatenate((channel_data, lap_data[channel]["data"]))
-            time_data = np.concatenate((time_data, lap_data["time"]["data"]))
-            
-            if unit == "":
-                unit = lap_data[channel]["unit"]
-                
+        time_data = self.session[self.timebases.get(channel, "time")].values
+        channel_data = self.session[channel].values
+        unit = self.session[channel].unit
+        
         # Plot the data
-        plt.title(f"{channel} (Laps 1-{self.n_laps})")
+        import matplotlib.pyplot as plt
+        plt.title(f"{channel} (Laps {self.laps[0]['lap']}-{self.laps[-1]['lap']})" if self.laps else channel)
         plt.xlabel("Time (s)")
         plt.ylabel(f"{channel} ({unit})")
         plt.plot(time_data, channel_data, label=channel)
@@ -0,0 +1,187 @@
+"""
+Derived channel expressions
+
+Derived channels are defined as expressions over recorded channels, e.g.
+"mean(LFtempCL, LFtempCM, LFtempCR)". Expressions use a restricted Python grammar: numbers, channel names,
+arithmetic, comparisons, and/or/not, "a if condition else b" and calls to the functions in FUNCTIONS. They
+are parsed and checked once, then compiled to a code object that evaluates the whole expression with
+vectorized NumPy operations over the channel arrays.
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import ast
+import json
+import hashlib
+import numpy as np
+
+MAX_EXPRESSION_LENGTH = 1000
+
+
+def _mean(*args):
+    return np.mean(np.broadcast_arrays(*args), axis=0) if len(args) > 1 else np.asarray(args[0], dtype=np.float64)
+
+
+# Functions expressions can call. deriv() is bound to the channel's timebase when evaluated
+FUNCTIONS = {
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "atan2": np.arctan2,
+    "hypot": np.hypot,
+    "degrees": np.degrees,
+    "radians": np.radians,
+    "sign": np.sign,
+    "floor": np.floor,
+    "min": lambda *args: np.minimum.reduce(np.broadcast_arrays(*args)),
+    "max": lambda *args: np.maximum.reduce(np.broadcast_arrays(*args)),
+    "mean": _mean,
+    "clip": np.clip,
+    "where": np.where,
+    "deriv": None,
+}
+CONSTANTS = {"pi": np.pi}
+
+# Helpers the grammar's boolean operators and conditionals are rewritten to
+_HELPERS = {
+    "_and": lambda *args: np.logical_and.reduce(args),
+    "_or": lambda *args: np.logical_or.reduce(args),
+    "_not": np.logical_not,
+    "_where": np.where,
+}
+
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd, ast.Not,
+              ast.And, ast.Or, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call, ast.Name, ast.Load, ast.Constant) + _OPERATORS
+
+
+class _Vectorize(ast.NodeTransformer):
+    """
+    Rewrite the operators that don't work elementwise on arrays into calls to NumPy helpers
+    """
+    def __call(self, name: str, args: list) -> ast.Call:
+        return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        return self.__call("_and" if isinstance(node.op, ast.And) else "_or", node.values)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        return self.__call("_not", [node.operand]) if isinstance(node.op, ast.Not) else node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self.__call("_where", [node.test, node.body, node.orelse])
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        operands = [node.left] + node.comparators
+        pairs = [ast.Compare(left=left, ops=[op], comparators=[right]) for left, op, right in zip(operands, node.ops, operands[1:])]
+        return self.__call("_and", pairs)
+
+
+class Expression:
+    """
+    Derived channel expression, checked and compiled once
+    """
+    def __init__(self, text: str):
+        """
+        Args:
+            text (str): Expression, e.g. "(LFbrakeLinePress + RFbrakeLinePress) / 2"
+        """
+        self.text = text
+        if len(text) > MAX_EXPRESSION_LENGTH:
+            raise Exception(f"Expression.__init__(): Expression is longer than {MAX_EXPRESSION_LENGTH} characters!")
+        try:
+            tree = ast.parse(text.strip(), mode="eval")
+        except SyntaxError as e:
+            raise Exception(f"Expression.__init__(): Invalid expression '{text}': {e.msg}!")
+
+        self.channels = []  # Channels the expression reads, in order of first use
+        self.__check(tree)
+        self.hash = hashlib.sha1(ast.dump(tree).encode()).hexdigest()[:16]     # Ignores formatting
+        tree = ast.fix_missing_locations(_Vectorize().visit(tree))
+        self.code = compile(tree, "<expression>", "eval")
+
+    def __check(self, tree: ast.AST):
+        """
+        Check that the expression only uses the restricted grammar, and collect the channels it reads
+        """
+        for node in ast.walk(tree):
+            if not isinstance(node, _NODES):
+                raise Exception(f"Expression.__check(): '{type(node).__name__}' is not allowed in expressions ('{self.text}')!")
+            if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+                raise Exception(f"Expression.__check(): Only numbers are allowed as constants ('{self.text}')!")
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                    name = node.func.id if isinstance(node.func, ast.Name) else ast.unparse(node.func)
+                    raise Exception(f"Expression.__check(): Unknown function '{name}' ('{self.text}')!")
+                if node.keywords or not node.args:
+                    raise Exception(f"Expression.__check(): Function '{node.func.id}' takes positional arguments only ('{self.text}')!")
+
+        functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Name) or id(node) in functions:
+                continue
+            if node.id.startswith("_") or node.id in FUNCTIONS:
+                raise Exception(f"Expression.__check(): '{node.id}' can't be used as a channel name ('{self.text}')!")
+            if node.id not in CONSTANTS and node.id not in self.channels:
+                self.channels.append(node.id)
+
+    def evaluate(self, channels: dict, time: np.ndarray = None) -> np.ndarray:
+        """
+        Evaluate the expression
+
+        Args:
+            channels (dict): {channel_name: samples} for every channel the expression reads, all on the same timebase
+            time (np.ndarray): Times of the samples, needed by deriv()
+
+        Returns:
+            np.ndarray: One value per sample. Invalid operations (e.g. division by zero) give inf or NaN
+        """
+        namespace = {**FUNCTIONS, **CONSTANTS, **_HELPERS, **{name: channels[name] for name in self.channels}}
+        if time is not None:
+            namespace["deriv"] = lambda data: np.gradient(data, time) if len(data) > 1 else np.zeros(len(data))
+        with np.errstate(all="ignore"):
+            result = eval(self.code, {"__builtins__": {}}, namespace)
+        length = len(time) if time is not None else len(next(iter(channels.values()), []))
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), (length,)).copy() if np.ndim(result) == 0 else np.asarray(result)
+
+    def __repr__(self) -> str:
+        return f"Expression({self.text!r})"
+
+
+_compiled = {}  # text: Expression
+
+
+def compile_expression(text: str) -> Expression:
+    """
+    Get the compiled expression for a text, parsing and compiling each text only once
+    """
+    if text not in _compiled:
+        _compiled[text] = Expression(text)
+    return _compiled[text]
+
+
+def load_derived_channels(path: str) -> dict:
+    """
+    Load derived channel definitions from a JSON file of {channel_name: {"expression", "unit", "desc"}}
+
+    Returns:
+        dict: Definitions, or an empty dict if the file doesn't exist
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        definitions = json.load(f)
+    for name, definition in definitions.items():
+        if "expression" not in definition:
+            raise Exception(f"load_derived_channels(): Derived channel '{name}' in '{path}' has no expression!")
+    return definitions
@@ -0,0 +1,840 @@
+"""
+Binary telemetry file format for the iRacing Telemetry Logger
+
+Layout (little-endian, every block payload is 8-byte aligned):
+
+    HEADER   b"IRTL" | uint16 version | uint16 reserved | uint32 meta_len | meta JSON
+    BLOCK    b"BLK0" | uint16 channel_id | uint8 encoding | uint8 reserved | uint32 count | uint32 nbytes | payload
+    ...
+    FOOTER   b"FTR0" | uint32 index_len | index JSON
+    TRAILER  uint64 footer_offset | b"IRTL"
+
+The header holds the channel names, units, descriptions and dtypes. Blocks are appended
+while recording, one block per channel per flushed chunk, so a file that was never closed
+(crash, power cut) can be recovered up to the last complete chunk by scanning the blocks.
+When a recording is closed it is compacted to a single contiguous block per channel and
+the footer index (block offsets and lap index) is written, so a reader can mmap the file
+and expose every channel as a NumPy view without parsing anything.
+
+Blocks of step-like channels (gear, lap, flags, tire wear...) are stored as runs when that is
+at least twice as small as the raw samples: a uint32 run count, the uint32 start index of every
+run and the value of every run. Readers can answer lap and value queries from the runs without
+expanding them.
+
+Recordings can also be written compressed. Float channels with a precision (decimal places,
+stored in their header entry) are quantized to scaled integers and integer channels are used
+as-is; the integers are delta encoded, narrowed to the smallest integer type that holds the
+deltas and compressed with zlib or lzma. The writer streams raw chunks while recording, so
+a crash loses as little as possible and the capture thread doesn't wait on the compressor, and
+compresses when the recording is compacted: one compressed block per channel, decoded once
+when the channel is first read. Compressed blocks can't be mapped.
+
+Channels sampled at a lower rate than the sim tick are stored with their own time channel,
+named by the "timebase" field of their header entry (channels without one use "time"). Each
+timebase has its own sample count, kept under "tiers" in the footer index.
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import json
+import mmap
+import zlib
+import lzma
+import struct
+import numpy as np
+from queue import Queue
+from datetime import datetime
+from threading import Thread
+
+MAGIC = b"IRTL"
+VERSION = 1
+ALIGNMENT = 8
+
+HEADER = struct.Struct("<4sHHI")
+BLOCK = struct.Struct("<4sHBBII")
+BLOCK_MAGIC = b"BLK0"
+FOOTER = struct.Struct("<4sI")
+FOOTER_MAGIC = b"FTR0"
+TRAILER = struct.Struct("<Q4s")
+
+# Block payload encodings
+ENCODING_RAW = 0
+ENCODING_RLE = 1
+ENCODING_DELTA_ZLIB = 2
+ENCODING_DELTA_LZMA = 3
+
+# Block encoding used for each compression
+COMPRESSIONS = {
+    "zlib": ENCODING_DELTA_ZLIB,
+    "lzma": ENCODING_DELTA_LZMA,
+}
+DELTA_HEADER = struct.Struct("<bB2x")   # int8 precision (-1 = integer channel) | uint8 delta itemsize
+
+# Time channel of channels sampled on every tick
+BASE_TIMEBASE = "time"
+
+
+def _padding(n: int) -> int:
+    """
+    Number of padding bytes needed to align n to ALIGNMENT
+    """
+    return -n % ALIGNMENT
+
+
+def build_meta(channels: dict, metadata: dict = None) -> dict:
+    """
+    Build the header metadata for a recording
+
+    Args:
+        channels (dict): {channel_name: {"desc": str, "unit": str, "dtype": np.dtype}}
+        metadata (dict): Extra recording metadata to store in the header
+    """
+    return {
+        "format": "iRTL",
+        "version": VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "channels": [
+            {
+                "name": name,
+                "desc": channel["desc"],
+                "unit": channel["unit"],
+                "dtype": np.dtype(channel["dtype"]).str,
+                **({"precision": channel["precision"]} if channel.get("precision") is not None else {}),
+                **({"timebase": channel["timebase"]} if channel.get("timebase", BASE_TIMEBASE) != BASE_TIMEBASE else {}),
+            }
+            for name, channel in channels.items()
+        ],
+        **(metadata or {}),
+    }
+
+
+def find_runs(data: np.ndarray) -> tuple:
+    """
+    Split samples into runs of the same value
+
+    Returns:
+        tuple: (start index of every run, value of every run)
+    """
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64), data[:0]
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    return starts, data[starts]
+
+
+def run_index(starts: np.ndarray, values: np.ndarray, n_samples: int) -> list:
+    """
+    Get [[value, start, end], ...] (end exclusive) for every run
+    """
+    ends = np.append(starts[1:], n_samples)
+    return np.column_stack((values, starts, ends)).astype(int).tolist()
+
+
+def lap_index(lap_data: np.ndarray) -> list:
+    """
+    Build the lap index for a recording from its Lap channel
+
+    Returns:
+        list: [[lap, start, end], ...] with end exclusive, one entry per run of the same lap number
+    """
+    return run_index(*find_runs(lap_data), len(lap_data))
+
+
+def encode_rle(data: np.ndarray):
+    """
+    Encode samples as runs if that is at least twice as small as the raw samples
+
+    Returns:
+        bytes: RLE payload, or None if the samples should be stored raw
+    """
+    starts, values = find_runs(data)
+    starts_nbytes = 8 + 4 * len(starts)
+    nbytes = starts_nbytes + _padding(starts_nbytes) + values.nbytes
+    if nbytes * 2 > data.nbytes:
+        return None
+
+    return b"".join((
+        struct.pack("<II", len(starts), 0),
+        starts.astype(np.uint32).tobytes(),
+        b"\x00" * _padding(starts_nbytes),
+        np.ascontiguousarray(values).tobytes(),
+    ))
+
+
+def read_runs(buf, offset: int, dtype: np.dtype) -> tuple:
+    """
+    Read the runs of an RLE block payload as views into buf
+
+    Returns:
+        tuple: (start index of every run, value of every run)
+    """
+    n_runs, _ = struct.unpack_from("<II", buf, offset)
+    starts = np.frombuffer(buf, dtype=np.uint32, count=n_runs, offset=offset + 8)
+    values_offset = offset + 8 + 4 * n_runs
+    values = np.frombuffer(buf, dtype=dtype, count=n_runs, offset=values_offset + _padding(values_offset))
+    return starts, values
+
+
+def encode_delta(data: np.ndarray, precision: int, encoding: int):
+    """
+    Quantize, delta encode and compress samples
+
+    Args:
+        data (np.ndarray): Samples
+        precision (int): Decimal places kept for float samples. Float samples without a precision aren't encoded
+        encoding (int): ENCODING_DELTA_ZLIB or ENCODING_DELTA_LZMA
+
+    Returns:
+        bytes: Encoded payload, or None if the samples should be stored raw
+    """
+    if data.dtype.kind == "f":
+        if precision is None:
+            return None
+        scaled = data * 10.0 ** precision
+        if not np.isfinite(scaled).all() or (len(scaled) and np.abs(scaled).max() >= 2**53):
+            return None
+        ints = np.rint(scaled).astype(np.int64)
+    elif data.dtype.kind in "iub":
+        precision = -1
+        ints = data.astype(np.int64)
+    else:
+        return None
+
+    # Narrow the deltas to the smallest integer type that holds them
+    deltas = np.diff(ints, prepend=0)
+    for delta_dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(delta_dtype)
+        if len(deltas) == 0 or (deltas.min() >= info.min and deltas.max() <= info.max):
+            break
+    deltas = deltas.astype(delta_dtype).tobytes()
+
+    if encoding == ENCODING_DELTA_LZMA:
+        compressed = lzma.compress(deltas, preset=1)
+    else:
+        compressed = zlib.compress(deltas, 6)
+    payload = DELTA_HEADER.pack(precision, np.dtype(delta_dtype).itemsize) + compressed
+    return payload if len(payload) < data.nbytes else None
+
+
+def decode_delta(buf, offset: int, count: int, encoding: int, dtype: np.dtype) -> np.ndarray:
+    """
+    Decode a quantized, delta encoded and compressed block payload
+    """
+    _, _, _, _, _, nbytes = BLOCK.unpack_from(buf, offset - BLOCK.size)
+    precision, itemsize = DELTA_HEADER.unpack_from(buf, offset)
+    compressed = buf[offset + DELTA_HEADER.size:offset + nbytes]
+    if encoding == ENCODING_DELTA_LZMA:
+        deltas = lzma.decompress(compressed)
+    else:
+        deltas = zlib.decompress(compressed)
+
+    ints = np.cumsum(np.frombuffer(deltas, dtype=f"<i{itemsize}", count=count), dtype=np.int64)
+    if precision < 0:
+        return ints.astype(dtype)
+    return (ints / 10.0 ** precision).astype(dtype)
+
+
+class ChannelData(dict):
+    """
+    {"desc", "unit", "data"} entry of a recording whose "data" is only read (and expanded) when first accessed
+    """
+    def __init__(self, load, **kwargs):
+        super().__init__(**kwargs)
+        self.load = load
+
+    def __missing__(self, key):
+        if key != "data":
+            raise KeyError(key)
+        self["data"] = self.load()
+        return self["data"]
+
+
+def timebases(meta: dict) -> dict:
+    """
+    Get the time channel of every channel in a recording
+
+    Returns:
+        dict: {channel_name: time channel name}
+    """
+    return {channel["name"]: channel.get("timebase", BASE_TIMEBASE) for channel in meta["channels"]}
+
+
+def align(time: np.ndarray, tier_time: np.ndarray, tier_data: np.ndarray) -> np.ndarray:
+    """
+    Resample a channel from its own timebase onto another one, holding the latest sample
+
+    Args:
+        time (np.ndarray): Times to resample to
+        tier_time (np.ndarray): Times the channel was sampled at (ascending)
+        tier_data (np.ndarray): Channel samples
+    """
+    if len(tier_data) == 0:
+        return np.zeros(len(time), dtype=tier_data.dtype)
+    idxs = np.searchsorted(tier_time, time, side="right") - 1
+    return tier_data[np.clip(idxs, 0, len(tier_data) - 1)]
+
+
+class BlockFile:
+    """
+    Appends the header, blocks and footer of an .irtl file
+    """
+    def __init__(self, path: str, meta: dict, compression: str = None):
+        """
+        Create the file and write the header
+
+        Args:
+            path (str): Output file path
+            meta (dict): Header metadata (see build_meta())
+            compression (str): "zlib" or "lzma" to store blocks quantized and compressed, None to store them raw
+        """
+        if compression is not None and compression not in COMPRESSIONS:
+            raise Exception(f"BlockFile.__init__(): Unknown compression '{compression}'!")
+
+        self.path = path
+        self.encoding = COMPRESSIONS.get(compression)
+        self.precisions = {channel["name"]: channel.get("precision") for channel in meta["channels"]}
+        self.names = [channel["name"] for channel in meta["channels"]]
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.index = {name: [] for name in self.names}     # channel_name: [[offset, count, encoding], ...]
+        self.bytes_written = 0
+
+        # Samples written per timebase, counted from each timebase's time channel
+        self.base = BASE_TIMEBASE if BASE_TIMEBASE in self.ids else self.names[0]
+        self.counts = {timebase: 0 for timebase in set(timebases(meta).values()) | {self.base}}
+
+        self.file = open(path, "wb")
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        self.write(HEADER.pack(MAGIC, VERSION, 0, len(meta_bytes)) + meta_bytes)
+        self.write(b"\x00" * _padding(self.bytes_written))
+
+    @property
+    def n_samples(self) -> int:
+        return self.counts[self.base]
+
+    def write(self, data):
+        self.file.write(data)
+        self.bytes_written += memoryview(data).nbytes
+
+    def sync(self):
+        """
+        Make everything written so far durable
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write_block(self, name: str, encoding: int, count: int, payload):
+        """
+        Write a single channel block and add it to the index
+        """
+        nbytes = memoryview(payload).nbytes
+        self.write(BLOCK.pack(BLOCK_MAGIC, self.ids[name], encoding, 0, count, nbytes))
+        self.index[name].append([self.bytes_written, count, encoding])
+        self.write(payload)
+        self.write(b"\x00" * _padding(nbytes))
+        if name in self.counts:
+            self.counts[name] += count
+
+    def write_chunk(self, chunk: dict):
+        """
+        Write one block per channel for a chunk of samples. Step-like channels are stored as runs,
+        other channels are compressed if the file is compressed
+        """
+        for name, data in chunk.items():
+            data = np.ascontiguousarray(data)
+            payload = encode_rle(data)
+            if payload is not None:
+                self.write_block(name, ENCODING_RLE, len(data), payload)
+                continue
+
+            if self.encoding is not None:
+                payload = encode_delta(data, self.precisions[name], self.encoding)
+                if payload is not None:
+                    self.write_block(name, self.encoding, len(data), payload)
+                    continue
+
+            self.write_block(name, ENCODING_RAW, len(data), data)
+
+    def write_footer(self, extra: dict = None):
+        """
+        Write the footer index and trailer
+        """
+        footer_offset = self.bytes_written
+        index = {"n_samples": self.n_samples, "channels": self.index, **(extra or {})}
+        tiers = {timebase: count for timebase, count in self.counts.items() if timebase != self.base}
+        if tiers:
+            index["tiers"] = tiers
+        index_bytes = json.dumps(index).encode("utf-8")
+        self.write(FOOTER.pack(FOOTER_MAGIC, len(index_bytes)) + index_bytes)
+        self.write(TRAILER.pack(footer_offset, MAGIC))
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def write_irtl(path: str, meta: dict, arrays: dict, index: dict = None, compression: str = None):
+    """
+    Write a complete, contiguous .irtl file in one go
+
+    Args:
+        path (str): Output file path
+        meta (dict): Header metadata (see build_meta())
+        arrays (dict): {channel_name: np.ndarray}, every array of a timebase the same length
+        index (dict): Extra entries to store in the footer index
+        compression (str): See BlockFile
+    """
+    index = dict(index or {})
+    if "Lap" in arrays and "laps" not in index:
+        index["laps"] = lap_index(np.asarray(arrays["Lap"]))
+
+    block_file = BlockFile(path, meta, compression)
+    block_file.write_chunk(arrays)
+    block_file.write_footer(index)
+    block_file.close()
+
+
+def compact(path: str, compression: str = None):
+    """
+    Rewrite a segmented recording with a single contiguous block per channel and a lap index
+
+    The compacted file is written next to the original and swapped in once complete, so the
+    segmented file stays intact if anything goes wrong part way through. The swap fails on Windows
+    while another process has the recording mapped; the temporary file is removed and the error raised.
+
+    Args:
+        path (str): Path to the recording
+        compression (str): "zlib" or "lzma" to quantize and compress each channel's block (see BlockFile)
+    """
+    src = iRTLFile(path)
+    if src.is_contiguous and compression is None:
+        src.close()
+        return
+
+    arrays = {name: src.channel(name) for name in src.names}
+    extra = {key: value for key, value in src.index.items() if key not in ("n_samples", "channels", "tiers")}
+    write_irtl(path + ".tmp", src.meta, arrays, extra, compression)
+
+    # Release the source mapping before swapping the files
+    del arrays
+    src.close()
+    try:
+        os.replace(path + ".tmp", path)
+    except OSError:
+        os.remove(path + ".tmp")
+        raise
+
+
+class iRTLFileWriter:
+    """
+    Background writer that streams recorded chunks to an .irtl file.
+
+    Chunks are queued by the capture thread and written, flushed and fsync'd by the writer
+    thread, so closing a recording only has to queue the last partial chunk. Once closed, the
+    writer thread compacts the file to contiguous per-channel arrays, compressing them if the
+    file is compressed.
+    """
+    def __init__(self, path: str, channels: dict, metadata: dict = None, queue_size: int = 64, compact: bool = True, compression: str = None, on_close=None):
+        """
+        Create the file and start the writer thread
+
+        Args:
+            path (str): Output file path
+            channels (dict): {channel_name: {"desc": str, "unit": str, "dtype": np.dtype, "precision": int (optional)}}
+            metadata (dict): Extra recording metadata to store in the header
+            queue_size (int): Maximum number of chunks waiting to be written
+            compact (bool): Rewrite the file with contiguous per-channel arrays when closed
+            compression (str): "zlib" or "lzma" to quantize and compress the file, None to store it raw. Chunks are
+                               written raw and compressed when the file is compacted, or compressed as they are
+                               written if it isn't compacted
+            on_close (callable): Called by the writer thread with the file path once the file is finished
+        """
+        self.path = path
+        self.on_close = on_close
+        self.compact = compact
+        self.compression = compression
+        self.queue = Queue(maxsize=queue_size)
+        self.closed = False
+
+        self.block_file = BlockFile(path, build_meta(channels, metadata), None if compact else compression)
+        self.block_file.sync()
+
+        # Start the writer thread
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write_chunk(self, chunk: dict):
+        """
+        Queue a chunk of samples to be written
+
+        Args:
+            chunk (dict): {channel_name: np.ndarray}, every array the same length. Chunks of each timebase are queued separately
+        """
+        if self.closed:
+            raise Exception(f"iRTLFileWriter.write_chunk(): '{self.path}' is already closed!")
+        self.queue.put(chunk)
+
+    def close(self, index: dict = None):
+        """
+        Queue the footer and close the file. Returns immediately; use join() to wait for the file to be finished
+
+        Args:
+            index (dict): Extra entries to store in the footer index
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(("close", index or {}))
+
+    def join(self, timeout: float = None):
+        """
+        Wait for the writer thread to finish writing the file
+        """
+        self.thread.join(timeout)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    @property
+    def bytes_written(self) -> int:
+        return self.block_file.bytes_written
+
+    def run(self):
+        """
+        Write queued chunks until the file is closed
+        """
+        while True:
+            item = self.queue.get()
+            if isinstance(item, tuple):
+                self.block_file.write_footer(item[1])
+                break
+            self.block_file.write_chunk(item)
+            self.block_file.sync()
+        self.block_file.close()
+
+        # A recording that can't be compacted (e.g. it's open in the plotting tab) is still complete, just segmented
+        if self.compact:
+            try:
+                compact(self.path, self.compression)
+            except Exception as e:
+                print(f"WARNING: iRTLFileWriter.run(): Could not compact '{self.path}', keeping it uncompacted: {e}")
+
+        if self.on_close:
+            try:
+                self.on_close(self.path)
+            except Exception as e:
+                print(f"WARNING: iRTLFileWriter.run(): on_close failed for '{self.path}': {e}")
+
+
+def read_header(buf) -> tuple:
+    """
+    Read the file header
+
+    Returns:
+        tuple: (meta dict, offset of the first block)
+    """
+    magic, version, _, meta_len = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise Exception("iRTLFile.read_header(): Not an iRTL telemetry file!")
+    if version > VERSION:
+        raise Exception(f"iRTLFile.read_header(): Unsupported file version {version}!")
+
+    start = HEADER.size + meta_len
+    meta = json.loads(bytes(buf[HEADER.size:start]).decode("utf-8"))
+    return meta, start + _padding(start)
+
+
+def read_footer(buf):
+    """
+    Read the footer index. Returns None if the file was never closed
+    """
+    if len(buf) < TRAILER.size:
+        return None
+    footer_offset, magic = TRAILER.unpack_from(buf, len(buf) - TRAILER.size)
+    if magic != MAGIC or footer_offset + FOOTER.size > len(buf):
+        return None
+
+    footer_magic, index_len = FOOTER.unpack_from(buf, footer_offset)
+    if footer_magic != FOOTER_MAGIC:
+        return None
+    start = footer_offset + FOOTER.size
+    return json.loads(bytes(buf[start:start + index_len]).decode("utf-8"))
+
+
+def scan_blocks(buf, meta: dict, start: int) -> tuple:
+    """
+    Rebuild the index of a file that was never closed by scanning its blocks
+
+    Only complete chunks are kept, so every channel of a timebase has the same number of samples.
+
+    Returns:
+        tuple: (index dict, offset just past the last complete chunk)
+    """
+    names = [channel["name"] for channel in meta["channels"]]
+    blocks = {name: [] for name in names}     # channel_name: [(offset, count, encoding, end), ...]
+
+    pos = start
+    while pos + BLOCK.size <= len(buf):
+        magic, channel_id, encoding, _, count, nbytes = BLOCK.unpack_from(buf, pos)
+        payload = pos + BLOCK.size
+        end = payload + nbytes + _padding(nbytes)
+        if magic != BLOCK_MAGIC or channel_id >= len(names) or payload + nbytes > len(buf):
+            break   # Reached a torn block or the footer
+        blocks[names[channel_id]].append((payload, count, encoding, end))
+        pos = end
+
+    # Drop the trailing partial chunk of each timebase, if any
+    groups = {}
+    for name, timebase in timebases(meta).items():
+        groups.setdefault(timebase, []).append(name)
+
+    index = {"n_samples": 0, "channels": {}}
+    counts = {}
+    end = start
+    for timebase, group in groups.items():
+        n_chunks = min(len(blocks[name]) for name in group)
+        for name in group:
+            kept = blocks[name][:n_chunks]
+            index["channels"][name] = [[offset, count, encoding] for offset, count, encoding, _ in kept]
+            if kept:
+                end = max(end, kept[-1][3])
+        counts[timebase] = sum(block[1] for block in index["channels"][group[0]])
+
+    base = BASE_TIMEBASE if BASE_TIMEBASE in counts else next(iter(counts), None)
+    index["n_samples"] = counts.pop(base, 0)
+    if counts:
+        index["tiers"] = counts
+    return index, end
+
+
+def recover(path: str) -> bool:
+    """
+    Recover a recording that was never closed by rebuilding and appending its footer
+
+    Args:
+        path (str): Path to the .irtl file
+
+    Returns:
+        bool: True if the file was recovered, False if it was already complete
+    """
+    with open(path, "rb") as f:
+        buf = f.read()
+
+    if read_footer(buf) is not None:
+        return False
+
+    meta, start = read_header(buf)
+    index, end = scan_blocks(buf, meta, start)
+    index["recovered"] = True
+
+    # Drop any torn data and append the footer
+    index_bytes = json.dumps(index).encode("utf-8")
+    with open(path, "r+b") as f:
+        f.truncate(end)
+        f.seek(end)
+        f.write(FOOTER.pack(FOOTER_MAGIC, len(index_bytes)) + index_bytes)
+        f.write(TRAILER.pack(end, MAGIC))
+    return True
+
+
+def decode_block(buf, offset: int, count: int, encoding: int, dtype: np.dtype) -> np.ndarray:
+    """
+    Decode a single block payload. Raw blocks are returned as views into buf
+    """
+    if encoding == ENCODING_RAW:
+        return np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+    if encoding == ENCODING_RLE:
+        starts, values = read_runs(buf, offset, dtype)
+        return np.repeat(values, np.diff(starts, append=count))
+    if encoding in (ENCODING_DELTA_ZLIB, ENCODING_DELTA_LZMA):
+        return decode_delta(buf, offset, count, encoding, dtype)
+    raise Exception(f"iRTLFile.decode_block(): Unknown block encoding {encoding}!")
+
+
+class iRTLFile:
+    """
+    Memory-mapped reader for .irtl recordings.
+
+    Opening a file only reads the header and footer index. Channels stored as a single raw
+    block (every compacted recording) are returned as read-only NumPy views into the mapping.
+    Channels stored as runs are expanded when first accessed, or can be queried as runs.
+    """
+    def __init__(self, path: str):
+        """
+        Open and map a recording
+
+        Args:
+            path (str): Path to the .irtl file
+        """
+        if not os.path.exists(path):
+            raise Exception(f"iRTLFile.__init__(): File '{path}' not found!")
+
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.meta, start = read_header(self.mmap)
+        self.index = read_footer(self.mmap)
+        self.recovered = self.index is None
+        if self.recovered:
+            self.index, _ = scan_blocks(self.mmap, self.meta, start)
+
+        self.channels = {channel["name"]: channel for channel in self.meta["channels"]}
+        self.names = list(self.channels.keys())
+        self.n_samples = self.index["n_samples"]
+        self.timebases = timebases(self.meta)
+        self.tiers = self.index.get("tiers", {})     # Time channel: n_samples, for channels not sampled on every tick
+        self.__cache = {}
+        self.__runs = {}
+
+        # Lap index, rebuilt from the runs of the Lap channel if the file doesn't have one
+        self.laps = self.index.get("laps")
+        if self.laps is None and "Lap" in self.channels:
+            self.laps = run_index(*self.runs("Lap"), self.n_samples)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self.channels
+
+    @property
+    def is_contiguous(self) -> bool:
+        """
+        True if every channel is stored as a single block
+        """
+        return all(len(blocks) <= 1 for blocks in self.index["channels"].values())
+
+    def channel(self, name: str) -> np.ndarray:
+        """
+        Get a channel's samples. Returns a view into the file when the channel is a single raw block
+        """
+        if name in self.__cache:
+            return self.__cache[name]
+
+        dtype = np.dtype(self.channels[name]["dtype"])
+        blocks = [decode_block(self.mmap, offset, count, encoding, dtype) for offset, count, encoding in self.index["channels"][name]]
+        if len(blocks) == 1:
+            data = blocks[0]
+        else:
+            data = np.concatenate(blocks) if blocks else np.empty(0, dtype=dtype)
+        self.__cache[name] = data
+        return data
+
+    def runs(self, name: str) -> tuple:
+        """
+        Get a channel as runs of the same value, without expanding blocks stored as runs
+
+        Returns:
+            tuple: (start index of every run, value of every run)
+        """
+        if name in self.__runs:
+            return self.__runs[name]
+
+        dtype = np.dtype(self.channels[name]["dtype"])
+        all_starts = []
+        all_values = []
+        block_start = 0
+        for offset, count, encoding in self.index["channels"][name]:
+            if encoding == ENCODING_RLE:
+                starts, values = read_runs(self.mmap, offset, dtype)
+            else:
+                starts, values = find_runs(decode_block(self.mmap, offset, count, encoding, dtype))
+            all_starts.append(starts.astype(np.int64) + block_start)
+            all_values.append(values)
+            block_start += count
+
+        if not all_starts:
+            runs = (np.empty(0, dtype=np.int64), np.empty(0, dtype=dtype))
+        else:
+            # Merge runs that continue across block boundaries
+            starts = np.concatenate(all_starts)
+            values = np.concatenate(all_values)
+            keep = np.concatenate(([True], values[1:] != values[:-1]))
+            runs = (starts[keep], values[keep])
+        self.__runs[name] = runs
+        return runs
+
+    def time(self, name: str) -> np.ndarray:
+        """
+        Get the times a channel was sampled at
+        """
+        return self.channel(self.timebases[name])
+
+    def aligned(self, name: str) -> np.ndarray:
+        """
+        Get a channel's samples on the base timebase (one per tick), holding the latest sample of lower rate channels
+        """
+        timebase = self.timebases[name]
+        if timebase not in self.tiers:
+            return self.channel(name)
+        return align(self.channel(BASE_TIMEBASE), self.channel(timebase), self.channel(name))
+
+    def to_dict(self, align: bool = False) -> dict:
+        """
+        Get the recording in the {channel_name: {"desc", "unit", "data"}} layout used by the JSON recordings
+
+        Channel data are only read when first accessed
+
+        Args:
+            align (bool): Resample lower rate channels onto the base timebase, so every channel has one sample per tick
+        """
+        load = self.aligned if align else self.channel
+        return {
+            name: ChannelData(lambda name=name: load(name), desc=channel["desc"], unit=channel["unit"])
+            for name, channel in self.channels.items() if not (align and name in self.tiers)
+        }
+
+    def export_json(self, path: str, precision: int = 3):
+        """
+        Export the recording to the legacy JSON layout. Lower rate channels are aligned to the base timebase
+
+        Args:
+            path (str): Output .json path
+            precision (int): Number of decimal places to round float channels to
+        """
+        output = {}
+        for name, channel in self.channels.items():
+            if name in self.tiers:
+                continue
+            data = self.aligned(name)
+            if data.dtype.kind == "f":
+                data = data.round(precision)
+            output[name] = {"desc": channel["desc"], "unit": channel["unit"], "data": data.tolist()}
+
+        with open(path, "w") as f:
+            json.dump(output, f)
+
+    def close(self):
+        """
+        Release the mapping. Views returned by channel() must not be used afterwards
+        """
+        self.__cache = {}
+        self.__runs = {}
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass    # Views are still alive; the mapping is released when they are
+
+
+def read_irtl(path: str, align: bool = False) -> dict:
+    """
+    Read an .irtl file into the {channel_name: {"desc", "unit", "data"}} layout used by the JSON recordings
+
+    Channel data are views into the mapped file. Files that were never closed are read up to
+    the last complete chunk. See iRTLFile.to_dict() for align.
+    """
+    return iRTLFile(path).to_dict(align)
+
+
+def load_recording(path: str, align: bool = False) -> dict:
+    """
+    Load a recording (.irtl or legacy .json) into the {channel_name: {"desc", "unit", "data"}} layout.
+    Channel data are only read when first accessed
+    """
+    if path.endswith(".irtl"):
+        return read_irtl(path, align)
+
+    from logger.iRTLJson import read_json
+    return read_json(path)
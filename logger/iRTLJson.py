@@ -0,0 +1,202 @@
+"""
+Streaming loader for legacy JSON recordings
+
+Legacy recordings are a single {channel_name: {"desc": str, "unit": str, "data": [...]}} object.
+JsonRecording memory-maps the file and scans its structure once, recording where each channel's
+data array starts and ends without parsing it. Channel lists and headers are then free, and a
+channel's data is parsed straight into a NumPy array only when it is requested, so opening a
+file to plot one channel costs time and memory proportional to that channel.
+
+Copyright © Kyle Ward 2023
+"""
+import re
+import json
+import mmap
+import numpy as np
+from logger.iRTLFile import ChannelData
+
+WHITESPACE = re.compile(rb"[ \t\n\r]*")
+STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+SCALAR = re.compile(rb"[^,\]}\s]+")
+STRUCTURE = re.compile(rb'[\[\]{}"]')
+
+
+class JsonRecording:
+    """
+    Legacy JSON recording, scanned without parsing its data arrays
+    """
+    def __init__(self, path: str):
+        """
+        Open and scan the recording
+
+        Args:
+            path (str): Path to the .json recording
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.buf = b""  # Empty file
+        self.channels = {}  # channel_name: {"desc": str, "unit": str}
+        self.spans = {}     # channel_name: (offset of the data array's "[", offset of its "]")
+        self.__scan()
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self.channels
+
+    def __skip_whitespace(self, pos: int) -> int:
+        return WHITESPACE.match(self.buf, pos).end()
+
+    def __expect(self, pos: int, char: bytes) -> int:
+        """
+        Check for a structural character at pos (after whitespace). Returns the position after it
+        """
+        pos = self.__skip_whitespace(pos)
+        if self.buf[pos:pos + 1] != char:
+            raise Exception(f"JsonRecording.__expect(): Expected '{char.decode()}' at byte {pos} of '{self.path}'!")
+        return pos + 1
+
+    def __string(self, pos: int) -> tuple:
+        """
+        Parse the string at pos. Returns (string, position after it)
+        """
+        match = STRING.match(self.buf, pos)
+        if not match:
+            raise Exception(f"JsonRecording.__string(): Expected a string at byte {pos} of '{self.path}'!")
+        return json.loads(match.group()), match.end()
+
+    def __value_end(self, pos: int) -> int:
+        """
+        Find the end of the JSON value starting at pos, without parsing it
+        """
+        char = self.buf[pos:pos + 1]
+        if char == b'"':
+            return STRING.match(self.buf, pos).end()
+        if char not in (b"[", b"{"):
+            return SCALAR.match(self.buf, pos).end()
+
+        # Arrays of numbers (every data array) have no nested structure, so their end is the next "]"
+        if char == b"[":
+            end = self.buf.find(b"]", pos)
+            if end != -1 and all(self.buf.find(c, pos + 1, end) == -1 for c in (b"[", b"{", b'"')):
+                return end + 1
+
+        # Anything else is skipped bracket by bracket, jumping over strings
+        depth = 0
+        while True:
+            match = STRUCTURE.search(self.buf, pos)
+            if not match:
+                raise Exception(f"JsonRecording.__value_end(): Unterminated value in '{self.path}'!")
+            token = match.group()
+            if token == b'"':
+                pos = STRING.match(self.buf, match.start()).end()
+                continue
+            pos = match.end()
+            depth += 1 if token in (b"[", b"{") else -1
+            if depth == 0:
+                return pos
+
+    def __members(self, pos: int):
+        """
+        Iterate over the members of the object starting at pos, yielding (key, value position).
+        The caller must set self.pos to the end of each value before continuing
+        """
+        self.pos = self.__expect(pos, b"{")
+        self.pos = self.__skip_whitespace(self.pos)
+        if self.buf[self.pos:self.pos + 1] == b"}":
+            self.pos += 1
+            return
+        while True:
+            key, self.pos = self.__string(self.__skip_whitespace(self.pos))
+            self.pos = self.__skip_whitespace(self.__expect(self.pos, b":"))
+            yield key, self.pos
+            self.pos = self.__skip_whitespace(self.pos)
+            char = self.buf[self.pos:self.pos + 1]
+            self.pos += 1
+            if char == b"}":
+                return
+            if char != b",":
+                raise Exception(f"JsonRecording.__members(): Expected ',' or '}}' at byte {self.pos - 1} of '{self.path}'!")
+
+    def __scan(self):
+        """
+        Record every channel's header and the span of its data array
+        """
+        if not len(self.buf):
+            raise Exception(f"JsonRecording.__scan(): '{self.path}' is empty!")
+
+        # The channel objects are iterated while iterating the top-level object. Both share self.pos,
+        # which is left at the end of each channel object
+        for name, pos in self.__members(0):
+            if self.buf[pos:pos + 1] != b"{":
+                self.pos = self.__value_end(pos)    # Not a channel
+                continue
+
+            channel = {"desc": "", "unit": ""}
+            span = None
+            for key, value_pos in self.__members(pos):
+                end = self.__value_end(value_pos)
+                if key == "data" and self.buf[value_pos:value_pos + 1] == b"[":
+                    span = (value_pos, end - 1)
+                elif key != "data":
+                    channel[key] = json.loads(self.buf[value_pos:end])
+                self.pos = end
+
+            if span is not None:
+                self.channels[name] = channel
+                self.spans[name] = span
+
+    def length(self, channel: str) -> int:
+        """
+        Number of samples of a channel, counted without parsing them
+        """
+        start, end = self.spans[channel]
+        raw = self.buf[start + 1:end]
+        return raw.count(b",") + 1 if raw.strip() else 0
+
+    def channel(self, name: str) -> np.ndarray:
+        """
+        Parse a channel's data into an array. Integer (and boolean) channels are int64, others float64 (nulls are NaN).
+        The whole array is validated, so a corrupt or hand-edited channel raises rather than coming back short
+        """
+        if name not in self.spans:
+            raise Exception(f"JsonRecording.channel(): Channel '{name}' not found in '{self.path}'!")
+        start, end = self.spans[name]
+        try:
+            values = json.loads(self.buf[start:end + 1])
+            data = np.array(values)
+            if data.dtype == object:
+                data = np.array(values, dtype=np.float64)     # Nulls among numbers
+        except (ValueError, TypeError) as e:
+            raise Exception(f"JsonRecording.channel(): Channel '{name}' in '{self.path}' is not an array of numbers: {e}!")
+        if data.ndim != 1 or data.dtype.kind not in "biuf":
+            raise Exception(f"JsonRecording.channel(): Channel '{name}' in '{self.path}' is not an array of numbers!")
+        return data.astype(np.int64) if data.dtype.kind == "b" else data
+
+    def to_dict(self, channels: list = None) -> dict:
+        """
+        Get the recording in the {channel_name: {"desc", "unit", "data"}} layout. Channel data are only parsed when first accessed
+
+        Args:
+            channels (list): Channels to include, None for every channel
+        """
+        names = self.channels if channels is None else [name for name in channels if name in self.channels]
+        return {name: ChannelData(lambda name=name: self.channel(name), **self.channels[name]) for name in names}
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self.file.close()
+
+
+def read_json(path: str, channels: list = None) -> dict:
+    """
+    Read a legacy JSON recording into the {channel_name: {"desc", "unit", "data"}} layout, parsing
+    channel data into arrays on first access
+
+    Args:
+        path (str): Path to the .json recording
+        channels (list): Channels to include, None for every channel
+    """
+    return JsonRecording(path).to_dict(channels)
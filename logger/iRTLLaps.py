@@ -0,0 +1,186 @@
+"""
+Lap index for recorded telemetry
+
+Laps are found from the runs of the Lap channel, so .irtl recordings (which store Lap as runs) are indexed
+without expanding it. Each lap is flagged when it isn't a clean flying lap (out/in laps, laps cut short by a
+reset or the end of the recording, laps the car started mid-way through, repeated lap numbers) and timed from
+LapLastLapTime when the SDK reported a time for it, otherwise from its timestamps.
+
+The index is cached in a <recording>.laps.json sidecar keyed by a hash of the recording's contents, so
+reopening a recording doesn't rescan it.
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+LAP_INDEX_SUFFIX = ".laps.json"
+LAP_INDEX_VERSION = 2
+
+PARTIAL_LAP_PCT = 0.05      # A first lap starting further than this into the lap (LapDistPct) was joined mid-way
+LAP_TIME_WINDOW = 5.0       # Seconds after a lap ends in which LapLastLapTime reports its time
+
+# Reasons a lap is not valid
+FLAG_OUT_LAP = "out_lap"        # Started on pit road
+FLAG_IN_LAP = "in_lap"          # Ended on pit road
+FLAG_PARTIAL = "partial"        # Started mid-lap, or the recording ended during it
+FLAG_RESET = "reset"            # Ended without the lap count going up by one (reset, tow, session change)
+FLAG_REPEAT = "repeat"          # Lap number already seen earlier in the recording
+
+
+def build_lap_index(starts: np.ndarray, values: np.ndarray, time: np.ndarray, on_pit_road: np.ndarray = None,
+                    lap_dist_pct: np.ndarray = None, last_lap_time: np.ndarray = None, last_lap_time_time: np.ndarray = None) -> list:
+    """
+    Build the lap index of a recording
+
+    Args:
+        starts (np.ndarray): Start index of every run of the Lap channel
+        values (np.ndarray): Lap number of every run
+        time (np.ndarray): Session time of every sample
+        on_pit_road (np.ndarray): OnPitRoad channel, if recorded
+        lap_dist_pct (np.ndarray): LapDistPct channel, if recorded
+        last_lap_time (np.ndarray): LapLastLapTime channel, if recorded
+        last_lap_time_time (np.ndarray): Session times of the LapLastLapTime samples, if it has its own timebase
+
+    Returns:
+        list: [{"lap", "start", "end", "start_time", "lap_time", "lap_time_source", "flags", "valid"}, ...].
+              Sample ranges are end exclusive. lap_time is None for laps that were never finished
+    """
+    n_samples = len(time)
+    n_laps = len(starts)
+    if n_laps == 0:
+        return []
+    starts = np.asarray(starts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    ends = np.append(starts[1:], n_samples)
+    time = np.asarray(time)
+
+    # A lap is finished when the next lap number is one higher
+    finished = np.append(values[1:] == values[:-1] + 1, False)
+    unfinished = ends == n_samples
+    flags = {
+        FLAG_RESET: ~finished & ~unfinished,
+        FLAG_PARTIAL: unfinished.copy(),
+        FLAG_REPEAT: np.ones(n_laps, dtype=bool),
+    }
+    _, first_seen = np.unique(values, return_index=True)
+    flags[FLAG_REPEAT][first_seen] = False
+    if lap_dist_pct is not None and len(lap_dist_pct):
+        flags[FLAG_PARTIAL][0] |= lap_dist_pct[starts[0]] > PARTIAL_LAP_PCT
+    if on_pit_road is not None and len(on_pit_road):
+        on_pit_road = np.asarray(on_pit_road, dtype=bool)
+        flags[FLAG_OUT_LAP] = on_pit_road[starts]
+        flags[FLAG_IN_LAP] = on_pit_road[ends - 1]
+
+    # Lap times from timestamps: first sample of the lap to the first sample of the next
+    lap_times = np.full(n_laps, np.nan)
+    lap_times[finished] = time[ends[finished]] - time[starts[finished]]
+    sources = np.where(finished, "timestamps", None)
+
+    # The SDK's time for a lap is the first change of LapLastLapTime shortly after the lap ends. Each change is
+    # given to the latest lap that ended before it, so two laps ending close together can't share a time. Laps
+    # timed the same as the previous lap don't change it, and keep their timestamp time. Partial and reset laps
+    # weren't driven from line to line, so whatever the SDK reports after them isn't their time
+    if last_lap_time is not None and len(last_lap_time) > 1:
+        last_lap_time = np.asarray(last_lap_time, dtype=np.float64)
+        change_time = time if last_lap_time_time is None else np.asarray(last_lap_time_time)
+        changes = np.flatnonzero(last_lap_time[1:] != last_lap_time[:-1]) + 1
+        if len(changes):
+            end_times = time[np.minimum(ends, n_samples - 1)]
+            lap = np.searchsorted(end_times, change_time[changes], side="right") - 1
+            changes, lap = changes[lap >= 0], lap[lap >= 0]
+            lap, first = np.unique(lap, return_index=True)
+            changes = changes[first]
+            reported = last_lap_time[changes]
+            delay = change_time[changes] - end_times[lap]
+            timed = finished[lap] & ~flags[FLAG_PARTIAL][lap] & (delay < LAP_TIME_WINDOW) & (reported > 0)
+            lap_times[lap[timed]] = reported[timed]
+            sources[lap[timed]] = "sdk"
+
+    names = list(flags)
+    lap_flags = np.column_stack([flags[name] for name in names])
+    return [
+        {
+            "lap": int(values[i]),
+            "start": int(starts[i]),
+            "end": int(ends[i]),
+            "start_time": float(time[starts[i]]),
+            "lap_time": None if np.isnan(lap_times[i]) else round(float(lap_times[i]), 4),
+            "lap_time_source": sources[i],
+            "flags": [name for name, flag in zip(names, lap_flags[i]) if flag],
+            "valid": not lap_flags[i].any(),
+        }
+        for i in range(n_laps)
+    ]
+
+
+def lap_index_path(recording_path: str) -> str:
+    """
+    Path of the lap index sidecar of a recording
+    """
+    return os.path.splitext(recording_path)[0] + LAP_INDEX_SUFFIX
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Hash of a file's contents
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_lap_index(recording_path: str, build, save: bool = True) -> list:
+    """
+    Get a recording's lap index from its sidecar, building and saving it if the sidecar is missing or stale.
+
+    The sidecar is keyed by the hash of the recording's contents. The recording is only hashed when its size or
+    modification time differ from the sidecar's, so opening an unchanged recording costs one stat() call
+
+    Args:
+        recording_path (str): Path to the recording
+        build (callable): Builds the lap index (see build_lap_index) if it isn't cached
+        save (bool): Save a built (or refreshed) index to the sidecar. Read-only listings only read existing sidecars
+
+    Returns:
+        list: Lap index
+    """
+    path = lap_index_path(recording_path)
+    stat = os.stat(recording_path)
+    digest = None
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached.get("version") == LAP_INDEX_VERSION:
+            if cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+                return cached["laps"]
+            digest = file_hash(recording_path)
+            if cached.get("hash") == digest:
+                if save:
+                    save_lap_index(path, cached["laps"], digest, stat)     # Same contents, e.g. a copy. Refresh the stat key
+                return cached["laps"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    laps = build()
+    if save:
+        save_lap_index(path, laps, digest or file_hash(recording_path), stat)
+    return laps
+
+
+def save_lap_index(path: str, laps: list, digest: str, stat: os.stat_result):
+    """
+    Write a lap index sidecar. Failing to write it (e.g. a read-only folder) only costs rebuilding it next time
+    """
+    cache = {"version": LAP_INDEX_VERSION, "hash": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "laps": laps}
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"WARNING: Could not save the lap index '{path}': {e}")
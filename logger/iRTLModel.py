@@ -0,0 +1,258 @@
+"""
+Columnar session model for recorded iRacing telemetry
+
+A Session holds every channel of a recording as one contiguous NumPy array, read on first use.
+Laps are index ranges into those arrays, so a lap's data is a view: repeated per-lap access
+doesn't copy or allocate arrays. Derived arrays (e.g. scaled channels) are kept in a memory-budgeted cache
+(see logger.iRTLCache) and the lap views into them are released when they are evicted.
+
+Copyright © Kyle Ward 2023
+"""
+import itertools
+import numpy as np
+from logger.iRTLCache import CACHE, LRUCache
+
+BASE_TIMEBASE = "time"
+
+# Units whose values are scaled for display (e.g. 0-1 fractions shown as percentages)
+UNIT_SCALES = {"%": 100}
+
+# Cache keys of sessions that aren't given one
+_session_keys = itertools.count()
+
+
+class Channel:
+    """
+    One channel of a recording
+    """
+    def __init__(self, name: str, desc: str, unit: str, load, timebase: str = BASE_TIMEBASE, session: "Session" = None, transform: str = None):
+        """
+        Args:
+            name (str): Channel name
+            desc (str): Description
+            unit (str): Unit
+            load (callable): Returns the channel's data. Only called the first time the data is used
+            timebase (str): Time channel the channel was sampled against
+            session (Session): Session whose cache holds the channel's derived data
+            transform (str): For channels computed from other channels, the cache transform their data are kept under.
+                             Their data are then recomputed with load whenever the cache has evicted them
+        """
+        self.session = session
+        self.transform = transform
+        self.name = name
+        self.desc = desc
+        self.unit = unit
+        self.timebase = timebase
+        self.scale = UNIT_SCALES.get(unit, 1)
+        self.__load = load
+        self.__raw = None
+        self.__values = None
+
+    @property
+    def raw(self) -> np.ndarray:
+        """
+        Recorded (or computed) values, as one contiguous array
+        """
+        if self.transform is not None and self.session is not None:
+            return self.session.derived(self.name, None, self.transform, lambda: np.ascontiguousarray(self.__load()))
+        if self.__raw is None:
+            self.__raw = np.ascontiguousarray(self.__load())
+            self.__load = None
+        return self.__raw
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        Values in display units (see UNIT_SCALES). Scaled on first use and kept in the session's cache
+        """
+        if self.scale == 1:
+            return self.raw
+        if self.session is not None:
+            return self.session.derived(self.name, None, "scaled", lambda: self.raw * self.scale)
+        if self.__values is None:
+            self.__values = self.raw * self.scale if self.scale != 1 else self.raw
+        return self.__values
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __repr__(self) -> str:
+        return f"Channel({self.name!r}, unit={self.unit!r})"
+
+
+class Lap:
+    """
+    One lap of a session. Channel data are views into the session's arrays
+    """
+    def __init__(self, session: "Session", index: int, number: int, start: int, end: int, flags: list = None, lap_time: float = None):
+        """
+        Args:
+            session (Session): Session the lap belongs to
+            index (int): Position of the lap in the session
+            number (int): Lap number (value of the Lap channel)
+            start (int): First sample of the lap on the base timebase
+            end (int): Sample after the last sample of the lap
+            flags (list): Reasons the lap isn't a valid flying lap (see logger.iRTLLaps)
+            lap_time (float): Lap time, if the lap was finished
+        """
+        self.session = session
+        self.index = index
+        self.number = number
+        self.start = start
+        self.end = end
+        self.flags = flags or []
+        self.valid = not self.flags
+        self.__lap_time = lap_time
+        self.__bounds = {BASE_TIMEBASE: (start, end)}     # timebase: (start, end)
+        self.__views = {}       # (channel_name, scaled): view
+        self.__dict = None
+
+    def bounds(self, timebase: str = BASE_TIMEBASE) -> tuple:
+        """
+        Sample range of the lap on a timebase. Lower rate timebases are indexed by session time
+        """
+        if timebase not in self.__bounds:
+            time = self.session.channels[BASE_TIMEBASE].raw
+            tier_time = self.session.channels[timebase].raw
+            end_time = time[self.end] if self.end < len(time) else np.inf
+            start, end = np.searchsorted(tier_time, [time[self.start], end_time])
+            self.__bounds[timebase] = (int(start), int(end))
+        return self.__bounds[timebase]
+
+    def data(self, channel: str, scaled: bool = False) -> np.ndarray:
+        """
+        Get a channel's data within the lap as a view
+
+        Args:
+            channel (str): Channel name
+            scaled (bool): Get values in display units (see Channel.values) instead of the recorded values
+        """
+        key = (channel, scaled)
+        if key not in self.__views:
+            _channel = self.session[channel]
+            start, end = self.bounds(_channel.timebase)
+            self.__views[key] = (_channel.values if scaled else _channel.raw)[start:end]
+        return self.__views[key]
+
+    def __getitem__(self, channel: str) -> np.ndarray:
+        return self.data(channel)
+
+    def release(self, channel: str):
+        """
+        Drop the lap's views into a channel's derived data, once the session's cache has evicted it
+        """
+        self.__views.pop((channel, True), None)
+        _channel = self.session.channels.get(channel)
+        if _channel is not None and _channel.transform is not None:
+            self.__views.pop((channel, False), None)
+        self.__dict = None
+
+    def to_dict(self, channels: list = None) -> dict:
+        """
+        Get the lap in the {channel_name: {"desc", "unit", "data"}} layout, with values in display units
+
+        Args:
+            channels (list): Channels to include. Defaults to the recorded channels; derived channels are only
+                             evaluated when asked for. The recorded channels' dict is built once and returned on later calls
+        """
+        if channels is not None:
+            return {name: self.__entry(name) for name in channels}
+        if self.__dict is None:
+            self.__dict = {name: self.__entry(name) for name, channel in self.session.channels.items() if channel.transform is None}
+        return self.__dict
+
+    def __entry(self, name: str) -> dict:
+        channel = self.session[name]
+        return {"desc": channel.desc, "unit": channel.unit, "data": self.data(name, scaled=True)}
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.data(BASE_TIMEBASE)
+
+    @property
+    def n_samples(self) -> int:
+        return self.end - self.start
+
+    @property
+    def lap_time(self) -> float:
+        """
+        Lap time from the lap index, else the time from the first sample of the lap to the first sample of the
+        next one (or the lap's last sample)
+        """
+        if self.__lap_time is not None:
+            return self.__lap_time
+        time = self.session.channels[BASE_TIMEBASE].raw
+        return float(time[min(self.end, len(time) - 1)] - time[self.start])
+
+    def __repr__(self) -> str:
+        return f"Lap({self.number}, samples {self.start}-{self.end})"
+
+
+class Session:
+    """
+    A recording as contiguous per-channel arrays, split into laps
+    """
+    def __init__(self, data: dict, laps: list, timebases: dict = None, cache: LRUCache = None, key=None):
+        """
+        Args:
+            data (dict): {channel_name: {"desc", "unit", "data"}}. "data" is only read when a channel is first used
+            laps (list): Lap index, [{"lap", "start", "end", "flags", "lap_time"}, ...] with sample ranges (end exclusive) on the base timebase
+            timebases (dict): {channel_name: time channel} for channels not sampled against the base timebase
+            cache (LRUCache): Cache for derived data. Defaults to the shared cache
+            key (hashable): Identifies the recording in the cache, e.g. its path, size and modification time
+        """
+        timebases = timebases or {}
+        self.cache = CACHE if cache is None else cache
+        self.key = ("session", next(_session_keys)) if key is None else key
+        self.channels = {
+            name: Channel(name, channel["desc"], channel["unit"], lambda channel=channel: channel["data"], timebases.get(name, BASE_TIMEBASE), self)
+            for name, channel in data.items()
+        }
+        self.laps = [Lap(self, i, lap["lap"], lap["start"], lap["end"], lap.get("flags"), lap.get("lap_time")) for i, lap in enumerate(laps)]
+
+    def __getitem__(self, channel: str) -> Channel:
+        return self.channels[channel]
+
+    def add_channel(self, name: str, desc: str, unit: str, compute, transform: str, timebase: str = BASE_TIMEBASE) -> Channel:
+        """
+        Add a channel computed from other channels. Its data are kept in the cache under transform
+        """
+        channel = Channel(name, desc, unit, compute, timebase, self, transform)
+        self.channels[name] = channel
+        for lap in self.laps:
+            lap.release(name)
+        return channel
+
+    def derived(self, channel: str, lap: int, transform: str, compute):
+        """
+        Get data derived from a channel from the cache, computing it on a miss
+
+        Args:
+            channel (str): Channel the data are derived from
+            lap (int): Lap index, None for the whole session
+            transform (str): Name of the derivation, e.g. "scaled"
+            compute (callable): Computes the data
+        """
+        return self.cache.get((self.key, channel, lap, transform), compute, self.__evicted)
+
+    def __evicted(self, key: tuple):
+        for lap in self.laps:
+            lap.release(key[1])
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self.channels
+
+    def __iter__(self):
+        return iter(self.laps)
+
+    def __len__(self) -> int:
+        return len(self.laps)
+
+    def lap(self, number: int) -> Lap:
+        """
+        Get a lap by its lap number
+        """
+        for lap in self.laps:
+            if lap.number == number:
+                return lap
+        raise Exception(f"Session.lap(): Lap {number} does not exist!")
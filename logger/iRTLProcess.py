@@ -0,0 +1,286 @@
+"""
+Out-of-process capture for the iRacing Telemetry Logger
+
+The SDK polling and the file writer run in a separate process, so they don't share the GIL
+with the UI: opening a file or redrawing a plot can't delay samples. The capture process
+publishes samples into a shared memory SampleRing that the UI reads zero-copy, and is driven
+over a control pipe.
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import multiprocessing as mp
+
+sys.path.append(os.getcwd())
+from utils.data_bank import DataBank
+from logger import APP_COMPRESSION
+
+
+def run_capture(conn, cwd: str, logger_kwargs: dict):
+    """
+    Entry point of the capture process. Serves commands from the control pipe until told to exit
+
+    Every command except "channels" is answered with ("ok", result) or ("error", message):
+        ("channels", [channel, ...])    Set the channels to record (applies to the next recording)
+        ("start",)                      Start recording. Returns the ring layout and output path
+        ("stop",)                       Stop recording and wait for the file to be written. Returns the capture stats
+        ("stats",)                      Returns the current capture stats ({} when not recording)
+        ("exit",)                       Stop recording if needed and exit
+    """
+    os.chdir(cwd)
+    sys.path.append(cwd)
+    from logger.iRTL import iRacingTelemetryLogger
+
+    data_bank = DataBank()
+    logger = iRacingTelemetryLogger(data_bank, shared_ring=True, **logger_kwargs)
+
+    while True:
+        try:
+            command, *args = conn.recv()
+        except (EOFError, OSError):
+            command, args = "exit", []   # The UI process is gone
+
+        try:
+            if command == "channels":
+                logger.channels = list(args[0])
+                continue
+            elif command == "start":
+                if not logger.start():
+                    result = None
+                else:
+                    result = {
+                        "shm_name": logger.ring_shm.name,
+                        "names": logger.ring.names,
+                        "capacity": logger.ring.capacity,
+                        "units": logger.ring.units,
+                        "output_path": logger.output_path,
+                    }
+            elif command == "stop":
+                saved = logger.stop()
+                logger.join()
+                result = {"saved": saved, "stats": logger.stats, "output_path": logger.output_path, "index_path": logger.index.path if logger.index else None}
+            elif command == "stats":
+                result = logger.stats_snapshot() if logger.recording else {}
+            elif command == "exit":
+                if logger.recording:
+                    logger.stop()
+                    logger.join()
+                break
+            else:
+                raise Exception(f"run_capture(): Unknown command '{command}'!")
+            reply = ("ok", result)
+        except Exception as e:
+            reply = ("error", str(e))
+
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            pass
+
+    conn.close()
+
+
+def create_logger(data_bank: DataBank, capture_mode: str = "thread", **kwargs):
+    """
+    Create the logger the app records with
+
+    Args:
+        data_bank (DataBank): Data bank the logger publishes to
+        capture_mode (str): "thread" to record in a thread of the app, "process" to record in a separate process
+
+    Keyword Args:
+        Passed on to iRacingTelemetryLogger. compression defaults to logger.APP_COMPRESSION
+
+    Returns:
+        iRacingTelemetryLogger or CaptureProcess: The logger
+    """
+    kwargs.setdefault("compression", APP_COMPRESSION)
+    if capture_mode == "process":
+        return CaptureProcess(data_bank, **kwargs)
+    if capture_mode != "thread":
+        raise Exception(f"create_logger(): Unknown capture mode '{capture_mode}'!")
+    from logger.iRTL import iRacingTelemetryLogger     # Imports the SDK, which process mode keeps out of the UI
+    return iRacingTelemetryLogger(data_bank, **kwargs)
+
+
+class CaptureProcess:
+    """
+    UI-side handle of a capture process. Used in place of iRacingTelemetryLogger
+    (same channels / start() / stop() interface)
+    """
+    def __init__(self, data_bank: DataBank, timeout: float = 30.0, **kwargs):
+        """
+        Start the capture process
+
+        Args:
+            data_bank (DataBank): Data bank the live ring is published to
+            timeout (float): Seconds to wait for the capture process to answer a command
+
+        Keyword Args:
+            Passed on to iRacingTelemetryLogger in the capture process (must be picklable)
+        """
+        self.data_bank = data_bank
+        self.timeout = timeout
+        self.recording = False
+        self.stopping = False   # A stop was sent without waiting and the recording is still being saved
+        self.live_monitor = None
+        self.ring = None
+        self.ring_shm = None
+        self.output_path = None
+        self.recording_path = None  # First segment of the current recording, which names it
+        self.stats = {}
+        self.__channels = list(kwargs.pop("channels", ["Lap", "LapDist"]))
+
+        # Spawn rather than fork, so the child doesn't inherit the UI's threads and Tk state
+        context = mp.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=run_capture, args=(child_conn, os.getcwd(), kwargs), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.send("channels", self.__channels)
+
+    @property
+    def channels(self) -> list:
+        return self.__channels
+
+    @channels.setter
+    def channels(self, channels: list):
+        """
+        Set the channels to record. Takes effect on the next recording
+        """
+        self.__channels = list(channels)
+        self.send("channels", self.__channels)
+
+    def send(self, *command):
+        """
+        Send a command to the capture process without waiting for it to be handled
+        """
+        if not self.process.is_alive():
+            raise Exception("CaptureProcess.send(): The capture process is not running!")
+        self.conn.send(command)
+
+    def request(self, *command):
+        """
+        Send a command to the capture process and wait for its result
+        """
+        self.send(*command)
+        if not self.conn.poll(self.timeout):
+            raise Exception(f"CaptureProcess.request(): No answer to '{command[0]}' after {self.timeout} seconds!")
+        return self.__receive(command[0])
+
+    def __receive(self, command: str):
+        """
+        Read the answer to a command
+        """
+        try:
+            status, result = self.conn.recv()
+        except (EOFError, OSError):
+            raise Exception(f"CaptureProcess.request(): The capture process exited while handling '{command}'!")
+        if status == "error":
+            raise Exception(f"CaptureProcess.request(): '{command}' failed: {result}")
+        return result
+
+    def start(self, live_monitor=None) -> bool:
+        """
+        Start recording in the capture process and attach to its live ring
+
+        Args:
+            live_monitor (LiveMonitor): Live monitor to render samples to, if any
+        """
+        if not self.live_monitor:
+            self.live_monitor = live_monitor
+        if self.stopping:
+            raise Exception("CaptureProcess.start(): The previous recording is still being saved!")
+
+        layout = self.request("start")
+        if layout is None:
+            print("\nERROR: Failed to connect to the iRacing SDK. Please ensure that the iRacing simulator is running\n")
+            return False
+
+        from logger.iRTLRing import attach_shared_ring     # Imports numpy, which the UI only needs once recording
+        self.ring, self.ring_shm = attach_shared_ring(layout["shm_name"], layout["names"], layout["capacity"], layout["units"])
+        self.output_path = self.recording_path = layout["output_path"]
+        self.data_bank.data["live_telemetry"] = self.ring
+        self.recording = True
+
+        if self.live_monitor:
+            self.live_monitor.start_rendering(self.ring)
+        return True
+
+    def stop(self, wait: bool = True) -> bool:
+        """
+        Stop recording
+
+        Args:
+            wait (bool): Wait for the recording to be saved. Otherwise returns at once, and poll_stop() tells when the
+                         recording is saved, so the UI thread isn't blocked while the capture process flushes the file
+
+        Returns:
+            bool: Whether the recording was saved, or None when not waiting
+        """
+        # Detach from the ring before the capture process releases it
+        if self.live_monitor:
+            self.live_monitor.stop_rendering(release=True)
+        self.data_bank.data["live_telemetry"] = {}
+        if self.ring_shm:
+            from logger.iRTLRing import release_shared_ring
+            release_shared_ring(self.ring, self.ring_shm)
+            self.ring = self.ring_shm = None
+
+        # The capture process reports the recording on the shared console
+        self.send("stop")
+        self.recording = False
+        self.stopping = True
+        if not wait:
+            return None
+        if not self.conn.poll(self.timeout):
+            raise Exception(f"CaptureProcess.stop(): No answer to 'stop' after {self.timeout} seconds!")
+        return self.poll_stop()
+
+    def poll_stop(self) -> bool:
+        """
+        Check whether the recording stopped by stop(wait=False) is saved, without blocking
+
+        Returns:
+            bool: Whether the recording was saved, or None while it is still being saved
+        """
+        if not self.stopping:
+            raise Exception("CaptureProcess.poll_stop(): No recording is being stopped!")
+        if not self.conn.poll():
+            if not self.process.is_alive():
+                self.stopping = False
+                raise Exception("CaptureProcess.poll_stop(): The capture process exited while saving the recording!")
+            return None
+
+        self.stopping = False
+        result = self.__receive("stop")
+        self.stats = result["stats"]
+        return result["saved"]
+
+    def open_recordings(self) -> list:
+        """
+        Recordings still being written or saved by the capture process (see iRacingTelemetryLogger.open_recordings())
+        """
+        return [self.recording_path] if self.recording or self.stopping else []
+
+    def publish_stats(self) -> dict:
+        """
+        Fetch the current capture stats from the capture process and publish them to the data bank
+        """
+        stats = self.request("stats") if self.recording else {}
+        self.data_bank.data["capture_stats"] = stats
+        return stats
+
+    def shutdown(self):
+        """
+        Stop the capture process, saving the recording in progress if any
+        """
+        if self.recording:
+            self.stop(wait=False)
+        if self.stopping and self.conn.poll(self.timeout):
+            self.poll_stop()
+        if self.process.is_alive():
+            self.conn.send(("exit",))
+            self.process.join(self.timeout)
+        self.conn.close()
@@ -0,0 +1,360 @@
+"""
+Replayable stand-in for the iRacing SDK
+
+ReplaySDK lays out a memory image identical to the sim's shared memory (header, var headers
+and rotating var buffers) and publishes frames into it on its own clock, so pyirsdk's own
+__getitem__, freeze_var_buffer_latest() and var header parsing run unmodified. It can replay
+an existing recording or a synthetic session at 1x, Nx or as fast as possible, with optional
+publish jitter and dropped ticks, so the capture pipeline can be tested without the sim.
+
+Copyright © Kyle Ward 2023
+"""
+import time
+import struct
+import irsdk
+import numpy as np
+from logger.iRTLStore import SDK_DTYPES
+from logger.iRTLFile import load_recording
+
+# irsdk var types
+TYPE_BOOL = 1
+TYPE_INT = 2
+TYPE_BITFIELD = 3
+TYPE_FLOAT = 4
+TYPE_DOUBLE = 5
+
+# Shared memory layout (see irsdk.Header, irsdk.VarBuffer and irsdk.VarHeader)
+HEADER = struct.Struct("<iiiiiiiiiiiB")
+VAR_BUF = struct.Struct("<ii")
+VAR_BUF_OFFSET = 48
+VAR_HEADER = struct.Struct("<iii?3x32s64s32s")
+MAX_BUFS = 4
+NUM_BUFS = 3
+
+# Recording channels that are stored under a different name than the SDK variable
+RECORDING_NAMES = {"time": "SessionTime", "tick": "SessionTick"}
+
+# Channels that hold integers/flags rather than floats in the SDK
+INT_CHANNELS = ["Gear", "Lap", "LapBestLap", "RaceLaps", "PlayerCarPosition", "SessionNum", "SessionTick", "SessionState"]
+BOOL_CHANNELS = ["BrakeABSactive", "IsOnTrack", "OnPitRoad"]
+
+
+def sdk_type(dtype: np.dtype, name: str = "") -> int:
+    """
+    Get the irsdk var type used to publish a channel with the given dtype
+    """
+    if name == "SessionTime":
+        return TYPE_DOUBLE
+    if dtype.kind == "b":
+        return TYPE_BOOL
+    if dtype.kind == "u":
+        return TYPE_BITFIELD
+    if dtype.kind == "i":
+        return TYPE_INT
+    return TYPE_DOUBLE if dtype.itemsize == 8 else TYPE_FLOAT
+
+
+class RecordingSource:
+    """
+    Frame source that replays an existing recording (.irtl or legacy .json)
+    """
+    def __init__(self, path: str, tick_rate: int = 60):
+        recording = load_recording(path, align=True)
+        self.tick_rate = tick_rate
+        self.columns = {}
+        self.vars = {}      # sdk_name: (sdk type, desc, unit)
+        for name, channel in recording.items():
+            sdk_name = RECORDING_NAMES.get(name, name)
+            data = np.asarray(channel["data"])
+            if data.dtype.kind == "f" and sdk_name in INT_CHANNELS:
+                data = data.astype(np.int32)
+            self.columns[sdk_name] = data
+            self.vars[sdk_name] = (sdk_type(data.dtype, sdk_name), channel["desc"], channel["unit"])
+
+        self.n_frames = min(len(data) for data in self.columns.values())
+
+        # Recordings made before SessionTick was captured tick once per sample
+        if "SessionTick" not in self.columns:
+            self.columns["SessionTick"] = np.arange(self.n_frames, dtype=np.int32)
+            self.vars["SessionTick"] = (TYPE_INT, "Current update number", "")
+
+    def block(self, start: int, stop: int) -> dict:
+        return {name: data[start:stop] for name, data in self.columns.items()}
+
+
+class SyntheticSource:
+    """
+    Frame source that generates a plausible session: laps of a fixed length with smooth,
+    lap-periodic values for every other channel. With session_seconds, the session number
+    increments and laps start over every session_seconds
+    """
+    def __init__(self, channels: list, n_frames: int, tick_rate: int = 60, lap_seconds: float = 90.0, track_length: float = 5000.0, seed: int = 0, session_seconds: float = None):
+        self.tick_rate = tick_rate
+        self.n_frames = n_frames
+        self.lap_ticks = int(lap_seconds * tick_rate)
+        self.session_ticks = int(session_seconds * tick_rate) if session_seconds else n_frames
+        self.track_length = track_length
+
+        names = list(dict.fromkeys(["SessionTime", "SessionTick", "SessionNum", "Lap", "LapDist", "LapDistPct"] + list(channels)))
+        rng = np.random.default_rng(seed)
+        self.phases = {name: rng.uniform(0, 2 * np.pi) for name in names}
+        self.vars = {}
+        for name in names:
+            if name in BOOL_CHANNELS:
+                var_type = TYPE_BOOL
+            elif name in INT_CHANNELS:
+                var_type = TYPE_INT
+            elif name == "SessionTime":
+                var_type = TYPE_DOUBLE
+            else:
+                var_type = TYPE_FLOAT
+            self.vars[name] = (var_type, f"Synthetic {name}", "")
+
+    def block(self, start: int, stop: int) -> dict:
+        ticks = np.arange(start, stop)
+        session, session_tick = np.divmod(ticks, max(self.session_ticks, 1))
+        lap_tick = session_tick % self.lap_ticks
+        pct = lap_tick / self.lap_ticks
+        lap = session_tick // self.lap_ticks
+
+        columns = {}
+        for name, (var_type, _, _) in self.vars.items():
+            wave = np.sin(2 * np.pi * 4 * pct + self.phases[name])
+            if name == "SessionTime":
+                columns[name] = ticks / self.tick_rate
+            elif name == "SessionTick":
+                columns[name] = ticks
+            elif name == "SessionNum":
+                columns[name] = session
+            elif name == "Lap":
+                columns[name] = lap + 1
+            elif name == "LapDistPct":
+                columns[name] = pct
+            elif name == "LapDist":
+                columns[name] = pct * self.track_length
+            elif name == "LapCurrentLapTime":
+                columns[name] = lap_tick / self.tick_rate
+            elif name in ("LapLastLapTime", "LapBestLapTime"):
+                columns[name] = np.where(lap > 0, self.lap_ticks / self.tick_rate, 0.0)
+            elif name in ("RaceLaps", "LapBestLap"):
+                columns[name] = lap
+            elif name == "PlayerCarPosition":
+                columns[name] = np.ones(len(ticks))
+            elif var_type == TYPE_BOOL:
+                columns[name] = wave > 0.9
+            elif var_type == TYPE_INT:
+                columns[name] = np.round(2 + 2 * wave)
+            else:
+                columns[name] = 50 + 50 * wave
+        return columns
+
+
+class ReplaySDK(irsdk.IRSDK):
+    """
+    Drop-in replacement for irsdk.IRSDK that publishes frames from a recording or generator
+    """
+    def __init__(self, source, speed: float = 1.0, jitter: float = 0.0, drop_rate: float = 0.0, loop: bool = False, seed: int = None, block_size: int = 1024):
+        """
+        Initialize the replay
+
+        Args:
+            source (RecordingSource | SyntheticSource): Frames to publish
+            speed (float): Replay speed multiplier. 0 publishes a new frame on every wait (as fast as possible)
+            jitter (float): Maximum random delay added to each frame's publish time, in seconds
+            drop_rate (float): Probability that the sim skips a tick
+            loop (bool): Start over when the source runs out of frames
+            seed (int): Seed for the jitter/drop random generator
+            block_size (int): Number of frames encoded at a time
+        """
+        super().__init__()
+        self.source = source
+        self.speed = speed
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.loop = loop
+        self.block_size = block_size
+        self.rng = np.random.default_rng(seed)
+        self.finished = False
+
+        # Lay out the variables with natural alignment, largest types first
+        names = sorted(source.vars, key=lambda name: -SDK_DTYPES[source.vars[name][0]].itemsize)
+        offsets = []
+        buf_len = 0
+        for name in names:
+            offsets.append(buf_len)
+            buf_len += SDK_DTYPES[source.vars[name][0]].itemsize
+        self.buf_len = buf_len + (-buf_len % 16)
+        self.layout = np.dtype({
+            "names": names,
+            "formats": [SDK_DTYPES[source.vars[name][0]] for name in names],
+            "offsets": offsets,
+            "itemsize": self.buf_len,
+        })
+
+    @classmethod
+    def from_recording(cls, path: str, **kwargs):
+        """
+        Create a replay of an existing recording (.irtl or legacy .json)
+        """
+        return cls(RecordingSource(path), **kwargs)
+
+    @classmethod
+    def synthetic(cls, channels: list, duration: float = 600.0, tick_rate: int = 60, session_seconds: float = None, **kwargs):
+        """
+        Create a replay of a generated session
+
+        Args:
+            channels (list): SDK variable names to publish
+            duration (float): Replay length in seconds
+            tick_rate (int): Sim ticks per second
+            session_seconds (float): Length of each session, None for a single session
+        """
+        return cls(SyntheticSource(channels, int(duration * tick_rate), tick_rate, session_seconds=session_seconds), **kwargs)
+
+    def startup(self, test_file=None, dump_to=None):
+        """
+        Build the shared memory image and publish the first frame
+        """
+        names = self.layout.names
+        var_header_offset = VAR_BUF_OFFSET + MAX_BUFS * 16
+        self.buf_offsets = [var_header_offset + len(names) * VAR_HEADER.size + i * self.buf_len for i in range(NUM_BUFS)]
+        self.memory = bytearray(self.buf_offsets[-1] + self.buf_len)
+
+        # Header, var buffer descriptors and var headers
+        HEADER.pack_into(self.memory, 0, 2, irsdk.StatusField.status_connected, self.source.tick_rate, 0, 0, 0,
+                         len(names), var_header_offset, NUM_BUFS, self.buf_len, 0, 0)
+        for i, buf_offset in enumerate(self.buf_offsets):
+            VAR_BUF.pack_into(self.memory, VAR_BUF_OFFSET + i * 16, 0, buf_offset)
+        for i, name in enumerate(names):
+            var_type, desc, unit = self.source.vars[name]
+            VAR_HEADER.pack_into(self.memory, var_header_offset + i * VAR_HEADER.size,
+                                 var_type, self.layout.fields[name][1], 1, False,
+                                 name.encode("latin-1"), desc.encode("latin-1", "replace")[:63], unit.encode("latin-1", "replace")[:31])
+
+        self.memory_bytes = np.frombuffer(self.memory, dtype=np.uint8)
+        self._shared_mem = self.memory
+        self._header = irsdk.Header(self.memory)
+        self._data_valid_event = True
+        self.is_initialized = True
+
+        # Replay state
+        self.finished = False
+        self.frame = 0              # Index of the current frame within the source
+        self.loops = 0
+        self.published = 0
+        self.dropped = 0
+        self.block_start = None
+        self.slots = 0              # Publish slots elapsed on the replay clock
+        self.start_time = time.perf_counter()
+        self.next_due = self.start_time + self.__frame_period()
+        self.__publish()
+        self.unread = True          # The first frame hasn't been waited on yet
+        return True
+
+    def shutdown(self):
+        self.unfreeze_var_buffer_latest()
+        self._shared_mem = None
+        self._header = None
+        self._data_valid_event = None
+        self.is_initialized = False
+
+    def __frame_bytes(self, frame: int) -> np.ndarray:
+        """
+        Get the encoded var buffer for a frame, encoding a new block of frames when needed
+        """
+        if self.block_start is None or not self.block_start <= frame < self.block_start + self.block_size:
+            self.block_start = frame - frame % self.block_size
+            stop = min(self.block_start + self.block_size, self.source.n_frames)
+            columns = self.source.block(self.block_start, stop)
+            frames = np.zeros(stop - self.block_start, dtype=self.layout)
+            for name in self.layout.names:
+                frames[name] = columns[name]
+            self.block_bytes = frames.view(np.uint8).reshape(len(frames), self.buf_len)
+        return self.block_bytes[frame - self.block_start]
+
+    def __frame_period(self) -> float:
+        return 1.0 / (self.source.tick_rate * self.speed) if self.speed else 0.0
+
+    def __advance(self) -> bool:
+        """
+        Move to the next frame, skipping ticks the sim drops
+
+        Returns:
+            bool: False if the source ran out of frames
+        """
+        self.frame += 1
+        if self.drop_rate and self.rng.random() < self.drop_rate and self.frame + 1 < self.source.n_frames:
+            self.frame += 1
+            self.dropped += 1
+
+        if self.frame >= self.source.n_frames:
+            if not self.loop:
+                self.finished = True
+                return False
+            self.frame -= self.source.n_frames
+            self.loops += 1
+        return True
+
+    def __publish(self):
+        """
+        Write the current frame into the next var buffer, the way the sim does
+        """
+        frame_bytes = self.__frame_bytes(self.frame)
+        buf = self.published % NUM_BUFS
+        offset = self.buf_offsets[buf]
+        self.memory_bytes[offset:offset + self.buf_len] = frame_bytes
+
+        # Looped replays keep time and ticks moving forward
+        if self.loops:
+            frame_offset = self.loops * self.source.n_frames
+            var_offset = self.layout.fields["SessionTick"][1]
+            tick = np.frombuffer(frame_bytes, dtype=np.int32, count=1, offset=var_offset)[0]
+            struct.pack_into("<i", self.memory, offset + var_offset, int(tick) + frame_offset)
+            if "SessionTime" in self.layout.names:
+                var_offset = self.layout.fields["SessionTime"][1]
+                session_time = np.frombuffer(frame_bytes, dtype=np.float64, count=1, offset=var_offset)[0]
+                struct.pack_into("<d", self.memory, offset + var_offset, float(session_time) + frame_offset / self.source.tick_rate)
+
+        # Mark the buffer as the latest one
+        self.published += 1
+        struct.pack_into("<i", self.memory, VAR_BUF_OFFSET + buf * 16, self.published)
+
+    def _wait_valid_data_event(self) -> bool:
+        """
+        Block until the next frame is published (at most 32 ms, like the sim's data-valid event)
+
+        Returns:
+            bool: True if a new frame was published
+        """
+        if self.finished:
+            time.sleep(0.032)
+            return False
+
+        # As fast as possible: every wait publishes the next frame
+        if not self.speed:
+            if self.unread:
+                self.unread = False
+                return True
+            if not self.__advance():
+                return False
+            self.__publish()
+            return True
+
+        # Real-time (or scaled): wait for the next frame's publish time
+        now = time.perf_counter()
+        if self.next_due > now:
+            time.sleep(min(self.next_due - now, 0.032))
+            now = time.perf_counter()
+            if self.next_due > now:
+                return False
+
+        # Catch up on frames that came due while nobody was reading; the sim overwrites them
+        while self.next_due <= now:
+            if not self.__advance():
+                return False
+            self.slots += 1
+            self.next_due = self.start_time + (self.slots + 1) * self.__frame_period()
+            if self.jitter:
+                self.next_due += self.rng.uniform(0, self.jitter)
+        self.__publish()
+        return True
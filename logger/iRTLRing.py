@@ -0,0 +1,134 @@
+"""
+Bounded sample ring for handing live telemetry from the capture thread (or process) to the UI
+
+Copyright © Kyle Ward 2023
+"""
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SampleRing:
+    """
+    Fixed-capacity ring holding the latest samples of every recorded channel.
+
+    There is a single producer (the capture thread) and any number of readers. The producer
+    writes a sample and only then bumps the write counter, so readers never wait on a lock.
+    A reader that falls a full ring behind would see samples being overwritten; window()
+    checks the counter again after reading, like a seqlock, and drops them.
+
+    In shared memory (see create_shared_ring()) the ring is read without pickling or copying
+    anything through a pipe. Windows are still copied out of it, since the producer keeps writing
+    over the ring while the reader holds on to them.
+    """
+    def __init__(self, names: list, capacity: int = 4096, units: dict = None, buffer=None):
+        """
+        Initialize the ring
+
+        Args:
+            names (list): Channel names, in the order samples are pushed
+            capacity (int): Number of samples the ring holds
+            units (dict): {channel_name: unit} for labelling plots
+            buffer (buffer): Optional memory to place the ring in (see SampleRing.nbytes())
+        """
+        self.names = list(names)
+        self.units = units or {}
+        self.columns = {name: i for i, name in enumerate(self.names)}
+        self.capacity = capacity
+
+        # Layout: int64 write counter followed by the (n_channels, capacity) sample matrix
+        if buffer is None:
+            buffer = bytearray(SampleRing.nbytes(len(self.names), capacity))
+        self.counter = np.ndarray((1,), dtype=np.int64, buffer=buffer)
+        self.data = np.ndarray((len(self.names), capacity), dtype=np.float64, buffer=buffer, offset=8)
+
+    @staticmethod
+    def nbytes(n_channels: int, capacity: int) -> int:
+        """
+        Size in bytes of the memory needed for a ring
+        """
+        return 8 + n_channels * capacity * 8
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self.columns
+
+    @property
+    def write_count(self) -> int:
+        """
+        Total number of samples pushed
+        """
+        return int(self.counter[0])
+
+    def push(self, row):
+        """
+        Publish one sample
+
+        Args:
+            row (sequence): One value per channel, in the order of self.names
+        """
+        count = self.counter[0]
+        self.data[:, count % self.capacity] = row
+        self.counter[0] = count + 1
+
+    def window(self, channel: str, n: int, end: int = None) -> np.ndarray:
+        """
+        Get up to n samples of a channel ending at sample number end (defaults to the latest). Windows hold at most
+        capacity - 1 samples: the remaining slot is the one the producer writes next.
+
+        Samples the producer may have overwritten while they were copied are dropped from the start of the window,
+        so a reader that falls behind gets fewer samples rather than torn ones
+        """
+        end = self.write_count if end is None else end
+        n = min(n, end, self.capacity - 1)
+        start = (end - n) % self.capacity
+        row = self.data[self.columns[channel]]
+        if start + n <= self.capacity:
+            samples = row[start:start + n].copy()
+        else:
+            samples = np.concatenate((row[start:], row[:start + n - self.capacity]))
+
+        # The producer is writing sample write_count, in the slot of the sample a full ring before it
+        overwritten = self.write_count - self.capacity + 1 - (end - n)
+        return samples[overwritten:] if overwritten > 0 else samples
+
+
+def create_shared_ring(names: list, capacity: int = 4096, units: dict = None) -> tuple:
+    """
+    Create a ring in a new shared memory block, so other processes can read it zero-copy
+
+    Returns:
+        tuple: (SampleRing, SharedMemory). The creator unlinks the block once done with it
+    """
+    shm = shared_memory.SharedMemory(create=True, size=SampleRing.nbytes(len(names), capacity))
+    return SampleRing(names, capacity, units, buffer=shm.buf), shm
+
+
+def attach_shared_ring(shm_name: str, names: list, capacity: int, units: dict = None) -> tuple:
+    """
+    Attach to a ring created by another process with create_shared_ring()
+
+    The creating process must be a child of this one (or its parent), so both share the same
+    resource tracker and the block is only tracked once; the creator unlinks it
+
+    Returns:
+        tuple: (SampleRing, SharedMemory)
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    return SampleRing(names, capacity, units, buffer=shm.buf), shm
+
+
+def release_shared_ring(ring: SampleRing, shm, unlink: bool = False):
+    """
+    Close a shared memory ring. The ring must not be used afterwards
+
+    Args:
+        ring (SampleRing): Ring placed in the block
+        shm (SharedMemory): Shared memory block
+        unlink (bool): Destroy the block (only done by the process that created it)
+    """
+    ring.counter = ring.data = None
+    try:
+        shm.close()
+    except BufferError:
+        pass    # Views of the ring are still alive; the mapping is released when they are
+    if unlink:
+        shm.unlink()
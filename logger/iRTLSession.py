@@ -0,0 +1,170 @@
+"""
+Session segments and the per-recording index for the iRacing Telemetry Logger
+
+A recording is split into one .irtl segment file per session (see iRTLCapture.SegmentDetector).
+The index file written next to the segments describes every segment with its session, time
+range and laps, so analysis tools can open just the segment they need instead of the whole
+recording.
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import json
+from datetime import datetime
+from threading import Lock
+from logger.iRTLFile import iRTLFile
+
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+
+
+def index_path(recording_path: str) -> str:
+    """
+    Path of the index file for a recording (the path of its first segment)
+    """
+    return os.path.splitext(recording_path)[0] + INDEX_SUFFIX
+
+
+def segment_path(recording_path: str, segment: int) -> str:
+    """
+    Path of a recording's nth segment (1-based). The first segment keeps the recording's name
+    """
+    if segment <= 1:
+        return recording_path
+    base, ext = os.path.splitext(recording_path)
+    return f"{base}_{segment}{ext}"
+
+
+def segment_summary(path: str) -> dict:
+    """
+    Summarize a finished segment file
+
+    Returns:
+        dict: {"n_samples": int, "start_time": float, "end_time": float, "laps": [{"lap", "start", "end", "start_time", "lap_time"}, ...]}.
+              Lap sample ranges are end exclusive. The last lap of a segment is unfinished and has no lap time
+    """
+    recording = iRTLFile(path)
+    try:
+        time = recording.channel("time") if recording.n_samples else []
+        laps = []
+        for lap, start, end in recording.laps or []:
+            # A lap is timed from its first sample to the first sample of the next lap
+            lap_time = round(float(time[end] - time[start]), 3) if end < len(time) else None
+            laps.append({"lap": int(lap), "start": int(start), "end": int(end), "start_time": float(time[start]), "lap_time": lap_time})
+        return {
+            "n_samples": recording.n_samples,
+            "start_time": float(time[0]) if len(time) else None,
+            "end_time": float(time[-1]) if len(time) else None,
+            "laps": laps,
+        }
+    finally:
+        recording.close()
+
+
+def load_index(path: str) -> dict:
+    """
+    Load a recording index. Segment file names are resolved to paths next to the index
+    """
+    with open(path, "r") as f:
+        index = json.load(f)
+    for segment in index["segments"]:
+        segment["path"] = os.path.join(os.path.dirname(os.path.abspath(path)), segment["file"])
+    return index
+
+
+def find_segment(path: str, session_num: int = None, lap: int = None) -> dict:
+    """
+    Find the first segment of a recording matching a session and/or a lap
+
+    Args:
+        path (str): Index file path
+        session_num (int): Session number, None for any session
+        lap (int): Lap the segment must contain, None for any lap
+
+    Returns:
+        dict: Index entry of the segment, with its "path"
+    """
+    for segment in load_index(path)["segments"]:
+        if session_num is not None and segment["session_num"] != session_num:
+            continue
+        if lap is not None and not any(entry["lap"] == lap for entry in segment.get("laps", [])):
+            continue
+        return segment
+    raise Exception(f"find_segment(): No segment of '{path}' matches session {session_num}, lap {lap}!")
+
+
+def open_segment(path: str, session_num: int = None, lap: int = None) -> iRTLFile:
+    """
+    Open the first segment of a recording matching a session and/or a lap (see find_segment())
+    """
+    return iRTLFile(find_segment(path, session_num, lap)["path"])
+
+
+class RecordingIndex:
+    """
+    Index of the segments of a recording, rewritten whenever a segment is started or finished.
+
+    Segments are finished by their writer threads, so entries are updated under a lock and the
+    file is replaced atomically; a crash leaves the index of the last consistent state.
+    """
+    def __init__(self, path: str, metadata: dict = None):
+        """
+        Create the index file
+
+        Args:
+            path (str): Index file path (see index_path())
+            metadata (dict): Recording metadata stored in the index
+        """
+        self.path = path
+        self.lock = Lock()
+        self.index = {
+            "version": INDEX_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "metadata": metadata or {},
+            "segments": [],
+        }
+        self.save()
+
+    @property
+    def segments(self) -> list:
+        return self.index["segments"]
+
+    def add_segment(self, path: str, reason: str, session_num: int = None, session_type: str = None):
+        """
+        Add a segment that is being recorded
+
+        Args:
+            path (str): Segment file path
+            reason (str): Why the segment was started ("start", "session", "lap_reset", "time_jump" or "pause")
+            session_num (int): Session number the segment starts in, if known
+            session_type (str): Session type (e.g. "Practice", "Race"), if known
+        """
+        with self.lock:
+            self.segments.append({
+                "file": os.path.basename(path),
+                "reason": reason,
+                "session_num": session_num,
+                "session_type": session_type,
+                "finished": False,
+            })
+            self.save()
+
+    def finish_segment(self, path: str):
+        """
+        Fill in a segment's samples, time range and laps once its file is finished. Used as the writer's on_close callback
+        """
+        summary = segment_summary(path)
+        with self.lock:
+            for segment in self.segments:
+                if segment["file"] == os.path.basename(path):
+                    segment.update(summary)
+                    segment["finished"] = True
+            self.save()
+
+    def save(self):
+        """
+        Write the index file
+        """
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.index, f, indent=4)
+        os.replace(self.path + ".tmp", self.path)
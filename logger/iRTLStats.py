@@ -0,0 +1,103 @@
+"""
+Capture instrumentation for the iRacing Telemetry Logger
+
+Copyright © Kyle Ward 2023
+"""
+import json
+import time
+
+# Poll durations are counted in power-of-two microsecond bins: bin i holds durations below 2**i us
+N_POLL_BINS = 24
+
+
+class CaptureStats:
+    """
+    Histogram of the time spent polling each tick.
+
+    Recording a duration is a couple of integer operations on a preallocated list, so the
+    capture loop can time every tick. Percentiles are estimated from the histogram bins.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the counters for a new recording
+        """
+        self.start_time = time.perf_counter()
+        self.hist = [0] * N_POLL_BINS
+        self.polls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """
+        Count one poll
+
+        Args:
+            seconds (float): Time spent polling the tick
+        """
+        self.hist[min(int(seconds * 1e6).bit_length(), N_POLL_BINS - 1)] += 1
+        self.polls += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bin holding the qth percentile poll duration, in microseconds
+        """
+        target = q / 100 * self.polls
+        count = 0
+        for i, n in enumerate(self.hist):
+            count += n
+            if n and count >= target:
+                return float(2 ** i)
+        return 0.0
+
+    def summary(self) -> dict:
+        """
+        Get the poll duration counters
+
+        Returns:
+            dict: Counts, mean/p50/p99/max durations in microseconds and the non-empty histogram bins ({upper bound in us: count})
+        """
+        return {
+            "polls": self.polls,
+            "poll_mean_us": self.total / self.polls * 1e6 if self.polls else 0.0,
+            "poll_p50_us": self.percentile(50),
+            "poll_p99_us": self.percentile(99),
+            "poll_max_us": self.max * 1e6,
+            "poll_hist_us": {str(2 ** i): n for i, n in enumerate(self.hist) if n},
+        }
+
+
+def format_stats(stats: dict, monitor_stats: dict = None) -> str:
+    """
+    Format capture stats as a compact status panel for the UI: rate and poll p50/p99/max,
+    dropped/duplicate ticks and writer queue depth, write rate, buffer memory and live monitor lag
+
+    Args:
+        stats (dict): Capture stats (see iRacingTelemetryLogger.stats_snapshot())
+        monitor_stats (dict): Live monitor render stats, if the monitor is running
+    """
+    if not stats:
+        return ""
+    elapsed = stats.get("elapsed") or 0
+    rate = stats["samples"] / elapsed if elapsed > 0 else 0
+    lines = [
+        f"{rate:.0f} Hz  poll {stats.get('poll_p50_us', 0):.0f}/{stats.get('poll_p99_us', 0):.0f}/{stats.get('poll_max_us', 0):.0f} us",
+        f"drop {stats['dropped_ticks']}  dup {stats['duplicate_ticks']}  queue {stats['writer_queue_depth']}",
+        f"{stats['bytes_per_second'] / 1024:.1f} kB/s  buf {stats['buffer_bytes'] / 2**20:.1f} MB",
+    ]
+    if monitor_stats:
+        lines[-1] += f"  lag {monitor_stats.get('lag_samples', 0)}"
+    return "\n".join(lines)
+
+
+def write_stats(path: str, stats: dict):
+    """
+    Write capture stats to a JSON sidecar file
+    """
+    with open(path, "w") as f:
+        json.dump(stats, f, indent=4)
@@ -0,0 +1,213 @@
+"""
+Columnar sample storage for the iRacing Telemetry Logger
+
+Copyright © Kyle Ward 2023
+"""
+import numpy as np
+
+# NumPy dtypes for each iRacing SDK var type (see irsdk.VAR_TYPE_MAP = ['c', '?', 'i', 'I', 'f', 'd'])
+SDK_DTYPES = {
+    0: np.dtype(np.int8),       # char
+    1: np.dtype(np.bool_),      # bool
+    2: np.dtype(np.int32),      # int
+    3: np.dtype(np.uint32),     # bitfield
+    4: np.dtype(np.float32),    # float
+    5: np.dtype(np.float64),    # double
+}
+DEFAULT_DTYPE = np.dtype(np.float64)
+
+
+def sdk_dtype(ir_sdk, channel: str) -> np.dtype:
+    """
+    Get the NumPy dtype for a channel from the SDK's var headers
+
+    Args:
+        ir_sdk (irsdk.IRSDK): Connected SDK instance
+        channel (str): Channel name
+    """
+    var_headers = getattr(ir_sdk, "_var_headers_dict", None) or {}
+    if channel in var_headers:
+        return SDK_DTYPES.get(var_headers[channel].type, DEFAULT_DTYPE)
+    return DEFAULT_DTYPE
+
+
+class ColumnGroup:
+    """
+    Channels sharing a dtype, stored in fixed-size chunks of shape (n_channels, chunk_size).
+
+    Chunks are row-per-channel so each channel's samples are contiguous in memory, and
+    one sample for every channel in the group is written with a single column assignment.
+    """
+    def __init__(self, dtype: np.dtype, names: list, chunk_size: int):
+        self.dtype = dtype
+        self.names = names
+        self.rows = {name: i for i, name in enumerate(names)}
+        self.chunk_size = chunk_size
+        self.chunks = []            # Sealed (full) chunks
+        self.retain_chunks = None   # Max number of sealed chunks to keep in memory (None = keep all)
+        self.active = np.empty((len(names), chunk_size), dtype=dtype)
+
+    def seal(self):
+        """
+        Seal the active chunk and start a new one. Returns the sealed chunk
+        """
+        sealed = self.active
+        self.chunks.append(sealed)
+        if self.retain_chunks is not None and len(self.chunks) > self.retain_chunks:
+            self.chunks.pop(0)
+        self.active = np.empty((len(self.names), self.chunk_size), dtype=self.dtype)
+        return sealed
+
+    @property
+    def nbytes(self) -> int:
+        return (len(self.chunks) + 1) * self.active.nbytes
+
+
+class SampleStore:
+    """
+    Preallocated, chunked column store for recorded samples.
+
+    Appending a sample writes into preallocated typed buffers, so the cost per sample is
+    O(1) and no Python objects are kept per value. Channel data is exposed as NumPy views
+    over the chunks.
+    """
+    def __init__(self, channels: dict, chunk_size: int = 4096):
+        """
+        Initialize the store
+
+        Args:
+            channels (dict): {channel_name: {"desc": str, "unit": str, "dtype": np.dtype}}
+            chunk_size (int): Number of samples per chunk
+        """
+        self.meta = channels
+        self.chunk_size = chunk_size
+        self.n_samples = 0
+        self.pos = 0    # Write position in the active chunks
+        self.on_seal = None     # Callback receiving {channel_name: np.ndarray} for every sealed chunk
+
+        # Group channels by dtype, ordering names so each group is a contiguous slice of a row
+        by_dtype = {}
+        for name, channel in channels.items():
+            by_dtype.setdefault(np.dtype(channel["dtype"]), []).append(name)
+
+        self.groups = []
+        self.slices = []
+        self.names = []
+        self.locations = {}     # channel_name: (group, row)
+        for dtype, names in by_dtype.items():
+            group = ColumnGroup(dtype, names, chunk_size)
+            self.slices.append(slice(len(self.names), len(self.names) + len(names)))
+            self.groups.append(group)
+            self.names.extend(names)
+            for name in names:
+                self.locations[name] = (group, group.rows[name])
+
+        # Staging row used to convert one sample of Python values without allocating
+        self.row = np.zeros(len(self.names), dtype=np.float64)
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self.locations
+
+    def append(self, values):
+        """
+        Append one sample
+
+        Args:
+            values (sequence): One value per channel, in the order of self.names
+        """
+        self.row[:] = values
+        for group, _slice in zip(self.groups, self.slices):
+            group.active[:, self.pos] = self.row[_slice]
+        self.__advance()
+
+    def __advance(self):
+        """
+        Move to the next sample, sealing the active chunks when they are full
+        """
+        self.pos += 1
+        self.n_samples += 1
+        if self.pos == self.chunk_size:
+            sealed = {}
+            for group in self.groups:
+                chunk = group.seal()
+                for name, row in group.rows.items():
+                    sealed[name] = chunk[row]
+            self.pos = 0
+            
+            if self.on_seal:
+                self.on_seal(sealed)
+
+    def retain(self, n_chunks: int):
+        """
+        Only keep the latest n sealed chunks in memory. Used once sealed chunks are persisted elsewhere
+        """
+        for group in self.groups:
+            group.retain_chunks = n_chunks
+
+    def flush(self):
+        """
+        Hand the partially filled active chunk to on_seal. Call once no more samples will be appended
+        """
+        if self.on_seal and self.pos > 0:
+            partial = {}
+            for group in self.groups:
+                for name, row in group.rows.items():
+                    partial[name] = group.active[row, :self.pos]
+            self.on_seal(partial)
+
+    def reset(self):
+        """
+        Start over with no samples. Chunks already handed to on_seal are left untouched, so they
+        can still be written while new samples are appended
+        """
+        for group in self.groups:
+            group.chunks = []
+            group.active = np.empty_like(group.active)
+        self.pos = 0
+        self.n_samples = 0
+
+    def chunks(self, channel: str) -> list:
+        """
+        Get zero-copy views of every chunk of a channel still in memory, in order
+        """
+        group, row = self.locations[channel]
+        views = [chunk[row] for chunk in group.chunks]
+        if self.pos > 0:
+            views.append(group.active[row, :self.pos])
+        return views
+
+    def array(self, channel: str) -> np.ndarray:
+        """
+        Get the full recording of a channel as a single contiguous array (copies)
+        """
+        views = self.chunks(channel)
+        if not views:
+            return np.empty(0, dtype=self.locations[channel][0].dtype)
+        return np.concatenate(views)
+
+    def window(self, channel: str, n: int) -> np.ndarray:
+        """
+        Get the latest n samples of a channel. Returns a view unless the window spans a chunk boundary
+        """
+        group, row = self.locations[channel]
+        n = min(n, self.n_samples)
+        if n <= self.pos:
+            return group.active[row, self.pos - n:self.pos]
+
+        # Window spans back into sealed chunks
+        views = [group.active[row, :self.pos]]
+        remaining = n - self.pos
+        for chunk in reversed(group.chunks):
+            take = min(remaining, self.chunk_size)
+            views.insert(0, chunk[row, self.chunk_size - take:])
+            remaining -= take
+            if remaining == 0:
+                break
+        return np.concatenate(views)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the sample buffers in bytes
+        """
+        return sum(group.nbytes for group in self.groups)
@@ -0,0 +1,238 @@
+"""
+Capture-path benchmark for the iRacing Telemetry Logger
+
+Drives iRacingTelemetryLogger against a ReplaySDK session and reports, for a sweep of channel counts:
+    - Sustained throughput (samples per second when frames are published as fast as they are read)
+    - Tick-interval jitter at the real sim rate (p50/p99/max deviation from the tick period)
+    - CPU time per sample
+    - Resident memory growth, extrapolated to one recorded hour
+    - stop()/save latency
+
+Results are written to a JSON file. Pass --baseline with a previous results file to compare
+branches; the script exits with a non-zero status if any metric regressed past --tolerance.
+
+Usage:
+    python test/bench_capture.py [--counts 2 8 32 0] [--frames 36000] [--realtime 10] [--output FILE] [--baseline FILE]
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from datetime import datetime
+
+sys.path.append(os.getcwd())
+from logger import CHANNELS
+from logger.iRTL import iRacingTelemetryLogger
+from logger.iRTLReplay import ReplaySDK
+from utils.data_bank import DataBank
+
+ALL_CHANNELS = [channel for category in CHANNELS.values() for channel in category]
+
+# Metrics compared against a baseline and whether a higher value is better
+METRICS = {
+    "throughput_hz": True,
+    "jitter_p99_ms": False,
+    "cpu_us_per_sample": False,
+    "rss_mb_per_hour": False,
+    "stop_ms": False,
+}
+
+
+def rss_bytes() -> int:
+    """
+    Resident set size of this process in bytes, or 0 if it can't be read on this platform
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+class TimedLogger(iRacingTelemetryLogger):
+    """
+    Logger that records the time each sample was taken
+    """
+    def __init__(self, *args, max_samples: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sample_times = np.zeros(max_samples)
+        self.n_timed = 0
+
+    def poll(self):
+        if self.n_timed < len(self.sample_times):
+            self.sample_times[self.n_timed] = time.perf_counter()
+            self.n_timed += 1
+        super().poll()
+
+
+def record(channels: list, output_dir: str, n_frames: int, speed: float, max_samples: int = 0) -> dict:
+    """
+    Record a synthetic session from start to finish
+
+    Returns:
+        dict: Measurements of the run
+    """
+    tick_rate = 60
+    sdk = ReplaySDK.synthetic(channels, duration=n_frames / tick_rate, tick_rate=tick_rate, speed=speed, seed=0)
+    logger = TimedLogger(DataBank(), ir_sdk=sdk, output_dir=output_dir, polling_rate_hz=None if not speed else tick_rate, max_samples=max_samples)
+    logger.channels = list(channels)
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    logger.start()
+
+    # Memory growth is measured once the store's retained chunks and the ring are allocated
+    warmup = 3 * logger.chunk_size
+    rss_start = rss_samples = None
+    while not sdk.finished:
+        time.sleep(0.005)
+        if rss_start is None and logger.scheduler.samples >= warmup:
+            rss_samples = logger.scheduler.samples
+            rss_start = rss_bytes()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    rss_end = rss_bytes()
+
+    # Time to stop, including writing the footer and compacting the file
+    stop_start = time.perf_counter()
+    logger.stop()
+    logger.writer.join()
+    stop_time = time.perf_counter() - stop_start
+
+    samples = logger.scheduler.stats()["samples"]
+    return {
+        "n_channels": len(logger.ring.names),
+        "samples": samples,
+        "wall": wall,
+        "cpu": cpu,
+        "rss_growth": rss_end - rss_start if rss_start is not None else 0,
+        "rss_samples": logger.scheduler.stats()["samples"] - rss_samples if rss_start is not None else 0,
+        "stop_time": stop_time,
+        "sample_times": logger.sample_times[:logger.n_timed],
+        "dropped_ticks": logger.scheduler.stats()["dropped_ticks"],
+        "file_bytes": os.path.getsize(logger.output_path),
+    }
+
+
+def bench(channels: list, n_frames: int, realtime_seconds: float) -> dict:
+    """
+    Benchmark the capture path for one set of channels
+    """
+    output_dir = tempfile.mkdtemp()
+
+    # Throughput, CPU and memory: publish frames as fast as the logger reads them
+    fast = record(channels, output_dir, n_frames, speed=0)
+    samples_per_hour = 60 * 3600
+
+    # Jitter: replay at the real sim rate and look at the spacing between samples
+    n_realtime = int(realtime_seconds * 60)
+    realtime = record(channels, output_dir, n_realtime, speed=1.0, max_samples=n_realtime)
+    intervals = np.diff(realtime["sample_times"])
+    jitter = np.abs(intervals - 1 / 60) * 1000 if len(intervals) else np.zeros(1)
+
+    return {
+        "n_channels": fast["n_channels"],
+        "samples": fast["samples"],
+        "throughput_hz": fast["samples"] / fast["wall"],
+        "cpu_us_per_sample": fast["cpu"] / fast["samples"] * 1e6,
+        "rss_mb_per_hour": fast["rss_growth"] / max(fast["rss_samples"], 1) * samples_per_hour / 2**20,
+        "stop_ms": fast["stop_time"] * 1000,
+        "bytes_per_sample": fast["file_bytes"] / fast["samples"],
+        "jitter_p50_ms": float(np.percentile(jitter, 50)),
+        "jitter_p99_ms": float(np.percentile(jitter, 99)),
+        "jitter_max_ms": float(jitter.max()),
+        "realtime_cpu_pct": realtime["cpu"] / realtime["wall"] * 100,
+        "realtime_dropped_ticks": realtime["dropped_ticks"],
+    }
+
+
+def git_revision() -> str:
+    """
+    Current commit and branch, so results from different branches can be told apart
+    """
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+        branch = subprocess.run(["git", "rev-parse", "--abbrev-ref", "HEAD"], capture_output=True, text=True).stdout.strip()
+        return f"{branch}@{rev}"
+    except OSError:
+        return ""
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare results against a baseline run
+
+    Returns:
+        list: Descriptions of the metrics that regressed by more than the tolerance
+    """
+    regressions = []
+    baseline_runs = {run["n_channels"]: run for run in baseline["runs"]}
+    for run in results["runs"]:
+        base = baseline_runs.get(run["n_channels"])
+        if not base:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base[metric], run[metric]
+            if old <= 0:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{run['n_channels']} channels: {metric} {old:.3f} -> {new:.3f} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the telemetry capture path")
+    parser.add_argument("--counts", type=int, nargs="+", default=[2, 8, 32, 0], help="Channel counts to sweep (0 = all channels)")
+    parser.add_argument("--frames", type=int, default=36000, help="Frames recorded per throughput run")
+    parser.add_argument("--realtime", type=float, default=10.0, help="Seconds recorded per real-time jitter run")
+    parser.add_argument("--output", default=None, help="Results file (defaults to data/outputs/bench_capture_<date>.json)")
+    parser.add_argument("--baseline", default=None, help="Previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression before failing")
+    args = parser.parse_args()
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": [],
+    }
+    for count in args.counts:
+        channels = ALL_CHANNELS[:count] if count else ALL_CHANNELS
+        run = bench(channels, args.frames, args.realtime)
+        results["runs"].append(run)
+        print(f"{run['n_channels']:>4} channels: {run['throughput_hz']:>9.0f} samples/s, {run['cpu_us_per_sample']:>6.1f} us/sample, "
+              f"jitter p50/p99/max {run['jitter_p50_ms']:.2f}/{run['jitter_p99_ms']:.2f}/{run['jitter_max_ms']:.2f} ms, "
+              f"{run['rss_mb_per_hour']:.1f} MB/h, stop {run['stop_ms']:.1f} ms")
+
+    output = args.output or os.path.join(os.getcwd(), "data", "outputs", f"bench_capture_{datetime.now().strftime('%m-%d-%Y_%H-%M-%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
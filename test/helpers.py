@@ -0,0 +1,76 @@
+"""
+Recordings shared by the test cases
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import numpy as np
+
+sys.path.append(os.getcwd())
+from utils.data_bank import DataBank
+from logger.iRTL import iRacingTelemetryLogger
+from logger.iRTLReplay import ReplaySDK
+
+SESSION_CHANNELS = ["Lap", "LapDist", "LapDistPct", "Speed", "Throttle", "AirTemp"]
+
+def recording() -> str:
+    """
+    Record three laps of a synthetic replay, with AirTemp on a 1 Hz timebase
+    """
+    sdk = ReplaySDK.synthetic(SESSION_CHANNELS, duration=200, speed=0, seed=7)
+    logger = iRacingTelemetryLogger(DataBank(), ir_sdk=sdk, output_dir=tempfile.mkdtemp(), polling_rate_hz=None)
+    logger.channels = SESSION_CHANNELS
+    logger.start()
+    while not sdk.finished:
+        time.sleep(0.01)
+    logger.stop()
+    logger.writer.join()
+    return logger.output_path
+
+def legacy_recording(n_channels: int = 20, n_samples: int = 20000) -> str:
+    """
+    Write a legacy JSON recording with laps of 5000 samples
+    """
+    rng = np.random.default_rng(0)
+    data = {
+        "time": {"desc": "Session time", "unit": "s", "data": (np.arange(n_samples) / 60).round(6).tolist()},
+        "Lap": {"desc": "Laps started count", "unit": "", "data": (np.arange(n_samples) // 5000 + 1).tolist()},
+        "OnPitRoad": {"desc": "Is the player car on pit road between the cones", "unit": "", "data": [False] * n_samples},
+    }
+    for i in range(n_channels):
+        data[f"Channel{i}"] = {"desc": f"Channel {i}, \"quoted\" [x]", "unit": "m/s", "data": rng.normal(size=n_samples).round(3).tolist()}
+    path = os.path.join(tempfile.mkdtemp(), "legacy.json")
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+    return path
+
+def legacy_laps(slowdowns: list, samples_per_lap: int = 600) -> str:
+    """
+    Write a legacy JSON recording of 10 s laps. Each lap is (sector, seconds): that third of the lap takes that
+    much longer. A final partial lap is added
+    """
+    times, pct, laps = [], [], []
+    t = 0.0
+    for lap, (sector, seconds) in enumerate(slowdowns + [(None, 0)]):
+        n = samples_per_lap if sector is not None else samples_per_lap // 4
+        dist = np.arange(n) / samples_per_lap
+        dt = np.full(n, 10 / samples_per_lap)
+        if sector is not None:
+            dt[(dist >= sector / 3) & (dist < (sector + 1) / 3)] += seconds / (samples_per_lap / 3)
+        times.append(t + np.concatenate(([0], np.cumsum(dt[:-1]))))
+        t = times[-1][-1] + dt[-1]
+        pct.append(dist)
+        laps.append(np.full(n, lap + 1))
+    data = {
+        "time": {"desc": "Session time", "unit": "s", "data": np.concatenate(times).tolist()},
+        "Lap": {"desc": "Laps started count", "unit": "", "data": np.concatenate(laps).tolist()},
+        "LapDistPct": {"desc": "Percentage distance around lap", "unit": "%", "data": np.concatenate(pct).tolist()},
+    }
+    path = os.path.join(tempfile.mkdtemp(), "laps.json")
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
@@ -0,0 +1,89 @@
+"""
+Test cases for batch analytics across recordings
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger.iRTLBatch import analyze, main
+from helpers import legacy_laps
+
+def archive(slowdowns: list, brake_peaks: list) -> str:
+    """
+    Write a folder of legacy JSON recordings of 10 s laps burning 2.5 l per lap, one per (slowdowns, peak front brake pressure)
+    """
+    folder = tempfile.mkdtemp()
+    for i, (laps, peak) in enumerate(zip(slowdowns, brake_peaks)):
+        path = legacy_laps(laps)
+        with open(path) as f:
+            data = json.load(f)
+        time = np.array(data["time"]["data"])
+        n = len(time)
+        data["FuelLevel"] = {"desc": "Liters of fuel remaining", "unit": "l", "data": (50 - 0.25 * time).tolist()}
+        for corner, scale in [("LF", 1.0), ("RF", 0.98), ("LR", 0.6), ("RR", 0.58)]:
+            press = np.zeros(n)
+            press[n // 3] = peak * scale
+            data[f"{corner}brakeLinePress"] = {"desc": "Brake line pressure", "unit": "bar", "data": press.tolist()}
+        with open(os.path.join(folder, f"session_{i}.json"), "w") as f:
+            json.dump(data, f)
+    return folder
+
+def best_lap_time(processor) -> float:
+    return processor.get_lap_time(processor.get_best_lap())
+
+def test_analyze_archive():
+    folder = archive([[(0, 0), (1, 1.5)], [(0, 0.5), (2, 2.0), (1, 0.2)], [(0, 3.0)]], [80.0, 95.0, 70.0])
+    cache_dir = tempfile.mkdtemp()
+    calls = []
+    report = analyze([folder], workers=2, cache_dir=cache_dir, progress=lambda done, total, path: calls.append(done))
+    assert report["computed"] == 3 and report["cached"] == 0 and calls[-1] == 3
+
+    files = {os.path.basename(path): results for path, results in report["files"].items()}
+    assert np.isclose(files["session_0.json"]["laps"]["best"], 10.0, atol=0.02)
+    assert np.isclose(files["session_1.json"]["laps"]["median"], 10.5, atol=0.02)
+    assert np.allclose(files["session_1.json"]["fuel"]["per_lap"], [2.625, 3.0, 2.55], atol=0.01)
+    assert np.isclose(files["session_2.json"]["brakes"]["RR"], 70.0 * 0.58)
+
+    summary = report["summary"]
+    assert summary["laps"]["n_laps"] == 9 and os.path.basename(summary["laps"]["best_file"]) == "session_0.json"
+    assert np.isclose(summary["fuel"]["median"], (2.625 + 2.875) / 2, atol=0.01)
+    assert summary["brakes"]["LF"]["peak"] == 95.0 and os.path.basename(summary["brakes"]["LF"]["file"]) == "session_1.json"
+
+    # Same results in one process, and from the cache without reopening the recordings
+    serial = analyze([folder], workers=1, cache_dir=None)
+    assert serial["files"] == report["files"] and serial["summary"] == report["summary"]
+    cached = analyze([folder], cache_dir=cache_dir)
+    assert cached["computed"] == 0 and cached["cached"] == 3 and cached["files"] == report["files"]
+
+    # A copy of a recording shares its results; a changed one and new metrics are recomputed
+    shutil.copy(os.path.join(folder, "session_0.json"), os.path.join(folder, "session_3.json"))
+    with open(os.path.join(folder, "session_2.json"), "a") as f:
+        f.write(" ")
+    again = analyze([folder], metrics=["laps", best_lap_time], cache_dir=cache_dir)
+    assert again["computed"] == 4 and again["cached"] == 0
+    assert again["files"][os.path.join(folder, "session_3.json")]["test_batch_analytics.best_lap_time"] == \
+        again["files"][os.path.join(folder, "session_0.json")]["laps"]["best"]
+    assert analyze([folder], metrics=["laps"], cache_dir=cache_dir)["cached"] == 4
+
+def test_cli():
+    folder = archive([[(0, 0), (1, 1.5)]], [80.0])
+    with open(os.path.join(folder, "broken.json"), "w") as f:
+        f.write("{")
+    output = os.path.join(folder, "report.json")
+    report = main([folder, "--metrics", "laps", "brakes", "--no-cache", "--output", output])
+    assert "error" in report["files"][os.path.join(folder, "broken.json")]["laps"]
+    with open(output) as f:
+        assert json.load(f)["summary"]["brakes"]["LF"]["peak"] == 80.0
+
+
+if __name__ == "__main__":
+    test_analyze_archive()
+    test_cli()
+    print("All tests passed")
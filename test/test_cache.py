@@ -0,0 +1,80 @@
+"""
+Test cases for the derived data cache
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger.iRTLCache import LRUCache
+from logger.iRTLData import iRTLDataProcessor
+from helpers import recording
+
+def test_lru_budget():
+    cache = LRUCache(max_bytes=3000)
+    evicted = []
+    def compute(n):
+        return lambda: np.zeros(n, dtype=np.uint8)
+
+    a = cache.get(("file", "A", None, "x"), compute(1000), evicted.append)
+    assert cache.get(("file", "A", None, "x"), compute(1000)) is a
+    cache.get(("file", "B", 0, "x"), compute(1000), evicted.append)
+    cache.get(("file", "A", None, "x"), compute(1000))        # A is now the most recently used
+    cache.get(("other", "C", 0, "x"), compute(1500), evicted.append)
+
+    # B was least recently used, so it made room for C
+    assert evicted == [("file", "B", 0, "x")]
+    assert cache.stats() == {"entries": 2, "nbytes": 2500, "max_bytes": 3000, "hits": 2, "misses": 3, "evictions": 1}
+
+    # Values over the budget are returned but not cached
+    assert len(cache.get(("file", "D", None, "x"), compute(5000))) == 5000
+    assert ("file", "D", None, "x") not in cache
+
+    # Invalidating a file drops only its entries
+    cache.invalidate("file")
+    assert list(cache.entries) == [("other", "C", 0, "x")]
+    assert evicted[-1] == ("file", "A", None, "x")
+    cache.resize(1000)
+    assert len(cache) == 0 and cache.nbytes == 0
+
+def test_processor_cache():
+    path = recording()
+    channel_bytes = iRTLDataProcessor(path).session["Throttle"].values.nbytes
+    cache = LRUCache(max_bytes=channel_bytes * 3 // 2)    # Room for one scaled channel
+    processor = iRTLDataProcessor(path, cache=cache)
+
+    # Flipping through laps scales the channel once
+    throttle = [processor.get_channel_data_for_lap("Throttle", lap, scaled=True) for lap in range(3)]
+    for lap in range(3):
+        assert processor.get_channel_data_for_lap("Throttle", lap, scaled=True) is throttle[lap]
+    assert processor.cache_stats()["misses"] == 1
+    assert np.allclose(throttle[1], processor.get_channel_data_for_lap("Throttle", 1) * 100)
+
+    # Scaling another channel evicts it, along with the lap views into it
+    lap_data = processor.get_lap_data(1)
+    pct = processor.get_channel_data("LapDistPct", scaled=True)
+    assert pct.max() > 99
+    assert processor.cache_stats()["evictions"] >= 1
+    assert processor.get_channel_data_for_lap("Throttle", 1, scaled=True) is not throttle[1]
+    assert processor.get_lap_data(1) is not lap_data
+
+    # Derived data of other transforms share the budget, and are dropped with the processor's entries
+    speed = processor.get_derived("Speed", 2, "mean", lambda: np.array([processor.get_channel_data_for_lap("Speed", 2).mean()]))
+    assert processor.get_derived("Speed", 2, "mean", lambda: None) is speed
+    processor.invalidate_cache()
+    assert len(cache) == 0
+
+    # A rewritten recording is cached under a new key
+    other = iRTLDataProcessor(path, cache=cache)
+    assert other.key == processor.key
+    os.utime(path, ns=(0, 0))
+    assert iRTLDataProcessor(path, cache=cache).key != processor.key
+
+
+if __name__ == "__main__":
+    test_lru_budget()
+    test_processor_cache()
+    print("All tests passed")
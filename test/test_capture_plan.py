@@ -0,0 +1,104 @@
+"""
+Test cases for decoding SDK frames with a capture plan
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import struct
+import irsdk
+import numpy as np
+
+sys.path.append(os.getcwd())
+from logger.iRTLCapture import CapturePlan
+from logger.iRTLReplay import HEADER, VAR_BUF, VAR_BUF_OFFSET, VAR_HEADER, MAX_BUFS
+
+# (name, irsdk var type, offset in the var buffer, count, struct code). Offsets are deliberately unaligned
+VARS = [
+    ("OnPitRoad", 1, 0, 1, "?"),
+    ("Speed", 4, 1, 1, "f"),
+    ("Lap", 2, 5, 1, "i"),
+    ("SessionTime", 5, 9, 1, "d"),
+    ("RPM", 4, 17, 1, "f"),
+    ("Gear", 0, 21, 1, "b"),
+    ("CarIdxLap", 2, 24, 4, "4i"),
+    ("EngineWarnings", 3, 40, 1, "I"),
+    ("Throttle", 4, 44, 1, "f"),
+]
+BUF_LEN = 48
+VALUES = {
+    "OnPitRoad": True,
+    "Speed": 41.25,
+    "Lap": 7,
+    "SessionTime": 1234.5678,
+    "RPM": 6500.5,
+    "Gear": -1,
+    "CarIdxLap": (3, 4, 5, 6),
+    "EngineWarnings": 0x20,
+    "Throttle": 0.75,
+}
+
+def hand_built_sdk() -> irsdk.IRSDK:
+    """
+    SDK instance over a hand-built shared memory image holding one frame of VALUES
+    """
+    var_header_offset = VAR_BUF_OFFSET + MAX_BUFS * 16
+    buf_offset = var_header_offset + len(VARS) * VAR_HEADER.size
+    memory = bytearray(buf_offset + BUF_LEN)
+    HEADER.pack_into(memory, 0, 2, irsdk.StatusField.status_connected, 60, 0, 0, 0, len(VARS), var_header_offset, 1, BUF_LEN, 0, 0)
+    VAR_BUF.pack_into(memory, VAR_BUF_OFFSET, 1, buf_offset)
+    for i, (name, var_type, offset, count, code) in enumerate(VARS):
+        VAR_HEADER.pack_into(memory, var_header_offset + i * VAR_HEADER.size, var_type, offset, count, False, name.encode(), b"", b"")
+        value = VALUES[name]
+        struct.pack_into("<" + code, memory, buf_offset + offset, *(value if count > 1 else [value]))
+
+    sdk = irsdk.IRSDK()
+    sdk._shared_mem = memory
+    sdk._header = irsdk.Header(memory)
+    sdk.is_initialized = True
+    return sdk
+
+def sdk_value(sdk: irsdk.IRSDK, name: str):
+    """
+    Value of a variable read through pyirsdk. Char variables come back as bytes and are recorded as int8
+    """
+    value = sdk[name]
+    return int.from_bytes(value, "little", signed=True) if isinstance(value, bytes) else value
+
+def test_decode_mixed_types():
+    sdk = hand_built_sdk()
+    names = [name for name, *_ in VARS if name != "CarIdxLap"]
+    plan = CapturePlan(sdk, names)
+
+    # Channels are grouped by dtype and alignment, and every channel decodes to the SDK's own value
+    assert plan.missing == []
+    assert len(plan.groups) < len(names)
+    row = plan.decode()
+    for i, name in enumerate(names):
+        assert row[i] == np.float64(sdk_value(sdk, name)), name
+    assert row[names.index("Speed")] == 41.25 and row[names.index("Gear")] == -1
+
+    # The snapshot holds the raw values in buffer order
+    assert plan.snapshot() == tuple(sdk_value(sdk, name) for name in names)
+
+def test_arrays_and_missing_variables():
+    sdk = hand_built_sdk()
+    plan = CapturePlan(sdk, ["Lap", "CarIdxLap", "Brake"], err_code=-9)
+
+    # Array variables and variables the SDK doesn't have are left at the error code
+    assert sdk["CarIdxLap"] == [3, 4, 5, 6]
+    assert plan.missing == ["CarIdxLap", "Brake"]
+    assert plan.decode().tolist() == [7, -9, -9]
+    assert plan.snapshot() == (7,)
+
+    # A plan of only missing variables has an empty layout
+    plan = CapturePlan(sdk, ["Brake"])
+    assert plan.groups == [] and plan.layout.size == 0
+    assert plan.snapshot() == ()
+    assert plan.decode().tolist() == [0]
+
+
+if __name__ == "__main__":
+    test_decode_mixed_types()
+    test_arrays_and_missing_variables()
+    print("All tests passed")
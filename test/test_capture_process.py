@@ -0,0 +1,117 @@
+"""
+Test cases for recording in a separate capture process
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.append(os.getcwd())
+from utils.data_bank import DataBank
+from logger.iRTLFile import iRTLFile
+from logger.iRTLProcess import CaptureProcess, create_logger
+from logger.iRTLReplay import ReplaySDK
+
+CHANNELS = ["Lap", "LapDist", "Speed", "RPM", "Throttle"]
+
+def busy(seconds: float) -> int:
+    """
+    Hold the GIL with pure Python work, like a busy UI
+    """
+    end = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < end:
+        n += sum(i * i for i in range(1000))
+    return n
+
+def test_capture_process():
+    data_bank = DataBank()
+    sdk = ReplaySDK.synthetic(CHANNELS, duration=600, speed=1.0, seed=5)
+    capture = CaptureProcess(data_bank, ir_sdk=sdk, output_dir=tempfile.mkdtemp())
+    try:
+        capture.channels = CHANNELS
+        assert capture.start()
+
+        # The ring is read zero-copy from the capture process while this process is busy
+        busy(2.0)
+        ring = data_bank.data["live_telemetry"]
+        assert ring.write_count > 100
+        assert ring.window("Speed", 10).shape == (10,)
+
+        # Capture stats are fetched from the capture process into the data bank
+        assert capture.publish_stats()["polls"] > 100
+        assert data_bank.data["capture_stats"]["samples"] >= ring.write_count
+
+        # Stopping doesn't block; the recording is saved in the background
+        start = time.perf_counter()
+        assert capture.stop(wait=False) is None
+        assert time.perf_counter() - start < 0.5
+        try:
+            capture.start()
+            raise AssertionError("Started while saving")
+        except Exception as e:
+            assert "still being saved" in str(e)
+        deadline = time.perf_counter() + capture.timeout
+        while (saved := capture.poll_stop()) is None:
+            assert time.perf_counter() < deadline
+            time.sleep(0.05)
+        assert saved
+        stats = capture.stats
+        assert stats["dropped_ticks"] == 0
+        assert iRTLFile(capture.output_path).n_samples == stats["samples"]
+    finally:
+        capture.shutdown()
+    assert not capture.process.is_alive()
+
+def test_app_capture_modes():
+    from app import parse_args
+    assert parse_args([]).capture_mode == "process"
+
+    for mode in ["process", "thread"]:
+        # Create the logger the way the app does for the mode given on its command line
+        data_bank = DataBank()
+        capture_mode = parse_args(["--capture-mode", mode]).capture_mode
+        sdk = ReplaySDK.synthetic(CHANNELS, duration=600, speed=1.0, seed=9)
+        logger = create_logger(data_bank, capture_mode, ir_sdk=sdk, output_dir=tempfile.mkdtemp())
+        assert isinstance(logger, CaptureProcess) == (mode == "process")
+        try:
+            logger.channels = CHANNELS
+            assert logger.start()
+            time.sleep(0.5)
+
+            # Stop the way MainScreen.toggle_recording() does: the capture process saves in the background while
+            # the UI polls, the thread logger saves before stop() returns
+            if mode == "process":
+                assert logger.stop(wait=False) is None
+                assert logger.open_recordings() == [logger.recording_path]
+                deadline = time.perf_counter() + logger.timeout
+                while (saved := logger.poll_stop()) is None:
+                    assert time.perf_counter() < deadline
+                    time.sleep(0.1)
+            else:
+                saved = logger.stop()
+                logger.join()
+            assert saved
+            assert logger.open_recordings() == []
+            recording = iRTLFile(logger.output_path)
+            assert recording.n_samples == logger.stats["samples"] > 0
+            recording.close()
+
+            # Closing the app mid-recording saves the recording (see iRTLApp.close())
+            if mode == "process":
+                assert logger.start()
+                time.sleep(0.5)
+                logger.shutdown()
+                assert not logger.process.is_alive()
+                assert iRTLFile(logger.output_path).n_samples > 0
+        finally:
+            if mode == "process":
+                logger.shutdown()
+
+
+if __name__ == "__main__":
+    test_capture_process()
+    test_app_capture_modes()
+    print("All tests passed")
@@ -0,0 +1,93 @@
+"""
+Test cases for the session catalog
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger.iRTLCache import LRUCache
+from logger.iRTLCatalog import SessionCatalog, recording_date
+from logger.iRTLData import iRTLDataProcessor
+from helpers import recording, legacy_laps
+
+def test_incremental_scan():
+    outputs = tempfile.mkdtemp()
+    irtl = shutil.copy(recording(), os.path.join(outputs, "iRTL_03-14-2023_19-30-05.irtl"))
+    legacy = shutil.copy(legacy_laps([(0, 0), (1, 1.5)]), os.path.join(outputs, "legacy.json"))
+    with open(os.path.join(outputs, "broken.irtl"), "w") as f:
+        f.write("not a recording")
+    catalog = SessionCatalog(os.path.join(outputs, "catalog.sqlite"), outputs)
+
+    calls = []
+    assert catalog.scan(progress=lambda done, total, path: calls.append((done, total))) == \
+        {"added": 2, "updated": 0, "removed": 0, "unchanged": 0, "failed": 1, "skipped": 0}
+    assert calls[0] == (0, 3) and calls[-1] == (3, 3)
+
+    # Indexing writes nothing next to the recordings; unchanged and broken files aren't reopened
+    assert sorted(os.listdir(outputs)) == ["broken.irtl", "catalog.sqlite", "iRTL_03-14-2023_19-30-05.irtl", "legacy.json"]
+    assert catalog.scan() == {"added": 0, "updated": 0, "removed": 0, "unchanged": 3, "failed": 0, "skipped": 0}
+
+    recordings = {os.path.basename(entry["path"]): entry for entry in catalog.recordings()}
+    assert set(recordings) == {"iRTL_03-14-2023_19-30-05.irtl", "legacy.json", "broken.irtl"}
+    assert recordings["broken.irtl"]["error"] and recordings["broken.irtl"]["n_laps"] == 0
+    entry = recordings["iRTL_03-14-2023_19-30-05.irtl"]
+    assert entry["recorded_at"] == "2023-03-14T19:30:05" and entry["format"] == "irtl"
+    assert entry["n_laps"] == 3 and "Speed" in entry["channels"] and entry["error"] is None
+
+    # Laps and their stats match the recording
+    processor = iRTLDataProcessor(irtl, cache=LRUCache(), derived_channels={})
+    laps = catalog.laps(recording=irtl)
+    assert [lap["lap"] for lap in sorted(laps, key=lambda lap: lap["lap_index"])] == [lap["lap"] for lap in processor.laps]
+    stats = catalog.lap_stats(irtl, 1)
+    speed = processor.get_channel_data_for_lap("Speed", 1, scaled=True)
+    assert np.isclose(stats["Speed"]["max"], speed.max()) and np.isclose(stats["Speed"]["mean"], speed.mean(), rtol=1e-5)
+    assert np.isclose(stats["Throttle"]["min"], processor.get_channel_data_for_lap("Throttle", 1, scaled=True).min())
+    processor.close()
+
+    # Fastest valid laps across recordings
+    best = catalog.laps(valid_only=True, limit=2)
+    assert [lap["lap_time"] for lap in best] == sorted(lap["lap_time"] for lap in best)
+    assert all(lap["valid"] for lap in best)
+    assert catalog.laps(since="2030-01-01") == []
+
+    # Only changed and deleted recordings are rescanned
+    os.remove(legacy)
+    os.utime(irtl, ns=(os.stat(irtl).st_atime_ns, os.stat(irtl).st_mtime_ns + 10 ** 9))
+    assert catalog.scan() == {"added": 0, "updated": 1, "removed": 1, "unchanged": 1, "failed": 0, "skipped": 0}
+    assert len(catalog.recordings()) == 2 and len(catalog.laps(recording=irtl)) == 3
+    catalog.close()
+
+    # The catalog persists between runs
+    with SessionCatalog(os.path.join(outputs, "catalog.sqlite"), outputs) as catalog:
+        assert len(catalog.recordings()) == 2
+
+def test_open_recordings_skipped():
+    outputs = tempfile.mkdtemp()
+    path = recording()
+    live = shutil.copy(path, os.path.join(outputs, "iRTL_03-14-2023_19-30-05.irtl"))
+    shutil.copy(path, os.path.join(outputs, "iRTL_03-14-2023_19-30-05_2.irtl"))
+    shutil.copy(path, os.path.join(outputs, "iRTL_03-14-2023_19-30-05_old.irtl"))
+    catalog = SessionCatalog(os.path.join(outputs, "catalog.sqlite"), outputs)
+
+    # The recording the logger is writing and its segments aren't opened until it is finished
+    assert catalog.scan(skip=[live]) == {"added": 1, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0, "skipped": 2}
+    assert [os.path.basename(entry["path"]) for entry in catalog.recordings()] == ["iRTL_03-14-2023_19-30-05_old.irtl"]
+    assert catalog.scan()["added"] == 2
+    catalog.close()
+
+def test_recording_date():
+    assert recording_date("data/outputs/iRTL_12-01-2022_08-05-00_2.irtl", 0) == "2022-12-01T08:05:00"
+    assert recording_date("data/outputs/lap.json", 1_700_000_000 * 10 ** 9).startswith("2023-11-1")
+
+
+if __name__ == "__main__":
+    test_incremental_scan()
+    test_open_recordings_skipped()
+    test_recording_date()
+    print("All tests passed")
@@ -0,0 +1,103 @@
+"""
+Test cases for derived channel expressions
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger import DERIVED_CHANNELS
+from logger.iRTLCache import LRUCache
+from logger.iRTLData import iRTLDataProcessor
+from logger.iRTLExpr import Expression, compile_expression
+from helpers import recording
+
+def test_expressions():
+    a = np.array([1.0, 2.0, 3.0, 4.0])
+    b = np.array([4.0, 2.0, 0.0, 1.0])
+    channels = {"A": a, "B": b}
+
+    assert Expression("mean(A, B, 2 * A)").channels == ["A", "B"]
+    assert np.allclose(Expression("mean(A, B, 2 * A)").evaluate(channels), (a + b + 2 * a) / 3)
+    assert np.allclose(Expression("A if A > B else -B").evaluate(channels), np.where(a > b, a, -b))
+    assert Expression("1 < A <= 3 and not B == 0").evaluate(channels).tolist() == [False, True, False, False]
+    assert Expression("A < 2 or B < 1").evaluate(channels).tolist() == [True, False, True, False]
+    assert np.allclose(Expression("max(A, B) - min(A, B)").evaluate(channels), np.abs(a - b))
+    assert np.allclose(Expression("deriv(A ** 2)").evaluate(channels, time=np.arange(4) / 2), np.gradient(a ** 2, np.arange(4) / 2))
+    assert Expression("2 * pi").evaluate(channels, time=a).tolist() == [2 * np.pi] * 4
+
+    # Division by zero doesn't raise
+    assert np.isinf(Expression("A / B").evaluate(channels)[2])
+
+    # Compiled once, and hashed regardless of formatting
+    assert compile_expression("A + B") is compile_expression("A + B")
+    assert Expression("A+B").hash == Expression(" (A + B) ").hash != Expression("B + A").hash
+
+def test_restricted_grammar():
+    for text in ["Speed.__class__", "__import__('os')", "open('file')", "(lambda: 1)()", "Speed[0]", "'text'",
+                 "clip(Speed, a_min=0)", "_where(Speed, 1, 2)", "[Speed]", "Speed; 1", "deriv", "x := 1", "True"]:
+        try:
+            Expression(text)
+        except Exception:
+            continue
+        raise AssertionError(f"'{text}' was allowed")
+
+def test_processor_channels():
+    processor = iRTLDataProcessor(recording(), cache=LRUCache(), derived_channels={})
+    assert processor.derived == {}
+
+    # Defined channels are only evaluated when used
+    assert processor.add_derived_channel("SpeedKph", "Speed * 3.6", "km/h", "Speed in km/h")
+    assert processor.cache_stats()["misses"] == 0
+    speed = processor.get_channel_data("Speed")
+    assert np.allclose(processor.get_channel_data("SpeedKph"), speed * 3.6, rtol=1e-6)
+    assert processor.data["SpeedKph"]["unit"] == "km/h"
+
+    # They are first class channels: laps, resampling and other expressions work on them
+    lap = processor.get_channel_data_for_lap("SpeedKph", 1)
+    assert np.shares_memory(lap, processor.get_channel_data("SpeedKph"))
+    assert processor.resample_laps(["SpeedKph"], n_points=100)["SpeedKph"].shape == (3, 100)
+    assert processor.add_derived_channel("SpeedMph", "SpeedKph / 1.609344")
+    assert np.allclose(processor.get_channel_data("SpeedMph"), speed * 3.6 / 1.609344, rtol=1e-6)
+
+    # Fetching lap data doesn't evaluate derived channels unless they're asked for
+    assert processor.add_derived_channel("Lazy", "Throttle * 2")
+    lap_data = processor.get_lap_data(2)
+    assert "Lazy" not in lap_data and "Speed" in lap_data
+    assert not any(key[1] == "Lazy" for key in processor.cache.entries)
+    assert np.allclose(processor.get_lap_data(2, ["Lazy"])["Lazy"]["data"], processor.get_channel_data_for_lap("Throttle", 2) * 2)
+
+    # Lower rate inputs stay on their timebase, or are aligned when mixed with base rate channels
+    assert processor.add_derived_channel("AirTempF", "AirTemp * 9 / 5 + 32")
+    assert len(processor.get_channel_data("AirTempF")) == len(processor.get_channel_data("AirTemp"))
+    assert processor.add_derived_channel("SpeedOverTemp", "Speed / AirTemp")
+    assert len(processor.get_channel_data("SpeedOverTemp")) == len(speed)
+
+    # Channels whose inputs weren't recorded are skipped, and recorded channels can't be replaced
+    assert not processor.add_derived_channel("LFtempCAvg", DERIVED_CHANNELS["LFtempCAvg"]["expression"])
+    try:
+        processor.add_derived_channel("Speed", "Speed * 2")
+        raise AssertionError("Recorded channel replaced")
+    except Exception as e:
+        assert "recorded channel" in str(e)
+
+    # Redefining a channel recomputes the channels that read it
+    assert processor.add_derived_channel("SpeedKph", "Speed * 3.6 * 2")
+    assert np.allclose(processor.get_channel_data("SpeedMph"), speed * 7.2 / 1.609344, rtol=1e-6)
+
+def test_default_channels():
+    for name, definition in DERIVED_CHANNELS.items():
+        compile_expression(definition["expression"])
+    processor = iRTLDataProcessor(recording(), cache=LRUCache())
+    assert "LFtempCAvg" not in processor.derived    # Tire temperatures weren't recorded
+
+
+if __name__ == "__main__":
+    test_expressions()
+    test_restricted_grammar()
+    test_processor_channels()
+    test_default_channels()
+    print("All tests passed")
@@ -0,0 +1,63 @@
+"""
+Test cases for resampling laps onto a distance grid
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger.iRTLCache import LRUCache
+from logger.iRTLData import iRTLDataProcessor, resample_laps
+from helpers import recording
+
+def test_wraparound():
+    # Joined at 60% of a lap, three full laps counted two samples after the line, then stopped 10% into a lap
+    n = 600
+    ticks = np.arange(3 * n + 300)
+    pct = (ticks / n + 0.6) % 1.0
+    lap = np.floor(ticks / n + 0.6 - 2 / n).astype(int)
+    starts = np.flatnonzero(np.diff(lap, prepend=-1))
+    ends = np.append(starts[1:], len(ticks))
+    grid = np.arange(100) / 100
+    resampled = resample_laps(pct, {"Speed": pct * 100, "Lap": lap}, starts, ends, grid, 1.0)
+
+    speed = resampled["Speed"]
+    assert speed.shape == (5, 100)
+    for row in speed[1:4]:
+        assert np.allclose(row[1:], grid[1:] * 100)
+        assert row[0] < 1   # The lap's first sample, just after the line
+    assert np.isnan(speed[0, :59]).all() and np.allclose(speed[0, 60:], grid[60:] * 100)
+    assert np.allclose(speed[4, 1:10], grid[1:10] * 100) and np.isnan(speed[4, 11:]).all()
+
+    # Integer channels hold their samples
+    assert (resampled["Lap"][1:4, 50] == [1, 2, 3]).all()
+
+def test_processor_overlay():
+    processor = iRTLDataProcessor(recording(), cache=LRUCache())
+    overlay = processor.resample_laps(["Speed", "Throttle"], n_points=500)
+    assert overlay["distance"].shape == (500,)
+    assert overlay["Speed"].shape == overlay["Throttle"].shape == (3, 500)
+
+    # Same result as interpolating lap by lap
+    lap = processor.session.laps[1]
+    expected = np.interp(overlay["distance"], lap["LapDistPct"], lap["Speed"])
+    assert np.allclose(overlay["Speed"][1], expected, atol=1e-3)
+
+    # Each channel is cached; adding a channel only resamples that one
+    assert processor.cache_stats()["misses"] == 2
+    again = processor.resample_laps(["Speed", "Throttle", "LapDist"], n_points=500)
+    assert again["Speed"] is overlay["Speed"] and again["Throttle"] is overlay["Throttle"]
+    assert processor.cache_stats()["misses"] == 3
+
+    # Subsets of laps and display units are cached separately
+    subset = processor.resample_laps(["Throttle"], laps=[0, 2], n_points=500, scaled=True)
+    assert np.allclose(subset["Throttle"], overlay["Throttle"][[0, 2]] * 100, equal_nan=True)
+
+
+if __name__ == "__main__":
+    test_wraparound()
+    test_processor_overlay()
+    print("All tests passed")
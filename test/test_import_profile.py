@@ -0,0 +1,31 @@
+"""
+Test cases for the app's startup imports
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from utils.import_profile import parse_importtime, profile_imports
+
+def test_parse_importtime():
+    output = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |     _io",
+        "import time:      3000 |       3120 |   json",
+        "import time:       500 |       3620 | app",
+    ])
+    assert parse_importtime(output) == [("_io", 120, 120, 2), ("json", 3000, 3120, 1), ("app", 500, 3620, 0)]
+
+def test_startup_is_lazy():
+    # matplotlib, pandas and the SDK are only imported once a tab or a recording needs them
+    report = profile_imports("app", window=False)
+    assert report["lazy_imported"] == []
+    assert report["n_modules"] > 0
+
+
+if __name__ == "__main__":
+    test_parse_importtime()
+    test_startup_is_lazy()
+    print("All tests passed")
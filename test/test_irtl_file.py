@@ -0,0 +1,178 @@
+"""
+Test cases for the segmented .irtl file writer and crash recovery
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import tempfile
+from unittest import mock
+import numpy as np
+
+sys.path.append(os.getcwd())
+from logger.iRTLStore import SampleStore
+from logger.iRTLFile import iRTLFile, iRTLFileWriter, read_irtl, read_footer, recover, ENCODING_RAW, ENCODING_RLE, ENCODING_DELTA_ZLIB
+
+CHANNELS = {
+    "time": {"desc": "Session time", "unit": "s", "dtype": np.float64},
+    "Lap": {"desc": "Laps started count", "unit": "", "dtype": np.int32},
+    "Speed": {"desc": "GPS vehicle speed", "unit": "m/s", "dtype": np.float32},
+}
+
+def record(path: str, n_samples: int, chunk_size: int = 100, compact: bool = True):
+    """
+    Record n synthetic samples through a store and writer
+    """
+    store = SampleStore(CHANNELS, chunk_size=chunk_size)
+    writer = iRTLFileWriter(path, store.meta, compact=compact)
+    store.on_seal = writer.write_chunk
+    store.retain(2)
+    for i in range(n_samples):
+        store.append([i / 60, i // 60, i % 90])
+    store.flush()
+    writer.close()
+    writer.join()
+
+def test_roundtrip():
+    path = os.path.join(tempfile.mkdtemp(), "roundtrip.irtl")
+    record(path, 250)
+    data = read_irtl(path)
+
+    assert len(data["time"]["data"]) == 250
+    assert data["Lap"]["data"][-1] == 249 // 60
+    assert data["Speed"]["unit"] == "m/s"
+
+def test_compacted_file_is_mapped():
+    path = os.path.join(tempfile.mkdtemp(), "mapped.irtl")
+    record(path, 250)
+    recording = iRTLFile(path)
+
+    # One contiguous block per channel, read as a view into the mapping
+    assert recording.is_contiguous
+    assert not recording.channel("Speed").flags.owndata
+    assert recording.laps == [[0, 0, 60], [1, 60, 120], [2, 120, 180], [3, 180, 240], [4, 240, 250]]
+
+def test_compaction_failure_keeps_recording():
+    # On Windows the swap fails while a reader has the recording mapped
+    path = os.path.join(tempfile.mkdtemp(), "open.irtl")
+    closed = []
+    store = SampleStore(CHANNELS, chunk_size=100)
+    writer = iRTLFileWriter(path, store.meta, on_close=closed.append)
+    store.on_seal = writer.write_chunk
+    for i in range(250):
+        store.append([i / 60, i // 60, i % 90])
+    store.flush()
+    with mock.patch("os.replace", side_effect=PermissionError("file is in use")):
+        writer.close()
+        writer.join()
+
+    # The uncompacted recording is kept and still finalized
+    assert closed == [path]
+    assert not os.path.exists(path + ".tmp")
+    recording = iRTLFile(path)
+    assert not recording.is_contiguous
+    assert len(recording.channel("Speed")) == 250
+
+def test_recover_truncated_file():
+    path = os.path.join(tempfile.mkdtemp(), "crash.irtl")
+    record(path, 250, compact=False)
+
+    # Simulate a crash part way through writing the last chunk
+    with open(path, "rb") as f:
+        buf = f.read()
+    with open(path, "wb") as f:
+        f.write(buf[:-300])
+
+    assert read_irtl(path)["time"]["data"].shape == (200,)
+    assert recover(path)
+    with open(path, "rb") as f:
+        assert read_footer(f.read())["n_samples"] == 200
+
+def test_step_channels_stored_as_runs():
+    path = os.path.join(tempfile.mkdtemp(), "runs.irtl")
+    record(path, 250, compact=False)
+    recording = iRTLFile(path)
+
+    # Lap only changes every 60 samples, Speed changes on every sample
+    assert {block[2] for block in recording.index["channels"]["Lap"]} == {ENCODING_RLE}
+    assert {block[2] for block in recording.index["channels"]["Speed"]} == {ENCODING_RAW}
+    assert recording.channel("Lap").tolist() == [i // 60 for i in range(250)]
+
+    # Runs continuing across chunks are merged
+    starts, values = recording.runs("Lap")
+    assert starts.tolist() == [0, 60, 120, 180, 240]
+    assert values.tolist() == [0, 1, 2, 3, 4]
+
+def test_compressed_roundtrip():
+    path = os.path.join(tempfile.mkdtemp(), "compressed.irtl")
+    channels = {**CHANNELS, "Throttle": {"desc": "Throttle", "unit": "%", "dtype": np.float32, "precision": 4}}
+    store = SampleStore(channels, chunk_size=100)
+    writer = iRTLFileWriter(path, store.meta, compression="zlib")
+    store.on_seal = writer.write_chunk
+    throttle = np.random.default_rng(0).random(250)
+    for i in range(250):
+        store.append([i / 60, i // 60, i % 90, throttle[i]])
+    store.flush()
+    writer.close()
+    writer.join()
+    recording = iRTLFile(path)
+
+    # Float channels with a precision are quantized and compressed, the rest are stored losslessly
+    assert {block[2] for block in recording.index["channels"]["Throttle"]} == {ENCODING_DELTA_ZLIB}
+    assert np.abs(recording.channel("Throttle") - throttle).max() <= 0.5e-4 + 1e-7
+    assert recording.channel("Speed").tolist() == [i % 90 for i in range(250)]
+    assert recording.laps == [[0, 0, 60], [1, 60, 120], [2, 120, 180], [3, 180, 240], [4, 240, 250]]
+
+def test_rate_tiers():
+    path = os.path.join(tempfile.mkdtemp(), "tiers.irtl")
+    slow = {
+        "time_1Hz": {"desc": "Session time", "unit": "s", "dtype": np.float64, "timebase": "time_1Hz"},
+        "AirTemp": {"desc": "Air temperature", "unit": "C", "dtype": np.float32, "timebase": "time_1Hz"},
+    }
+    store = SampleStore(CHANNELS, chunk_size=100)
+    slow_store = SampleStore(slow, chunk_size=2)
+    writer = iRTLFileWriter(path, {**store.meta, **slow_store.meta}, compact=False)
+    store.on_seal = writer.write_chunk
+    slow_store.on_seal = writer.write_chunk
+    for i in range(250):
+        store.append([i / 60, i // 60, i % 90])
+        if i % 60 == 0:
+            slow_store.append([i / 60, 20 + i // 60])
+    store.flush()
+    slow_store.flush()
+    writer.close()
+    writer.join()
+
+    # Each timebase keeps its own sample count
+    recording = iRTLFile(path)
+    assert recording.n_samples == 250
+    assert recording.tiers == {"time_1Hz": 5}
+    assert recording.channel("AirTemp").tolist() == [20, 21, 22, 23, 24]
+
+    # Aligned to the base timebase, the latest sample is held until the next one
+    aligned = recording.aligned("AirTemp")
+    assert len(aligned) == 250
+    assert aligned[59] == 20 and aligned[60] == 21 and aligned[-1] == 24
+    assert "time_1Hz" not in recording.to_dict(align=True)
+    recording.close()
+
+    # Timebases have different numbers of chunks, so a file without a footer is recovered per timebase
+    with open(path, "rb") as f:
+        buf = f.read()
+    with open(path, "wb") as f:
+        f.write(buf[:buf.rfind(b"FTR0")])
+    recovered = iRTLFile(path)
+    assert recovered.recovered
+    assert recovered.n_samples == 250
+    assert recovered.tiers == {"time_1Hz": 5}
+
+
+if __name__ == "__main__":
+    test_roundtrip()
+    test_compacted_file_is_mapped()
+    test_compaction_failure_keeps_recording()
+    test_recover_truncated_file()
+    test_step_channels_stored_as_runs()
+    test_compressed_roundtrip()
+    test_rate_tiers()
+    print("All tests passed")
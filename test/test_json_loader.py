@@ -0,0 +1,75 @@
+"""
+Test cases for the streaming loader of legacy JSON recordings
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import json
+import tracemalloc
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger.iRTLJson import JsonRecording
+from logger.iRTLData import iRTLDataProcessor
+from helpers import legacy_recording
+
+def test_channels_without_parsing():
+    path = legacy_recording()
+    with open(path) as f:
+        expected = json.load(f)
+    recording = JsonRecording(path)
+
+    # Headers and lengths are read without parsing any data
+    assert list(recording.channels) == list(expected)
+    assert recording.channels["Channel3"] == {"desc": "Channel 3, \"quoted\" [x]", "unit": "m/s"}
+    assert recording.length("time") == 20000
+
+    # Channels parse straight into arrays, integer channels as ints
+    assert np.array_equal(recording.channel("Channel7"), expected["Channel7"]["data"])
+    assert recording.channel("Lap").dtype == np.int64
+    assert not recording.channel("OnPitRoad").any()
+
+    # Only the requested channels are included
+    assert list(recording.to_dict(["time", "Speed", "Channel1"])) == ["time", "Channel1"]
+    recording.close()
+
+def test_one_channel_costs_one_channel():
+    path = legacy_recording()
+    iRTLDataProcessor(path)     # Index the laps. Reopening reads the index from its sidecar
+    tracemalloc.start()
+    processor = iRTLDataProcessor(path)
+    speed = processor.data["Channel0"]["data"]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert processor.n_laps == 4
+    assert len(speed) == 20000
+    assert peak < os.path.getsize(path) / 5
+
+def test_corrupt_channel_raises():
+    path = legacy_recording(n_channels=2, n_samples=100)
+    with open(path) as f:
+        text = f.read()
+    # A token that can't be parsed part way through the array, and nulls among numbers
+    channel = json.dumps({"desc": "", "unit": "", "data": [1.5, 2.5, None]})
+    with open(path, "w") as f:
+        f.write(text.replace("-0.", "x0.", 1)[:-1] + f', "Nulls": {channel}}}')
+    recording = JsonRecording(path)
+
+    assert np.array_equal(recording.channel("Nulls"), [1.5, 2.5, np.nan], equal_nan=True)
+    assert len(recording.channel("Channel1")) == 100
+    try:
+        recording.channel("Channel0")
+        raise AssertionError("Parsed a corrupt channel")
+    except Exception as e:
+        assert "Channel0" in str(e) and "not an array of numbers" in str(e)
+    recording.close()
+
+
+if __name__ == "__main__":
+    test_channels_without_parsing()
+    test_one_channel_costs_one_channel()
+    test_corrupt_channel_raises()
+    print("All tests passed")
@@ -0,0 +1,137 @@
+"""
+Test cases for the lap index
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger.iRTLFile import find_runs
+from logger.iRTLData import iRTLDataProcessor
+from logger.iRTLLaps import build_lap_index, load_lap_index, lap_index_path
+from helpers import legacy_recording
+
+def test_lap_flags():
+    # Joined mid-way through lap 3, pitted at the end of lap 4, reset back to lap 4, then stopped during lap 6
+    lap = np.repeat([3, 4, 5, 4, 5, 6], [30, 100, 50, 100, 100, 40])
+    time = np.arange(len(lap)) / 10
+    pct = np.zeros(len(lap))
+    pct[0] = 0.6
+    on_pit_road = np.zeros(len(lap), dtype=bool)
+    on_pit_road[120:135] = True
+    laps = build_lap_index(*find_runs(lap), time, on_pit_road, pct)
+
+    assert [(entry["lap"], entry["start"], entry["end"]) for entry in laps] == [(3, 0, 30), (4, 30, 130), (5, 130, 180), (4, 180, 280), (5, 280, 380), (6, 380, 420)]
+    assert [entry["flags"] for entry in laps] == [["partial"], ["in_lap"], ["reset", "out_lap"], ["repeat"], ["repeat"], ["partial"]]
+    assert [entry["valid"] for entry in laps] == [False, False, False, False, False, False]
+    assert [entry["lap_time"] for entry in laps] == [3.0, 10.0, None, 10.0, 10.0, None]
+
+def test_lap_times_from_sdk():
+    lap = np.repeat([1, 2, 3, 4], 100)
+    time = np.arange(len(lap)) / 10
+    # The SDK reports a lap's time a moment after it ends. Lap 3 matches lap 2's time, so LapLastLapTime doesn't change
+    last_lap_time = np.repeat([0.0, 9.95, 9.95, 9.95], 100)
+    last_lap_time[100:103] = 0.0
+    laps = build_lap_index(*find_runs(lap), time, last_lap_time=last_lap_time)
+
+    assert [entry["lap_time"] for entry in laps] == [9.95, 10.0, 10.0, None]
+    assert [entry["lap_time_source"] for entry in laps] == ["sdk", "timestamps", "timestamps", None]
+    assert [entry["valid"] for entry in laps] == [True, True, True, False]
+
+def test_lap_time_given_to_one_lap():
+    # Lap 2 ends 3 s after lap 1, and the SDK reports one time shortly after lap 2 ends
+    lap = np.repeat([1, 2, 3, 4], [100, 30, 100, 50])
+    time = np.arange(len(lap)) / 10
+    last_lap_time = np.repeat([0.0, 3.05], [132, 148])
+    laps = build_lap_index(*find_runs(lap), time, last_lap_time=last_lap_time)
+    assert [entry["lap_time_source"] for entry in laps] == ["timestamps", "sdk", "timestamps", None]
+    assert [entry["lap_time"] for entry in laps] == [10.0, 3.05, 10.0, None]
+
+    # Partial and reset laps never get the SDK's time
+    pct = np.zeros(len(lap))
+    pct[0] = 0.5
+    laps = build_lap_index(*find_runs(lap), time, lap_dist_pct=pct, last_lap_time=np.repeat([0.0, 9.95], [102, 178]))
+    assert laps[0]["flags"] == ["partial"] and laps[0]["lap_time_source"] == "timestamps"
+    laps = build_lap_index(np.array([0, 100, 200]), np.array([1, 1, 2]), np.arange(250) / 10, last_lap_time=np.repeat([0.0, 9.95], [102, 148]))
+    assert laps[0]["flags"] == ["reset"] and laps[0]["lap_time"] is None
+    assert laps[1]["lap_time_source"] == "timestamps"
+
+def test_sidecar_cache():
+    path = legacy_recording(n_channels=1)
+    processor = iRTLDataProcessor(path)
+    assert os.path.exists(lap_index_path(path))
+    assert [lap["lap"] for lap in processor.laps] == [1, 2, 3, 4]
+    assert abs(processor.get_lap_time(0) - 5000 / 60) < 1e-3
+
+    # Laps are looked up by position, whatever their numbers
+    assert processor.n_laps == 4
+    assert processor.get_lap_data(3) is processor.session.laps[3].to_dict()
+    assert processor.get_lap_time(3) > 0
+    assert processor.get_lap_points(3).tolist() == [15000, 19999]
+    for lap in [4, -1]:
+        for method in [processor.get_lap_time, processor.get_lap_points]:
+            try:
+                method(lap)
+                raise AssertionError(f"Lap {lap} found")
+            except Exception as e:
+                assert "does not exist" in str(e)
+
+    # Reopening reads the sidecar
+    def fail():
+        raise AssertionError("lap index rebuilt")
+    assert load_lap_index(path, fail) == processor.laps
+
+    # A copy with a new modification time is matched by its contents
+    copy = os.path.join(tempfile.mkdtemp(), "copy.json")
+    shutil.copyfile(path, copy)
+    shutil.copyfile(lap_index_path(path), lap_index_path(copy))
+    os.utime(copy, ns=(0, 0))
+    assert load_lap_index(copy, fail) == processor.laps
+
+    # A changed recording is reindexed
+    with open(copy, "a") as f:
+        f.write(" ")
+    assert load_lap_index(copy, lambda: []) == []
+    assert load_lap_index(copy, fail) == []
+
+def test_lap_value_counts():
+    # Two 100 sample laps. Gear changes to 4 on the last sample of lap 1
+    gear = np.repeat([2, 3, 4, 5], [50, 49, 1, 100])
+    data = {
+        "time": {"desc": "Session time", "unit": "s", "data": (np.arange(200) / 10).tolist()},
+        "Lap": {"desc": "Laps started count", "unit": "", "data": np.repeat([1, 2], 100).tolist()},
+        "Gear": {"desc": "Gear", "unit": "", "data": gear.tolist()},
+    }
+    path = os.path.join(tempfile.mkdtemp(), "gears.json")
+    with open(path, "w") as f:
+        json.dump(data, f)
+    processor = iRTLDataProcessor(path)
+
+    # Every sample of the lap is counted, including a run that starts on its last sample
+    assert processor.get_value_counts("Gear", 0) == {2: 50, 3: 49, 4: 1}
+    assert processor.get_value_counts("Gear", 1) == {5: 100}
+    starts, values = processor.get_channel_runs("Gear", 0)
+    assert starts.tolist() == [0, 50, 99] and values.tolist() == [2, 3, 4]
+
+    # Laps that don't exist are reported by the method they were asked of
+    for method in ["get_value_counts", "get_channel_runs"]:
+        try:
+            getattr(processor, method)("Gear", 2)
+            raise AssertionError(f"{method}() accepted lap 2")
+        except Exception as e:
+            assert str(e).startswith(f"iRTLDataProcessor.{method}(): Lap 2 does not exist")
+
+
+if __name__ == "__main__":
+    test_lap_flags()
+    test_lap_times_from_sdk()
+    test_lap_time_given_to_one_lap()
+    test_sidecar_cache()
+    test_lap_value_counts()
+    print("All tests passed")
@@ -0,0 +1,201 @@
+"""
+Test cases for recording offline from a replayed SDK
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import time
+import json
+import tempfile
+import numpy as np
+
+sys.path.append(os.getcwd())
+from utils.data_bank import DataBank
+from logger.iRTL import iRacingTelemetryLogger
+from logger.iRTLCapture import TickScheduler
+from logger.iRTLProcess import create_logger
+from logger.iRTLFile import iRTLFile
+from logger.iRTLReplay import ReplaySDK
+from logger.iRTLSession import load_index, open_segment
+
+CHANNELS = ["Lap", "LapDist", "LapDistPct", "Speed", "RPM", "Gear", "Throttle", "Brake"]
+
+def record(sdk: ReplaySDK, output_dir: str) -> iRacingTelemetryLogger:
+    """
+    Record a replay from start to finish as fast as it can be published
+    """
+    logger = iRacingTelemetryLogger(DataBank(), ir_sdk=sdk, output_dir=output_dir, polling_rate_hz=None)
+    logger.channels = CHANNELS
+    logger.chunk_size = 256
+    assert logger.start()
+    while not sdk.finished:
+        time.sleep(0.01)
+    logger.stop()
+    logger.writer.join()
+    return logger
+
+def test_synthetic_replay():
+    sdk = ReplaySDK.synthetic(CHANNELS, duration=200, speed=0, seed=1)
+    logger = record(sdk, tempfile.mkdtemp())
+    recording = iRTLFile(logger.output_path)
+
+    # Every published frame is recorded exactly once
+    assert recording.n_samples == 200 * 60
+    assert logger.scheduler.stats()["dropped_ticks"] == 0
+    assert [lap[0] for lap in recording.laps] == [1, 2, 3]
+
+    # Recordings are uncompressed by default, compacted and read without copying
+    assert recording.is_contiguous
+    assert not recording.channel("Speed").flags.owndata
+
+def test_dropped_frames_are_counted():
+    sdk = ReplaySDK.synthetic(CHANNELS, duration=20, speed=0, drop_rate=0.05, seed=2)
+    logger = record(sdk, tempfile.mkdtemp())
+
+    assert sdk.dropped > 0
+    assert logger.scheduler.stats()["dropped_ticks"] == sdk.dropped
+    assert iRTLFile(logger.output_path).n_samples + sdk.dropped == 20 * 60
+
+def test_replay_recording():
+    output_dir = tempfile.mkdtemp()
+    first = record(ReplaySDK.synthetic(CHANNELS, duration=10, speed=0, seed=3), output_dir)
+    original = iRTLFile(first.output_path)
+
+    # Re-recording a recording reproduces its samples
+    time.sleep(1)   # Recordings are named by the second
+    second = record(ReplaySDK.from_recording(first.output_path, speed=0), output_dir)
+    replayed = iRTLFile(second.output_path)
+    assert replayed.n_samples == original.n_samples
+    assert (replayed.channel("Speed") == original.channel("Speed")).all()
+
+def test_rate_tiers():
+    sdk = ReplaySDK.synthetic(CHANNELS + ["AirTemp", "LapLastLapTime"], duration=200, speed=0, seed=4)
+    logger = iRacingTelemetryLogger(DataBank(), ir_sdk=sdk, output_dir=tempfile.mkdtemp(), polling_rate_hz=None)
+    logger.channels = CHANNELS + ["AirTemp", "LapLastLapTime"]
+    logger.start()
+    while not sdk.finished:
+        time.sleep(0.01)
+    logger.stop()
+    logger.writer.join()
+    recording = iRTLFile(logger.output_path)
+
+    # AirTemp is sampled once a second and the last lap time only when it changes
+    assert recording.n_samples == 200 * 60
+    assert recording.tiers == {"time_1Hz": 200, "time_change": 2}
+    assert recording.channel("LapLastLapTime").tolist() == [0, 90]
+    assert len(recording.aligned("AirTemp")) == recording.n_samples
+
+def test_session_segments():
+    sdk = ReplaySDK.synthetic(CHANNELS, duration=300, session_seconds=200, speed=0, seed=5)
+    logger = iRacingTelemetryLogger(DataBank(), ir_sdk=sdk, output_dir=tempfile.mkdtemp(), polling_rate_hz=None)
+    logger.channels = CHANNELS
+    logger.start()
+    while not sdk.finished:
+        time.sleep(0.01)
+    logger.stop()
+    logger.join()
+    index = load_index(logger.index.path)
+
+    # The second session is recorded to its own segment, starting on its first sample
+    assert [segment["reason"] for segment in index["segments"]] == ["start", "session"]
+    assert [segment["session_num"] for segment in index["segments"]] == [0, 1]
+    assert [segment["n_samples"] for segment in index["segments"]] == [200 * 60, 100 * 60]
+    assert index["segments"][1]["start_time"] == 200
+
+    # Every lap but the last of each segment is timed
+    assert [(lap["lap"], lap["lap_time"]) for lap in index["segments"][0]["laps"]] == [(1, 90), (2, 90), (3, None)]
+    assert [(lap["lap"], lap["lap_time"]) for lap in index["segments"][1]["laps"]] == [(1, 90), (2, None)]
+
+    # A lap can be opened without reading the other session
+    recording = open_segment(logger.index.path, session_num=1, lap=2)
+    assert recording.path == index["segments"][1]["path"]
+    assert [lap[0] for lap in recording.laps] == [1, 2]
+
+def test_capture_stats():
+    data_bank = DataBank()
+    sdk = ReplaySDK.synthetic(CHANNELS, duration=20, speed=0, seed=6)
+    logger = iRacingTelemetryLogger(data_bank, ir_sdk=sdk, output_dir=tempfile.mkdtemp(), polling_rate_hz=None, stats_file=True)
+    logger.channels = CHANNELS
+    assert logger.open_recordings() == []
+    logger.start()
+    assert logger.open_recordings() == [logger.recording_path]
+    while not sdk.finished:
+        time.sleep(0.01)
+    logger.stop()
+    logger.join()
+    assert logger.open_recordings() == []
+
+    # Every poll is timed, and the final stats are published and written next to the recording
+    stats = data_bank.data["capture_stats"]
+    assert stats["polls"] == stats["samples"] == 20 * 60
+    assert sum(stats["poll_hist_us"].values()) == stats["polls"]
+    assert stats["poll_p50_us"] <= stats["poll_p99_us"]
+    assert stats["buffer_bytes"] > 0
+    with open(os.path.splitext(logger.recording_path)[0] + ".stats.json") as f:
+        assert json.load(f)["polls"] == stats["polls"]
+
+def test_app_recordings_are_compressed():
+    sizes = {}
+    recordings = {}
+    for compression in ["app", None]:
+        sdk = ReplaySDK.synthetic(CHANNELS, duration=200, speed=0, seed=8)
+        kwargs = {} if compression == "app" else {"compression": None}
+        logger = create_logger(DataBank(), ir_sdk=sdk, output_dir=tempfile.mkdtemp(), polling_rate_hz=None, **kwargs)
+        logger.channels = CHANNELS
+        assert logger.start()
+        while not sdk.finished:
+            time.sleep(0.01)
+        logger.stop()
+        logger.join()
+        sizes[compression] = os.path.getsize(logger.output_path)
+        recordings[compression] = iRTLFile(logger.output_path)
+
+    # Recordings made the way the app makes them are compacted and compressed, and read back within their precision
+    app, raw = recordings["app"], recordings[None]
+    assert app.is_contiguous
+    assert sizes["app"] * 2 < sizes[None]
+    assert app.n_samples == raw.n_samples
+    assert np.abs(app.channel("Speed") - raw.channel("Speed")).max() <= 0.5e-3 + 1e-4
+    assert np.array_equal(app.channel("Gear"), raw.channel("Gear"))
+
+class WallClockSDK:
+    """
+    Publishes a new frame every 1/60 s of wall clock time, like the sim does. Freezing the var buffer
+    doesn't block, so every check for a new frame is counted
+    """
+    class Header:
+        tick_rate = 60
+
+    def __init__(self):
+        self._header = self.Header()
+        self.start = time.perf_counter()
+        self.freezes = 0
+
+    def freeze_var_buffer_latest(self):
+        self.freezes += 1
+
+    def __getitem__(self, name: str):
+        return int((time.perf_counter() - self.start) * self._header.tick_rate)
+
+def test_scheduler_sleeps_between_ticks():
+    sdk = WallClockSDK()
+    scheduler = TickScheduler(sdk, rate_hz=None)
+    for _ in range(60):
+        assert scheduler.wait_for_tick()
+
+    # Frames found early are waited for until the sim is due to publish the next one, not re-checked every min_wait
+    assert sdk.freezes < 3 * scheduler.samples
+    assert scheduler.dropped_ticks <= 3
+
+
+if __name__ == "__main__":
+    test_synthetic_replay()
+    test_dropped_frames_are_counted()
+    test_replay_recording()
+    test_rate_tiers()
+    test_session_segments()
+    test_capture_stats()
+    test_app_recordings_are_compressed()
+    test_scheduler_sleeps_between_ticks()
+    print("All tests passed")
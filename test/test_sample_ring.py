@@ -0,0 +1,103 @@
+"""
+Test cases for the live sample ring
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from utils.data_bank import DataBank
+from logger.iRTLRing import SampleRing, create_shared_ring, attach_shared_ring, release_shared_ring
+
+def filled_ring(n_samples: int, capacity: int = 8) -> SampleRing:
+    """
+    Ring of two channels holding sample i as (i, -i)
+    """
+    ring = SampleRing(["time", "Speed"], capacity=capacity, units={"time": "s"})
+    for i in range(n_samples):
+        ring.push([i, -i])
+    return ring
+
+def test_window_wraps_around():
+    ring = filled_ring(13)
+    assert ring.write_count == 13
+
+    # The latest samples span the end of the ring and are returned in order
+    assert ring.window("time", 5).tolist() == [8, 9, 10, 11, 12]
+    assert ring.window("Speed", 5).tolist() == [-8, -9, -10, -11, -12]
+    assert ring.window("time", 3, end=11).tolist() == [8, 9, 10]
+
+    # Before the ring is full, windows only hold what was pushed
+    assert filled_ring(3).window("time", 5).tolist() == [0, 1, 2]
+
+    # Windows are copies the producer can't write over
+    window = ring.window("time", 5)
+    ring.push([13, -13])
+    assert window.tolist() == [8, 9, 10, 11, 12]
+
+def test_window_larger_than_ring():
+    # At most capacity - 1 samples: the remaining slot is the one the producer writes next
+    ring = filled_ring(13)
+    assert ring.window("time", 100).tolist() == [6, 7, 8, 9, 10, 11, 12]
+
+def test_overwritten_samples_are_dropped():
+    # A reader asking for samples the producer has since written over only gets those still intact
+    ring = filled_ring(13)
+    assert ring.window("time", 5, end=10).tolist() == [6, 7, 8, 9]
+    assert ring.window("time", 3, end=5).tolist() == []
+
+def test_shared_ring():
+    ring, shm = create_shared_ring(["time", "Speed"], capacity=8, units={"time": "s"})
+    reader, reader_shm = attach_shared_ring(shm.name, ring.names, ring.capacity, ring.units)
+    try:
+        # Samples pushed by the producer are read from the same memory
+        for i in range(10):
+            ring.push([i, -i])
+        assert reader.write_count == 10
+        assert reader.window("Speed", 3).tolist() == [-7, -8, -9]
+    finally:
+        release_shared_ring(reader, reader_shm)
+        release_shared_ring(ring, shm, unlink=True)
+
+    # Released rings can't be used, and the block is gone once unlinked
+    assert reader.data is None and ring.data is None
+    try:
+        attach_shared_ring(shm.name, ring.names, ring.capacity)
+        raise AssertionError("Attached to an unlinked block")
+    except FileNotFoundError:
+        pass
+
+def test_live_monitor_lag():
+    from gui.live_monitor import LiveMonitor
+
+    # Render frames without a window: only the ring bookkeeping of LiveMonitor.render() runs
+    monitor = LiveMonitor.__new__(LiveMonitor)
+    monitor.data_bank = DataBank()
+    monitor.fps = 30
+    monitor.plotted = []
+    monitor.plot = monitor.plotted.append
+    monitor.schedule_render = lambda: None
+    ring = filled_ring(10, capacity=64)
+    monitor.start_rendering(ring)
+
+    monitor.render()
+    for i in range(10, 13):
+        ring.push([i, -i])
+    monitor.render()
+    monitor.render()    # Nothing new to render
+
+    stats = monitor.data_bank.data["live_monitor_stats"]
+    assert monitor.plotted == [10, 13]
+    assert stats["frames"] == 2
+    assert stats["lag_samples"] == 3
+    assert stats["max_lag_samples"] == 10
+
+
+if __name__ == "__main__":
+    test_window_wraps_around()
+    test_window_larger_than_ring()
+    test_overwritten_samples_are_dropped()
+    test_shared_ring()
+    test_live_monitor_lag()
+    print("All tests passed")
@@ -0,0 +1,107 @@
+"""
+Test cases for the columnar sample store
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.getcwd())
+from logger.iRTLStore import SampleStore
+
+CHANNELS = {
+    "time": {"desc": "Session time", "unit": "s", "dtype": np.float64},
+    "Gear": {"desc": "Gear", "unit": "", "dtype": np.int8},
+    "Speed": {"desc": "Speed", "unit": "m/s", "dtype": np.float32},
+    "Lap": {"desc": "Laps started count", "unit": "", "dtype": np.int8},
+}
+
+def filled_store(n_samples: int, chunk_size: int = 4) -> tuple:
+    """
+    Store holding time i / 10, Gear i % 5, Lap i // 4 and Speed i * 2 for sample i, and the chunks it handed to on_seal
+    """
+    store = SampleStore(CHANNELS, chunk_size=chunk_size)
+    sealed = []
+    store.on_seal = sealed.append
+    for i in range(n_samples):
+        store.append([i / 10, i % 5, i // 4, i * 2])
+    return store, sealed
+
+def test_channels_grouped_by_dtype():
+    store, _ = filled_store(0)
+
+    # Channels of the same dtype share a group and are appended in group order
+    assert store.names == ["time", "Gear", "Lap", "Speed"]
+    assert [group.names for group in store.groups] == [["time"], ["Gear", "Lap"], ["Speed"]]
+    assert "Gear" in store and "RPM" not in store
+    assert store.array("Gear").dtype == np.int8 and len(store.array("Gear")) == 0
+
+def test_append_across_chunks():
+    store, sealed = filled_store(10)
+
+    # Every full chunk is sealed and handed on once, as views of the sealed chunk
+    assert store.n_samples == 10 and store.pos == 2
+    assert len(sealed) == 2
+    assert sealed[1]["Speed"].tolist() == [8, 10, 12, 14]
+    assert sealed[1]["Speed"].dtype == np.float32
+    assert np.shares_memory(sealed[1]["Gear"], store.groups[1].chunks[1])
+
+    # Channel data are read across chunks, as views of each chunk
+    assert store.array("Gear").tolist() == [i % 5 for i in range(10)]
+    assert store.array("Lap").tolist() == [i // 4 for i in range(10)]
+    chunks = store.chunks("Speed")
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert np.shares_memory(chunks[0], store.groups[2].chunks[0])
+
+def test_window():
+    store, _ = filled_store(10)
+
+    # Windows within the active chunk are views, windows spanning chunks are copied
+    window = store.window("Speed", 2)
+    assert window.tolist() == [16, 18]
+    assert np.shares_memory(window, store.groups[2].active)
+    assert store.window("Speed", 7).tolist() == [6, 8, 10, 12, 14, 16, 18]
+    assert store.window("Speed", 100).tolist() == [i * 2 for i in range(10)]
+
+def test_flush_and_reset():
+    store, sealed = filled_store(10)
+
+    # The partial chunk is handed on as views of the active chunk
+    store.flush()
+    assert len(sealed) == 3
+    assert sealed[2]["time"].tolist() == [0.8, 0.9]
+    assert np.shares_memory(sealed[2]["time"], store.groups[0].active)
+
+    # Views already handed on stay valid while new samples are appended after a reset
+    store.reset()
+    assert store.n_samples == 0 and store.array("time").tolist() == []
+    for i in range(6):
+        store.append([100 + i, 0, 0, 0])
+    assert sealed[2]["time"].tolist() == [0.8, 0.9]
+    assert sealed[0]["time"].tolist() == [0.0, 0.1, 0.2, 0.3]
+    assert store.array("time").tolist() == [100, 101, 102, 103, 104, 105]
+
+def test_retain():
+    store, sealed = filled_store(0)
+    store.retain(1)
+    for i in range(14):
+        store.append([i / 10, i % 5, i // 4, i * 2])
+
+    # Only the latest sealed chunk is kept in memory, every chunk was still handed on
+    assert len(sealed) == 3
+    assert [len(group.chunks) for group in store.groups] == [1, 1, 1]
+    assert store.array("Lap").tolist() == [2, 2, 2, 2, 3, 3]
+    assert store.nbytes == 2 * sum(group.active.nbytes for group in store.groups)
+
+    # Windows only reach back as far as the retained chunks
+    assert store.window("Speed", 10).tolist() == [16, 18, 20, 22, 24, 26]
+
+
+if __name__ == "__main__":
+    test_channels_grouped_by_dtype()
+    test_append_across_chunks()
+    test_window()
+    test_flush_and_reset()
+    test_retain()
+    print("All tests passed")
@@ -0,0 +1,71 @@
+"""
+Test cases for the columnar session model
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import tracemalloc
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger.iRTLData import iRTLDataProcessor
+from helpers import recording, legacy_recording
+
+def test_lap_views():
+    processor = iRTLDataProcessor(recording())
+    session = processor.session
+    throttle = session["Throttle"]
+    assert [lap.number for lap in session] == [1, 2, 3]
+
+    # Laps cover the recording without gaps and their data are views into the channel's array
+    assert sum(lap.n_samples for lap in session) == len(throttle)
+    for i, lap in enumerate(session):
+        data = processor.get_channel_data_for_lap("Throttle", i)
+        assert np.shares_memory(data, throttle.raw)
+        assert np.array_equal(data, throttle.raw[lap.start:lap.end])
+        assert data is processor.get_channel_data_for_lap("Throttle", i)
+
+    # Lower rate channels are sliced by session time
+    lap = session.lap(2)
+    air_temp = lap["AirTemp"]
+    air_time = lap.data("time_1Hz")
+    assert np.shares_memory(air_temp, session["AirTemp"].raw)
+    assert len(air_temp) == len(air_time) > 0
+    assert lap.time[0] <= air_time[0] and air_time[-1] < lap.time[-1] + 1 / 60
+
+    # Percentages are scaled once, and lap data are views of the scaled array
+    lap_data = processor.get_lap_data(1)
+    assert lap_data is processor.get_lap_data(1)
+    assert lap_data["Throttle"]["unit"] == "%"
+    assert np.allclose(lap_data["Throttle"]["data"], throttle.raw[lap.start:lap.end] * 100)
+    assert np.shares_memory(lap_data["Throttle"]["data"], throttle.values)
+    assert np.shares_memory(lap_data["Speed"]["data"], session["Speed"].raw)
+
+def test_repeated_access_allocates_nothing():
+    processor = iRTLDataProcessor(recording())
+    for i in range(len(processor.session)):
+        processor.get_lap_data(i)
+
+    tracemalloc.start()
+    for _ in range(100):
+        for i in range(len(processor.session)):
+            processor.get_lap_data(i)["Speed"]["data"]
+            processor.get_channel_data_for_lap("Speed", i)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert size < 1000
+
+def test_legacy_recording():
+    processor = iRTLDataProcessor(legacy_recording(n_channels=2))
+    session = processor.session
+    assert [(lap.number, lap.start, lap.end) for lap in session] == [(1, 0, 5000), (2, 5000, 10000), (3, 10000, 15000), (4, 15000, 20000)]
+    assert np.shares_memory(processor.get_channel_data_for_lap("Channel1", 3), session["Channel1"].raw)
+
+
+if __name__ == "__main__":
+    test_lap_views()
+    test_repeated_access_allocates_nothing()
+    test_legacy_recording()
+    print("All tests passed")
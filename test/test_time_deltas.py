@@ -0,0 +1,56 @@
+"""
+Test cases for lap time deltas
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from logger.iRTLCache import LRUCache
+from logger.iRTLData import iRTLDataProcessor, lap_time_deltas
+from helpers import legacy_laps
+
+def test_sector_deltas():
+    # Lap 2 loses 1.5 s in the second sector, lap 3 loses 0.5 s in the first
+    processor = iRTLDataProcessor(legacy_laps([(0, 0), (1, 1.5), (0, 0.5)]), cache=LRUCache())
+    assert processor.get_best_lap() == 0
+    deltas = processor.get_time_deltas(n_points=300)
+
+    assert deltas["reference"]["lap"] == 0
+    assert deltas["delta"].shape == (4, 300)
+    assert np.allclose(deltas["sector_deltas"][:3], [[0, 0, 0], [0, 1.5, 0], [0.5, 0, 0]], atol=0.02)
+    assert np.allclose(deltas["lap_deltas"][:3], [0, 1.5, 0.5], atol=0.02)
+
+    # The delta builds up through the sector the time was lost in
+    lap_2 = deltas["delta"][1]
+    assert abs(lap_2[100]) < 0.02 and 0.7 < lap_2[150] < 0.8 and abs(lap_2[250] - 1.5) < 0.02
+
+    # The partial lap is compared up to where it stopped
+    assert np.isnan(deltas["delta"][3, 100:]).all() and abs(deltas["delta"][3, 50]) < 0.02
+
+    # Against a lap of another recording
+    other = iRTLDataProcessor(legacy_laps([(2, 1.0)]), cache=LRUCache())
+    against_other = processor.get_time_deltas(laps=[0, 1], reference=(other, "best"), n_points=300)
+    assert np.allclose(against_other["lap_deltas"], [-1.0, 0.5], atol=0.02)
+    assert np.allclose(against_other["sector_deltas"][1], [0, 1.5, -1.0], atol=0.02)
+
+def test_hundreds_of_laps():
+    rng = np.random.default_rng(0)
+    n_laps, n_points = 500, 1000
+    reference = np.linspace(0, 90, n_points)
+    elapsed = reference[None, :] * rng.uniform(0.98, 1.05, size=(n_laps, 1))
+    start = time.perf_counter()
+    deltas = lap_time_deltas(elapsed, reference, np.arange(n_points) / n_points, np.array([0, 1 / 3, 2 / 3]))
+    assert time.perf_counter() - start < 0.5
+    assert deltas["sector_deltas"].shape == (n_laps, 3)
+    assert np.allclose(deltas["sector_deltas"].sum(axis=1), deltas["lap_deltas"])
+
+
+if __name__ == "__main__":
+    test_sector_deltas()
+    test_hundreds_of_laps()
+    print("All tests passed")
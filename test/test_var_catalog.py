@@ -0,0 +1,73 @@
+"""
+Test cases for the cached SDK variable catalog
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+sys.path.append(os.getcwd())
+from utils.data_bank import DataBank
+from utils.data_utils import load_irsdk_vars, apply_sdk_types, TYPE_BOOL, TYPE_INT, TYPE_FLOAT, TYPE_DOUBLE
+from logger import SDK_VARS, CHANNELS
+from logger.iRTL import iRacingTelemetryLogger
+from logger.iRTLReplay import ReplaySDK
+
+VAR_FILE = os.path.join(os.getcwd(), "data", "irsdk_vars.txt")
+
+def test_catalog_cache():
+    var_file = os.path.join(tempfile.mkdtemp(), "irsdk_vars.txt")
+    shutil.copy(VAR_FILE, var_file)
+    cache_file = os.path.splitext(var_file)[0] + ".cache.json"
+
+    # The first load builds the cache, the next one reads it
+    catalog = load_irsdk_vars(var_file)
+    with open(cache_file) as f:
+        assert json.load(f)["vars"] == catalog
+    assert load_irsdk_vars(var_file) == catalog
+    assert catalog["Gear"]["type_source"] == "guess"
+    assert catalog["Gear"]["type"] == TYPE_INT
+    assert catalog["SessionTime"]["type"] == TYPE_DOUBLE
+    assert catalog["BrakeABSactive"]["type"] == TYPE_BOOL
+    assert catalog["CarIdxLap"]["count"] == 64
+
+    # Editing the var file invalidates the cache
+    with open(var_file, "a") as f:
+        f.write("\nTestVar                           Added var for testing, m")
+    os.utime(var_file, ns=(os.stat(cache_file).st_mtime_ns + 10**9,) * 2)
+    assert load_irsdk_vars(var_file)["TestVar"]["unit"] == "m"
+
+def test_sdk_types():
+    catalog = load_irsdk_vars(VAR_FILE)
+    catalog["Speed"]["type"] = TYPE_INT     # A wrong guess
+    sdk = ReplaySDK.synthetic(["Speed", "Gear", "OnPitRoad"], duration=1)
+    sdk.startup()
+
+    # Types and counts reported by the SDK replace the guesses, other vars keep theirs
+    assert apply_sdk_types(catalog, sdk) >= 1
+    assert catalog["Speed"]["type"] == TYPE_FLOAT and catalog["Speed"]["type_source"] == "sdk"
+    assert catalog["Gear"]["type"] == sdk._var_headers_dict["Gear"].type == TYPE_INT
+    assert catalog["OnPitRoad"]["type"] == TYPE_BOOL
+    assert catalog["RPM"]["type_source"] == "guess"
+
+def test_shared_catalog():
+    # CHANNELS entries are the catalog's entries, tagged with their category
+    assert CHANNELS["powertrain"]["RPM"] is SDK_VARS["RPM"]
+    assert SDK_VARS["RPM"]["category"] == "powertrain"
+    assert SDK_VARS["CarIdxLap"]["category"] is None
+
+    # Channels passed to the logger are validated against the catalog
+    logger = iRacingTelemetryLogger(DataBank(), ir_sdk=object(), channels=["Speed", "NotAVar"])
+    assert logger.channel_exists("Speed")
+    assert not logger.channel_exists("NotAVar")
+    assert logger.channels == ["Speed", "Lap", "LapDist"]
+
+
+if __name__ == "__main__":
+    test_catalog_cache()
+    test_sdk_types()
+    test_shared_catalog()
+    print("All tests passed")
@@ -18,6 +18,8 @@ class DataBank:
             "is_recording": False,
             "channels": {},
             "live_telemetry": {},
+            "live_monitor_stats": {},
+            "capture_stats": {},
         }
         
         # Add channels to data dictionary
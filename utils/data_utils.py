@@ -4,7 +4,27 @@ Data utilities for iRTL
 Copyright © Kyle Ward 2023
 """
 import os
+import re
 import sys
+import json
+
+# Bump when the catalog entries change, so stale caches are rebuilt
+CATALOG_VERSION = 2
+
+# iRacing SDK var types (see irsdk.VAR_TYPE_MAP = ['c', '?', 'i', 'I', 'f', 'd'])
+TYPE_BOOL, TYPE_INT, TYPE_BITFIELD, TYPE_FLOAT, TYPE_DOUBLE = 1, 2, 3, 4, 5
+
+# Vars the SDK publishes as doubles
+DOUBLE_VARS = {"SessionTime", "SessionTimeRemain", "ReplaySessionTime", "Lat", "Lon"}
+
+# Enum units that are bitfields rather than plain ints
+BITFIELD_UNITS = {"irsdk_CameraState", "irsdk_EngineWarnings"}
+
+# Descriptions of counters and indices, which the SDK publishes as ints
+INT_DESC = re.compile(r"\b(number|count|laps?|position|gear|tick|id|idx)\b")
+
+# Per-car vars are arrays with one entry per car index
+CAR_IDX_COUNT = 64
 
 def parse_irsdk_vars(var_file: str) -> dict:
     """
@@ -49,4 +69,98 @@ def parse_irsdk_vars(var_file: str) -> dict:
         # Add the var to the list
         sdk_vars[varname] = _var
         
-    return sdk_vars
\ No newline at end of file
+    return sdk_vars
+
+
+def var_type(name: str, desc: str, unit: str) -> int:
+    """
+    Best guess of an SDK var's type from its name, description and unit. The var file doesn't
+    list types, so the types reported by a connected SDK take precedence (see apply_sdk_types())
+    """
+    if desc.lower().startswith(("true if", "is ")):
+        return TYPE_BOOL
+    if unit.startswith("irsdk_"):
+        return TYPE_BITFIELD if unit.endswith("Flags") or unit in BITFIELD_UNITS else TYPE_INT
+    if name in DOUBLE_VARS:
+        return TYPE_DOUBLE
+    if not unit and INT_DESC.search(desc.lower()):
+        return TYPE_INT
+    return TYPE_FLOAT
+
+
+def load_irsdk_vars(var_file: str, cache_file: str = None) -> dict:
+    """
+    Load the catalog of iRacing SDK variables, keyed by name
+
+    The catalog is parsed from the var file once and saved to a JSON cache file, which is used
+    until the var file changes (by modification time and size) or the catalog version changes
+
+    A single var item will include:
+        - desc
+        - unit
+        - type (iRacing SDK var type). Guessed by var_type() until a connected SDK reports it (see apply_sdk_types())
+        - type_source ("guess" or "sdk")
+        - count (number of values, e.g. one per car for CarIdx vars)
+        - category (channel category in logger.CHANNELS, None if the var isn't a selectable channel)
+
+    Args:
+        var_file (str): Path to the text file containing the iRacing SDK variables
+        cache_file (str): Path of the cache. Defaults to the var file with a .cache.json extension
+    """
+    cache_file = cache_file or os.path.splitext(var_file)[0] + ".cache.json"
+    try:
+        stat = os.stat(var_file)
+        key = [CATALOG_VERSION, stat.st_mtime_ns, stat.st_size]
+    except OSError:
+        key = None
+
+    # Use the cache if it was built from this version of the var file
+    if key is not None:
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+            if cached["key"] == key:
+                return cached["vars"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    catalog = parse_irsdk_vars(var_file)
+    for name, var in catalog.items():
+        var["type"] = var_type(name, var["desc"], var["unit"])
+        var["type_source"] = "guess"
+        var["count"] = CAR_IDX_COUNT if name.startswith("CarIdx") else 1
+        var["category"] = None
+
+    # The cache is only an optimization, so a read-only data directory isn't an error
+    try:
+        with open(cache_file + ".tmp", "w") as f:
+            json.dump({"key": key, "vars": catalog}, f)
+        os.replace(cache_file + ".tmp", cache_file)
+    except OSError:
+        pass
+    return catalog
+
+
+def apply_sdk_types(catalog: dict, ir_sdk) -> int:
+    """
+    Replace the guessed types and counts of the catalog's vars with the ones in a connected SDK's var headers
+
+    Args:
+        catalog (dict): Catalog from load_irsdk_vars(), updated in place
+        ir_sdk (irsdk.IRSDK): Connected SDK instance
+
+    Returns:
+        int: Number of vars whose type or count was corrected
+    """
+    var_headers = getattr(ir_sdk, "_var_headers_dict", None) or {}
+    corrected = 0
+    for name, var in catalog.items():
+        var_header = var_headers.get(name)
+        if var_header is None:
+            continue
+        if (var["type"], var["count"]) != (var_header.type, var_header.count):
+            corrected += 1
+        var["type"] = var_header.type
+        var["count"] = var_header.count
+        var["type_source"] = "sdk"
+    return corrected
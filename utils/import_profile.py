@@ -0,0 +1,126 @@
+"""
+Import-time profile of the app's startup, for tracking cold start regressions
+
+Runs the app's imports in a fresh interpreter with `python -X importtime`, then reports the
+total import time, the time spent per top-level package and the slowest modules. Packages that
+should only be imported on first use (see LAZY_PACKAGES) are flagged if startup imports them.
+
+Copyright © Kyle Ward 2023
+"""
+import os
+import sys
+import json
+import subprocess
+
+# Packages that the app should only import once a feature needs them
+LAZY_PACKAGES = ["matplotlib", "pandas", "irsdk"]
+
+# Imports the app, then builds the main window if there is a display, and prints the timings as JSON
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import {module}
+timings = {{"import_s": time.perf_counter() - start, "window_s": None}}
+if {window}:
+    try:
+        app = {module}.iRTLApp()
+        app.update()
+        timings["window_s"] = time.perf_counter() - start
+        app.close()
+    except Exception as e:
+        timings["window_error"] = str(e)
+print(json.dumps(timings))
+"""
+
+
+def parse_importtime(output: str) -> list:
+    """
+    Parse the output of `python -X importtime`
+
+    Returns:
+        list: [(module name, self time in us, cumulative time in us, nesting depth), ...] in import order
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def profile_imports(module: str = "app", window: bool = True, top: int = 15) -> dict:
+    """
+    Profile the imports (and first window) of a module in a fresh interpreter
+
+    Args:
+        module (str): Module to import, e.g. "app" or "gui.main_screen"
+        window (bool): Also time building the app window (module must define iRTLApp). Skipped without a display
+        top (int): Number of slowest modules and packages to report
+
+    Returns:
+        dict: Profile report
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT.format(module=module, window=window)],
+                            capture_output=True, text=True, cwd=os.getcwd())
+    if result.returncode != 0:
+        raise Exception(f"profile_imports(): Importing '{module}' failed:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+    modules = parse_importtime(result.stderr)
+    packages = {}
+    for name, self_us, _, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    return {
+        "module": module,
+        **timings,
+        "n_modules": len(modules),
+        "packages_ms": {package: us / 1000 for package, us in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+        "slowest_ms": {name: self_us / 1000 for name, self_us, _, _ in sorted(modules, key=lambda module: -module[1])[:top]},
+        "lazy_imported": [package for package in LAZY_PACKAGES if package in packages],
+    }
+
+
+def print_report(report: dict):
+    """
+    Print a profile report
+    """
+    print(f"Import of '{report['module']}': {report['import_s'] * 1000:.0f} ms ({report['n_modules']} modules)")
+    if report.get("window_s") is not None:
+        print(f"First window: {report['window_s'] * 1000:.0f} ms")
+    elif report.get("window_error"):
+        print(f"First window: not measured ({report['window_error']})")
+
+    print("\nSelf time by package:")
+    for package, ms in report["packages_ms"].items():
+        print(f"  {package:<30} {ms:>8.1f} ms")
+    print("\nSlowest modules:")
+    for name, ms in report["slowest_ms"].items():
+        print(f"  {name:<50} {ms:>8.1f} ms")
+
+    if report["lazy_imported"]:
+        print(f"\nWARNING: Imported at startup but should be imported on first use: {report['lazy_imported']}")
+
+
+def main(argv: list = None):
+    """
+    Profile the app's startup and print the report. Writes the report to a JSON file if a path is given
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Profile the app's import time")
+    parser.add_argument("--profile-imports", action="store_true")
+    parser.add_argument("--module", default="app", help="Module to profile")
+    parser.add_argument("--no-window", action="store_true", help="Only time the imports, not building the window")
+    parser.add_argument("--output", default=None, help="JSON file to write the report to")
+    args = parser.parse_args(argv)
+
+    report = profile_imports(args.module, window=not args.no_window)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"\nReport saved to {args.output}")
+    return report